@@ -0,0 +1,368 @@
+import os
+import struct
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+
+class UnsupportedAudio(Exception):
+    pass
+
+
+class AudioInfo(NamedTuple):
+    format:str
+    codec:str
+    sample_rate:Optional[int]=None
+    channels:Optional[int]=None
+    sample_width:Optional[int]=None
+    duration_ms:Optional[int]=None
+    data_offset:Optional[int]=None
+    data_size:Optional[int]=None
+
+
+MP3_BITRATES={
+    (1,1):[0,32,64,96,128,160,192,224,256,288,320,352,384,416,448],
+    (1,2):[0,32,48,56,64,80,96,112,128,160,192,224,256,320,384],
+    (1,3):[0,32,40,48,56,64,80,96,112,128,160,192,224,256,320],
+    (2,1):[0,32,48,56,64,80,96,112,128,144,160,176,192,224,256],
+    (2,2):[0,8,16,24,32,40,48,56,64,80,96,112,128,144,160],
+    (2,3):[0,8,16,24,32,40,48,56,64,80,96,112,128,144,160],
+}
+MP3_SAMPLE_RATES={1:[44100,48000,32000],2:[22050,24000,16000],25:[11025,12000,8000]}
+AAC_SAMPLE_RATES=[96000,88200,64000,48000,44100,32000,24000,22050,16000,12000,11025,8000,7350]
+
+ASF_HEADER=bytes.fromhex("3026b2758e66cf11a6d900aa0062ce6c")
+ASF_FILE_PROPERTIES=bytes.fromhex("a1dcab8c47a9cf118ee400c00c205365")
+ASF_STREAM_PROPERTIES=bytes.fromhex("9107dcb7b7a9cf118ee600c00c205365")
+ASF_AUDIO_MEDIA=bytes.fromhex("409e69f84d5bcf11a8fd00805f5c442b")
+
+WAVE_FORMAT_PCM=1
+WAVE_FORMAT_EXTENSIBLE=0xFFFE
+
+
+class AudioProbeModel():
+    def __init__(self, scan_bytes:int=64*1024):
+        """
+            identifies an upload from its header bytes and reads sample rate, channels and
+            duration where the container stores them, nothing is decoded
+            scan_bytes : how far to look for the first mp3/adts frame and the last ogg page
+        """
+        self.scan_bytes=scan_bytes
+
+    def probe(self, source:BinaryIO) -> AudioInfo:
+        """
+            raises UnsupportedAudio when no known container or stream header is found
+        """
+        size=source.seek(0, os.SEEK_END)
+        try:
+            head=self._read(source, 0, 64)
+            if head[:4]==b"RIFF" and head[8:12]==b"WAVE":
+                return self._wav(source, size)
+            if head[:4]==b"FORM" and head[8:12] in (b"AIFF",b"AIFC"):
+                return self._aiff(source, size)
+            if head[:4]==b"fLaC":
+                return self._flac(source)
+            if head[:4]==b"OggS":
+                return self._ogg(source, size, head)
+            if head[4:8]==b"ftyp":
+                return self._mp4(source, size)
+            if head[:16]==ASF_HEADER:
+                return self._asf(source)
+            info=self._frames(source, size)
+            if info:
+                return info
+        except UnsupportedAudio:
+            raise
+        except Exception as e:
+            raise UnsupportedAudio(f"Unreadable audio header: {e}")
+        finally:
+            source.seek(0)
+        raise UnsupportedAudio("Unsupported audio format")
+
+    def _read(self, source:BinaryIO, offset:int, length:int) -> bytes:
+        source.seek(offset)
+        return source.read(length)
+
+    def _chunks(self, source:BinaryIO, start:int, end:int, endian:str) -> Iterator[Tuple[bytes,int,int]]:
+        """
+            (id, data offset, data size) of the RIFF/IFF chunks between start and end
+        """
+        offset=start
+        while offset+8<=end:
+            header=self._read(source, offset, 8)
+            if len(header)<8:
+                return
+            chunk_id, chunk_size=struct.unpack(endian+"4sI", header)
+            yield chunk_id, offset+8, chunk_size
+            offset+=8+chunk_size+(chunk_size&1)
+
+    def _wav(self, source:BinaryIO, size:int) -> AudioInfo:
+        fmt=None
+        data=None
+        for chunk_id, offset, chunk_size in self._chunks(source, 12, size, "<"):
+            if chunk_id==b"fmt ":
+                fmt=self._read(source, offset, min(chunk_size, 40))
+            elif chunk_id==b"data":
+                # streaming writers leave the size at 0 or 0xFFFFFFFF, the data then runs to the end
+                data=(offset, chunk_size if 0<chunk_size<=size-offset else size-offset)
+                break
+        if fmt is None:
+            raise UnsupportedAudio("WAV file without fmt chunk")
+        audio_format, channels, sample_rate, byte_rate, _, bits=struct.unpack("<HHIIHH", fmt[:16])
+        if audio_format==WAVE_FORMAT_EXTENSIBLE and len(fmt)>=26:
+            audio_format=struct.unpack("<H", fmt[24:26])[0]
+        codec=f"pcm_s{bits}le" if audio_format==WAVE_FORMAT_PCM else f"wav_0x{audio_format:04x}"
+        duration_ms=int(data[1]*1000/byte_rate) if data and byte_rate else None
+        return AudioInfo("WAV",codec,sample_rate,channels,bits//8 if audio_format==WAVE_FORMAT_PCM else None,duration_ms,*(data or (None,None)))
+
+    def _aiff(self, source:BinaryIO, size:int) -> AudioInfo:
+        compressed=self._read(source, 8, 4)==b"AIFC"
+        for chunk_id, offset, _ in self._chunks(source, 12, size, ">"):
+            if chunk_id==b"COMM":
+                comm=self._read(source, offset, 22)
+                channels, frames, bits=struct.unpack(">hIh", comm[:8])
+                sample_rate=self._extended(comm[8:18])
+                codec=comm[18:22].decode("latin-1") if compressed else f"pcm_s{bits}be"
+                duration_ms=int(frames*1000/sample_rate) if sample_rate else None
+                return AudioInfo("AIFF",codec,int(sample_rate),channels,bits//8,duration_ms)
+        raise UnsupportedAudio("AIFF file without COMM chunk")
+
+    @staticmethod
+    def _extended(data:bytes) -> float:
+        """
+            80 bit IEEE extended float, how AIFF stores its sample rate
+        """
+        exponent, mantissa=struct.unpack(">HQ", data)
+        if not exponent and not mantissa:
+            return 0.0
+        sign=-1 if exponent&0x8000 else 1
+        return sign*mantissa*2.0**((exponent&0x7FFF)-16383-63)
+
+    def _flac(self, source:BinaryIO) -> AudioInfo:
+        header=self._read(source, 4, 4+34)
+        if header[0]&0x7F!=0:
+            raise UnsupportedAudio("FLAC file without STREAMINFO")
+        info=int.from_bytes(header[4+10:4+18], "big")
+        sample_rate=info>>44
+        channels=((info>>41)&0x7)+1
+        bits=((info>>36)&0x1F)+1
+        samples=info&0xFFFFFFFFF
+        duration_ms=int(samples*1000/sample_rate) if samples and sample_rate else None
+        return AudioInfo("FLAC","flac",sample_rate,channels,(bits+7)//8,duration_ms)
+
+    def _ogg(self, source:BinaryIO, size:int, head:bytes) -> AudioInfo:
+        segments=head[26]
+        packet=self._read(source, 27+segments, 32)
+        if packet[:7]==b"\x01vorbis":
+            channels=packet[11]
+            sample_rate, =struct.unpack("<I", packet[12:16])
+            codec, clock, skip="vorbis", sample_rate, 0
+        elif packet[:8]==b"OpusHead":
+            channels=packet[9]
+            skip, sample_rate=struct.unpack("<HI", packet[10:16])
+            # opus granule positions always count 48 kHz samples
+            codec, clock=("opus", 48000)
+        elif packet[:5]==b"\x7fFLAC":
+            info=int.from_bytes(packet[27:35], "big")
+            sample_rate, channels=info>>44, ((info>>41)&0x7)+1
+            codec, clock, skip="flac", sample_rate, 0
+        else:
+            return AudioInfo("OGG","unknown")
+
+        # the last page's granule position is the stream length in samples
+        tail_start=max(0, size-self.scan_bytes)
+        tail=self._read(source, tail_start, size-tail_start)
+        last=tail.rfind(b"OggS")
+        duration_ms=None
+        if last>=0 and len(tail)>=last+14 and clock:
+            granule, =struct.unpack("<q", tail[last+6:last+14])
+            if granule>0:
+                duration_ms=int(max(granule-skip, 0)*1000/clock)
+        return AudioInfo("OGG",codec,sample_rate,channels,None,duration_ms)
+
+    def _boxes(self, source:BinaryIO, start:int, end:int) -> Iterator[Tuple[bytes,int,int]]:
+        """
+            (type, payload offset, box end) of the ISO BMFF boxes between start and end
+        """
+        offset=start
+        while offset+8<=end:
+            header=self._read(source, offset, 16)
+            box_size, box_type=struct.unpack(">I4s", header[:8])
+            payload=offset+8
+            if box_size==1:
+                box_size, =struct.unpack(">Q", header[8:16])
+                payload=offset+16
+            elif box_size==0:
+                box_size=end-offset
+            if box_size<8:
+                return
+            yield box_type, payload, min(offset+box_size, end)
+            offset+=box_size
+
+    def _child(self, source:BinaryIO, start:int, end:int, path:Tuple[bytes,...]) -> Optional[Tuple[int,int]]:
+        for box_type, payload, box_end in self._boxes(source, start, end):
+            if box_type==path[0]:
+                return (payload, box_end) if len(path)==1 else self._child(source, payload, box_end, path[1:])
+        return None
+
+    def _mp4(self, source:BinaryIO, size:int) -> AudioInfo:
+        moov=self._child(source, 0, size, (b"moov",))
+        if moov is None:
+            raise UnsupportedAudio("MP4 file without moov box")
+        for box_type, payload, box_end in self._boxes(source, *moov):
+            if box_type!=b"trak":
+                continue
+            handler=self._child(source, payload, box_end, (b"mdia",b"hdlr"))
+            if handler is None or self._read(source, handler[0]+8, 4)!=b"soun":
+                continue
+            duration_ms=None
+            mdhd=self._child(source, payload, box_end, (b"mdia",b"mdhd"))
+            if mdhd:
+                version=self._read(source, mdhd[0], 1)[0]
+                if version==1:
+                    timescale, duration=struct.unpack(">IQ", self._read(source, mdhd[0]+20, 12))
+                else:
+                    timescale, duration=struct.unpack(">II", self._read(source, mdhd[0]+12, 8))
+                duration_ms=int(duration*1000/timescale) if timescale else None
+            stsd=self._child(source, payload, box_end, (b"mdia",b"minf",b"stbl",b"stsd"))
+            if stsd is None:
+                continue
+            entry=self._read(source, stsd[0]+8, 36)
+            entry_type=entry[4:8]
+            channels, bits=struct.unpack(">HH", entry[24:28])
+            sample_rate=struct.unpack(">I", entry[32:36])[0]>>16
+            if entry_type==b"alac":
+                return AudioInfo("ALAC","alac",sample_rate,channels,bits//8,duration_ms)
+            if entry_type==b"mp4a":
+                return AudioInfo("AAC","aac",sample_rate,channels,None,duration_ms)
+            raise UnsupportedAudio(f"Unsupported MP4 audio codec {entry_type.decode('latin-1')}")
+        raise UnsupportedAudio("MP4 file without an audio track")
+
+    def _asf(self, source:BinaryIO) -> AudioInfo:
+        header_size, count=struct.unpack("<QI", self._read(source, 16, 12))
+        offset=30
+        duration_ms=None
+        sample_rate=channels=bits=None
+        for _ in range(count):
+            object_id=self._read(source, offset, 24)
+            object_size, =struct.unpack("<Q", object_id[16:24])
+            if object_id[:16]==ASF_FILE_PROPERTIES:
+                play_duration, _, preroll=struct.unpack("<QQQ", self._read(source, offset+24+40, 24))
+                duration_ms=max(play_duration//10000-preroll, 0)
+            elif object_id[:16]==ASF_STREAM_PROPERTIES and sample_rate is None:
+                properties=self._read(source, offset+24, 54+16)
+                if properties[:16]==ASF_AUDIO_MEDIA:
+                    _, channels, sample_rate, _, _, bits=struct.unpack("<HHIIHH", properties[54:70])
+            if object_size<24:
+                break
+            offset+=object_size
+            if offset>=header_size:
+                break
+        if sample_rate is None:
+            raise UnsupportedAudio("ASF file without an audio stream")
+        return AudioInfo("WMA","wma",sample_rate,channels,bits//8 if bits else None,duration_ms)
+
+    def _frames(self, source:BinaryIO, size:int) -> Optional[AudioInfo]:
+        """
+            raw mp3 or adts aac, skips an id3v2 tag and looks for the first frame header
+        """
+        start=0
+        tag=self._read(source, 0, 10)
+        if tag[:3]==b"ID3":
+            start=10+((tag[6]&0x7F)<<21|(tag[7]&0x7F)<<14|(tag[8]&0x7F)<<7|(tag[9]&0x7F))
+        data=self._read(source, start, self.scan_bytes)
+        stream_size=size-start
+        position=data.find(b"\xff")
+        while 0<=position<len(data)-10:
+            found=self._frame(data, position, stream_size)
+            if found and self._followed(data, position, found, stream_size):
+                info=found[0]
+                if info.format=="AAC":
+                    info=info._replace(duration_ms=self._adtsDuration(data, position, stream_size, info.sample_rate))
+                return info
+            position=data.find(b"\xff", position+1)
+        return None
+
+    def _frame(self, data:bytes, position:int, stream_size:int) -> Optional[Tuple[AudioInfo,int]]:
+        if len(data)<position+10 or data[position]!=0xFF or data[position+1]&0xE0!=0xE0:
+            return None
+        if data[position+1]&0x06==0:
+            return self._adts(data, position, stream_size-position)
+        return self._mp3(data, position, stream_size-position)
+
+    def _followed(self, data:bytes, position:int, first:Tuple[AudioInfo,int], stream_size:int, frames:int=3) -> bool:
+        """
+            a lone sync word is common in random bytes, the next frames have to follow it and
+            carry the same codec, sample rate and channel layout
+        """
+        frame_length=first[1]
+        for _ in range(frames):
+            position+=frame_length
+            # a short stream ends on a frame boundary or an id3v1 tag, not inside a frame
+            if position==stream_size or data[position:position+3]==b"TAG":
+                return True
+            if position+10>len(data):
+                return False
+            found=self._frame(data, position, stream_size)
+            if not found or found[0][1:4]!=first[0][1:4]:
+                return False
+            frame_length=found[1]
+        return True
+
+    def _adtsDuration(self, data:bytes, position:int, stream_size:int, sample_rate:int) -> int:
+        """
+            adts has no length field, estimated from the average frame size of the scanned bytes
+        """
+        start=position
+        frames=0
+        while True:
+            found=self._frame(data, position, stream_size)
+            if not found:
+                break
+            frames+=1
+            position+=found[1]
+        return int((stream_size-start)/((position-start)/frames)*1024*1000/sample_rate)
+
+    def _adts(self, data:bytes, position:int, stream_size:int) -> Optional[Tuple[AudioInfo,int]]:
+        header=data[position:position+7]
+        if header[1]&0xF6!=0xF0:
+            return None
+        rate_index=(header[2]>>2)&0xF
+        if rate_index>=len(AAC_SAMPLE_RATES):
+            return None
+        sample_rate=AAC_SAMPLE_RATES[rate_index]
+        channels=((header[2]&1)<<2)|(header[3]>>6)
+        frame_length=((header[3]&3)<<11)|(header[4]<<3)|(header[5]>>5)
+        if frame_length<7:
+            return None
+        duration_ms=int(stream_size/frame_length*1024*1000/sample_rate)
+        return AudioInfo("AAC","aac",sample_rate,channels or None,None,duration_ms), frame_length
+
+    def _mp3(self, data:bytes, position:int, stream_size:int) -> Optional[Tuple[AudioInfo,int]]:
+        header=int.from_bytes(data[position:position+4], "big")
+        version={3:1,2:2,0:25}.get((header>>19)&3)
+        layer={3:1,2:2,1:3}.get((header>>17)&3)
+        bitrate_index=(header>>12)&0xF
+        rate_index=(header>>10)&3
+        if version is None or layer is None or bitrate_index in (0,15) or rate_index==3:
+            return None
+        bitrate=MP3_BITRATES[(1 if version==1 else 2, layer)][bitrate_index]*1000
+        sample_rate=MP3_SAMPLE_RATES[version][rate_index]
+        channels=1 if (header>>6)&3==3 else 2
+        samples_per_frame=384 if layer==1 else 1152 if layer==2 or version==1 else 576
+        padding=(header>>9)&1
+        frame_length=(12*bitrate//sample_rate+padding)*4 if layer==1 else samples_per_frame//8*bitrate//sample_rate+padding
+
+        # vbr files carry their frame count in a Xing/Info or VBRI header in the first frame
+        frames=None
+        side_info=(32 if channels==2 else 17) if version==1 else (17 if channels==2 else 9)
+        xing=position+4+side_info
+        if data[xing:xing+4] in (b"Xing",b"Info"):
+            flags, =struct.unpack(">I", data[xing+4:xing+8])
+            if flags&1:
+                frames, =struct.unpack(">I", data[xing+8:xing+12])
+        elif data[position+36:position+40]==b"VBRI":
+            frames, =struct.unpack(">I", data[position+36+14:position+36+18])
+        if frames:
+            duration_ms=int(frames*samples_per_frame*1000/sample_rate)
+        else:
+            duration_ms=int(stream_size*8*1000/bitrate)
+        return AudioInfo("MP3",f"mp{layer}",sample_rate,channels,None,duration_ms), frame_length
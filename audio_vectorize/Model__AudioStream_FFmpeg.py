@@ -0,0 +1,265 @@
+import math
+import os
+import shutil
+import subprocess
+import threading
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional
+
+from audio_vectorize.Model__AudioProbe_Headers import AudioInfo, AudioProbeModel, UnsupportedAudio
+from audio_vectorize.Model__Metrics_Prometheus import StageTimer
+from audio_vectorize.Model__SilenceDetection_NumPy import SilenceDetectionModel
+
+
+class PCMChunk(NamedTuple):
+    index:int
+    start_ms:int
+    end_ms:int
+    data:bytes
+
+
+class AudioStreamModel():
+    def __init__(self, sample_rate:int=16000, channels:int=1, window_ms:int=30000, min_silence_len:int=1000, silence_offset:float=-14, keep_silence:int=500, max_chunk_ms:int=60000):
+        """
+            decodes audio through ffmpeg in windows of raw PCM and splits it on silence as it arrives,
+            memory stays around window_ms + max_chunk_ms of audio whatever the length of the book
+        """
+        self.sample_rate=sample_rate
+        self.channels=channels
+        self.sample_width=2
+        self.window_ms=window_ms
+        self.min_silence_len=min_silence_len
+        self.silence_offset=silence_offset
+        self.keep_silence=keep_silence
+        self.max_chunk_ms=max_chunk_ms
+        self.silence=SilenceDetectionModel(sample_rate,channels,self.sample_width)
+        self.probe=AudioProbeModel()
+
+    @property
+    def bytes_per_ms(self) -> int:
+        return self.sample_rate*self.sample_width*self.channels//1000
+
+    def isNativePCM(self, info:AudioInfo) -> bool:
+        """
+            wav that is already s16le at the target rate and channel count, decoding it is a copy
+        """
+        return info.format=="WAV" and info.codec=="pcm_s16le" and info.sample_rate==self.sample_rate and info.channels==self.channels and info.data_offset is not None
+
+    def decode(self, source:BinaryIO, start_ms:int=0) -> Iterator[bytes]:
+        """
+            yields raw s16le PCM windows from start_ms on, reads from the file path when there is one,
+            else pipes the stream
+        """
+        try:
+            info=self.probe.probe(source)
+        except UnsupportedAudio:
+            info=None
+        timer=StageTimer("decode")
+        if info and self.isNativePCM(info):
+            try:
+                yield from self._readPCM(source, info, timer, start_ms)
+            finally:
+                timer.observe()
+            return
+
+        path=getattr(source,"name",None)
+        use_path=isinstance(path,str) and os.path.isfile(path)
+        # input seeking, a file on disk is seeked into, a pipe is decoded up to start_ms and discarded
+        seek=["-ss",f"{start_ms/1000:.3f}"] if start_ms else []
+        command=["ffmpeg","-hide_banner","-loglevel","error",*seek,"-i",path if use_path else "pipe:0",
+                 "-vn","-f","s16le","-acodec","pcm_s16le","-ac",str(self.channels),"-ar",str(self.sample_rate),"pipe:1"]
+        process=subprocess.Popen(command,stdin=subprocess.DEVNULL if use_path else subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+
+        writer=None
+        if not use_path:
+            source.seek(0)
+            writer=threading.Thread(target=self._feed,args=(source,process.stdin),daemon=True)
+            writer.start()
+
+        window_bytes=self.window_ms*self.bytes_per_ms
+        try:
+            while True:
+                with timer.step():
+                    window=process.stdout.read(window_bytes)
+                if not window:
+                    break
+                yield window
+            process.wait()
+            if process.returncode!=0:
+                raise Exception({"Error":process.stderr.read().decode(errors="replace"),"details":"Error in decoding audio"})
+        finally:
+            timer.observe()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            if writer:
+                writer.join()
+            process.stdout.close()
+            process.stderr.close()
+
+    def _readPCM(self, source:BinaryIO, info:AudioInfo, timer:StageTimer, start_ms:int=0) -> Iterator[bytes]:
+        """
+            windows straight from the data chunk, no ffmpeg process
+        """
+        window_bytes=self.window_ms*self.bytes_per_ms
+        frame_bytes=self.sample_width*self.channels
+        skip=min(start_ms*self.bytes_per_ms, info.data_size)
+        remaining=info.data_size-skip
+        remaining-=remaining%frame_bytes
+        source.seek(info.data_offset+skip)
+        while remaining:
+            with timer.step():
+                window=source.read(min(window_bytes, remaining))
+            if not window:
+                break
+            remaining-=len(window)
+            yield window
+
+    def _feed(self, source:BinaryIO, stdin):
+        try:
+            shutil.copyfileobj(source, stdin, 1024*1024)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def dBFS(self, source:BinaryIO) -> float:
+        """
+            loudness of the whole decoded file, same as AudioSegment.dBFS, from a first pass over
+            its PCM windows that keeps only a running sum of squares
+        """
+        square_sum=0.0
+        sample_count=0
+        timer=StageTimer("loudness")
+        try:
+            for window in self.decode(source):
+                with timer.step():
+                    samples=self.silence.samples(window)
+                    square_sum+=self.silence.squareSum(samples)
+                sample_count+=len(samples)
+        finally:
+            timer.observe()
+        if not sample_count:
+            return -math.inf
+        rms=int(math.sqrt(square_sum/sample_count))
+        if not rms:
+            return -math.inf
+        return 20*math.log10(rms/self.silence.max_possible_amplitude)
+
+    def chunks(self, source:BinaryIO, start_ms:int=0, first_index:int=0) -> Iterator[PCMChunk]:
+        """
+            split_on_silence chunks with pydub's threshold, the whole file's dBFS + silence_offset.
+            start_ms and first_index resume a file part way, chunk times stay relative to its start.
+            Nothing is read before the first chunk is asked for
+        """
+        silence_thresh=self.dBFS(source)+self.silence_offset
+        yield from self.split(self.decode(source, start_ms), start_ms, first_index, silence_thresh)
+
+    def split(self, windows:Iterable[bytes], start_ms:int=0, first_index:int=0, silence_thresh:Optional[float]=None) -> Iterator[PCMChunk]:
+        """
+            incremental split_on_silence over PCM windows, a chunk is emitted as soon as the silence
+            after it has been seen. Without silence_thresh the threshold follows the loudness of the
+            audio split so far (running dBFS + silence_offset), chunks then differ from pydub's
+        """
+        timer=StageTimer("silence_split")
+        try:
+            yield from self._split(windows, timer, start_ms, first_index, silence_thresh)
+        finally:
+            timer.observe()
+
+    def _split(self, windows:Iterable[bytes], timer:StageTimer, start_ms:int=0, first_index:int=0, silence_thresh:Optional[float]=None) -> Iterator[PCMChunk]:
+        bytes_per_ms=self.bytes_per_ms
+        keep=self.keep_silence
+        buffer=bytearray()
+        buffer_start=start_ms   # absolute ms of buffer[0]
+        min_start=start_ms      # absolute ms where the next chunk may start
+        square_sum=0.0
+        sample_count=0
+        index=first_index
+
+        def threshold() -> float:
+            if silence_thresh is not None:
+                return silence_thresh
+            if not square_sum:
+                return -math.inf
+            rms=int(math.sqrt(square_sum/sample_count))
+            if not rms:
+                return -math.inf
+            return 20*math.log10(rms/self.silence.max_possible_amplitude)+self.silence_offset
+
+        def nonsilent():
+            with timer.step():
+                samples=self.silence.samples(buffer)
+                return self.silence.lengthMs(samples), self.silence.detectNonsilent(samples,self.min_silence_len,threshold(),1)
+
+        def cut(start:int, end:int) -> Iterator[PCMChunk]:
+            nonlocal index
+            for piece_start in range(start,end,self.max_chunk_ms):
+                piece_end=min(piece_start+self.max_chunk_ms,end)
+                yield PCMChunk(index,piece_start,piece_end,bytes(buffer[(piece_start-buffer_start)*bytes_per_ms:(piece_end-buffer_start)*bytes_per_ms]))
+                index+=1
+
+        for window in windows:
+            window=window[:len(window)-len(window)%(self.sample_width*self.channels)]
+            if not window:
+                continue
+            buffer+=window
+            if silence_thresh is None:
+                with timer.step():
+                    window_samples=self.silence.samples(window)
+                    square_sum+=self.silence.squareSum(window_samples)
+                sample_count+=len(window_samples)
+
+            buffer_ms,ranges=nonsilent()
+
+            # ranges that stop before the end of the buffer are followed by enough silence to be final
+            pending_start=None
+            silence_start=buffer_start
+            for position,(start,end) in enumerate(ranges):
+                start+=buffer_start
+                end+=buffer_start
+                next_start=ranges[position+1][0]+buffer_start if position+1<len(ranges) else None
+                if end>=buffer_start+buffer_ms or (next_start is None and end+keep*2>buffer_start+buffer_ms):
+                    pending_start=start
+                    break
+                chunk_end=end+keep
+                if next_start is not None and next_start-keep<chunk_end:
+                    chunk_end=(chunk_end+next_start-keep)//2
+                yield from cut(max(start-keep,min_start),chunk_end)
+                min_start=chunk_end
+                silence_start=end
+
+            while pending_start is not None and buffer_start+buffer_ms-max(pending_start-keep,min_start)>self.max_chunk_ms:
+                # no silence long enough, force a cut so memory stays bounded
+                chunk_start=max(pending_start-keep,min_start)
+                yield from cut(chunk_start,chunk_start+self.max_chunk_ms)
+                min_start=chunk_start+self.max_chunk_ms
+                silence_start=min_start
+                pending_start=min_start
+
+            # keep enough leading silence for the next range to be detected the same way
+            lead=max(keep,self.min_silence_len)
+            if pending_start is not None:
+                trim_to=max(silence_start,pending_start-lead)
+            else:
+                trim_to=max(silence_start,buffer_start+buffer_ms-lead)
+            trim_to=max(buffer_start,min(trim_to,buffer_start+buffer_ms))
+            del buffer[:(trim_to-buffer_start)*bytes_per_ms]
+            buffer_start=trim_to
+            min_start=max(min_start,buffer_start)
+
+        # end of stream, everything left is final
+        if buffer:
+            buffer_ms,ranges=nonsilent()
+            for position,(start,end) in enumerate(ranges):
+                start+=buffer_start
+                end+=buffer_start
+                chunk_end=min(end+keep,buffer_start+buffer_ms)
+                if position+1<len(ranges) and ranges[position+1][0]+buffer_start-keep<chunk_end:
+                    chunk_end=(chunk_end+ranges[position+1][0]+buffer_start-keep)//2
+                chunk_start=max(start-keep,min_start)
+                if chunk_end>chunk_start:
+                    yield from cut(chunk_start,chunk_end)
+                    min_start=chunk_end
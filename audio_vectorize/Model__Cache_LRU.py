@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCacheModel():
+    def __init__(self, max_entries:int=1024, ttl_seconds:Optional[float]=None):
+        """
+            in-process least recently used cache, entries optionally expire after ttl_seconds
+        """
+        self.max_entries=max_entries
+        self.ttl_seconds=ttl_seconds
+        self.entries:OrderedDict[Hashable,tuple]=OrderedDict()
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1]<time.monotonic()):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses+=1
+                return default
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return entry[0]
+
+    def put(self, key:Hashable, value:Any):
+        expires_at=time.monotonic()+self.ttl_seconds if self.ttl_seconds else None
+        with self.lock:
+            self.entries[key]=(value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions+=1
+
+    def getOrLoad(self, key:Hashable, load:Callable[[],Any]) -> Any:
+        missing=object()
+        value=self.get(key, missing)
+        if value is missing:
+            value=load()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, predicate:Optional[Callable[[Hashable],bool]]=None):
+        """
+            drops every entry, or only the ones whose key matches predicate
+        """
+        with self.lock:
+            if predicate is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def stats(self) -> dict:
+        lookups=self.hits+self.misses
+        return {"hits":self.hits,"misses":self.misses,"hit_rate":self.hits/lookups if lookups else 0.0,"evictions":self.evictions,"entries":len(self.entries),"max_entries":self.max_entries}
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+logger=logging.getLogger(__name__)
+
+
+class LazyComponent():
+    """
+        stands in for an object that is expensive to build, builds it on first attribute access,
+        a failed build is retried on the next access, own attributes are underscored so they never
+        shadow the wrapped object's
+    """
+    def __init__(self, name:str, factory:Callable[[],Any]):
+        self._name=name
+        self._factory=factory
+        self._instance=None
+        self._error:Optional[str]=None
+        self._seconds:Optional[float]=None
+        self._lock=threading.Lock()
+
+    def _load(self) -> Any:
+        if self._instance is not None:
+            return self._instance
+        with self._lock:
+            if self._instance is None:
+                logger.info("Loading %s", self._name)
+                start=time.perf_counter()
+                try:
+                    instance=self._factory()
+                except Exception as e:
+                    self._error=str(e)
+                    raise
+                self._seconds=time.perf_counter()-start
+                self._error=None
+                self._instance=instance
+                logger.info("Loaded %s in %.2f s", self._name, self._seconds)
+        return self._instance
+
+    def __getattr__(self, attribute:str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return f"LazyComponent({self._name}, {'warm' if self._instance is not None else 'cold'})"
+
+
+class ComponentRegistryModel():
+    def __init__(self):
+        """
+            the lazily built components of the service, warmed up in the background after startup
+            so the first request does not pay for them, and reported on by the readiness probe
+        """
+        self.components:Dict[str,LazyComponent]={}
+        self.warming:Dict[str,threading.Thread]={}
+
+    def register(self, name:str, factory:Callable[[],Any]) -> LazyComponent:
+        component=LazyComponent(name, factory)
+        self.components[name]=component
+        return component
+
+    def names(self) -> List[str]:
+        return list(self.components)
+
+    def loaded(self, name:str) -> Optional[Any]:
+        """
+            the built object, None while cold, never triggers a build
+        """
+        return self.components[name]._instance
+
+    async def loadAsync(self, names:List[str]):
+        """
+            builds the cold ones of the named components in worker threads, so an async caller
+            never blocks the event loop on a connection or a model load, raises the first failure
+        """
+        cold=[self.components[name] for name in names if self.components[name]._instance is None]
+        if cold:
+            await asyncio.gather(*(asyncio.to_thread(component._load) for component in cold))
+
+    def warmUp(self, names:Optional[List[str]]=None):
+        """
+            builds every component in its own daemon thread, failures are logged and left cold
+        """
+        for name in names or self.names():
+            component=self.components[name]
+            if component._instance is not None or (name in self.warming and self.warming[name].is_alive()):
+                continue
+            thread=threading.Thread(target=self._warm, args=(component,), name=f"warmup-{name}", daemon=True)
+            self.warming[name]=thread
+            thread.start()
+
+    def _warm(self, component:LazyComponent):
+        try:
+            component._load()
+        except Exception as e:
+            logger.error("Warm up of %s failed: %s", component._name, e)
+
+    def status(self) -> Dict[str,dict]:
+        status={}
+        for name, component in self.components.items():
+            if component._instance is not None:
+                status[name]={"state":"warm","seconds":round(component._seconds,3)}
+            elif name in self.warming and self.warming[name].is_alive():
+                status[name]={"state":"warming"}
+            elif component._error is not None:
+                status[name]={"state":"failed","error":component._error}
+            else:
+                status[name]={"state":"cold"}
+        return status
+
+    def ready(self, names:List[str]) -> bool:
+        return all(self.components[name]._instance is not None for name in names)
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import List, Optional, Set
+
+
+logger=logging.getLogger(__name__)
+
+
+class DeletionModel():
+    def __init__(self, files_database, vector_database, local_index=None, retry_seconds:float=60, batch_size:int=100):
+        """
+            second half of a delete. The files database removes its rows and writes a tombstone in
+            one transaction, apply() then drops or deletes the matching vectors and clears the
+            tombstone. A tombstone whose vector side failed stays and is retried every retry_seconds
+        """
+        self.files_database=files_database
+        self.vector_database=vector_database
+        self.local_index=local_index
+        self.retry_seconds=retry_seconds
+        self.batch_size=batch_size
+        self.running:Set[str]=set()
+        self.lock=threading.Lock()
+        self.task:Optional[asyncio.Task]=None
+
+    def apply(self, deletion) -> bool:
+        """
+            one vector store call per target, True once the tombstone is cleared
+        """
+        deletion_id=str(deletion.id)
+        with self.lock:
+            if deletion_id in self.running:
+                return False
+            self.running.add(deletion_id)
+        try:
+            for target in json.loads(deletion.targets):
+                database=target["database"]
+                collection=target.get("collection")
+                if target.get("file_ids") is not None:
+                    self.vector_database.Delete_Files(target["file_ids"],database,collection)
+                elif collection is not None:
+                    self.vector_database.Drop_Collection(database,collection)
+                else:
+                    self.vector_database.Drop_Database(database,target.get("collections",[]))
+                if self.local_index and target.get("file_ids") is None:
+                    self.local_index.drop(database,collection)
+            self.files_database.finishDeletion(deletion.id)
+            logger.info("Deletion %s of %s %s finished", deletion_id, deletion.kind, deletion.target_id)
+            return True
+        except Exception as e:
+            logger.warning("Deletion %s of %s %s failed, will retry: %s", deletion_id, deletion.kind, deletion.target_id, e)
+            try:
+                self.files_database.failDeletion(deletion.id,str(e))
+            except Exception as error:
+                logger.error("Could not record failed deletion %s: %s", deletion_id, error)
+            return False
+        finally:
+            with self.lock:
+                self.running.discard(deletion_id)
+
+    def retry(self) -> int:
+        """
+            applies every pending tombstone, returns how many were cleared
+        """
+        deletions:List=self.files_database.getDeletions(self.batch_size)
+        return sum(self.apply(deletion) for deletion in deletions)
+
+    def start(self):
+        self.task=asyncio.create_task(self._retryLoop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task=None
+
+    async def _retryLoop(self):
+        while True:
+            await asyncio.sleep(self.retry_seconds)
+            try:
+                cleared=await asyncio.to_thread(self.retry)
+                if cleared:
+                    logger.info("Cleared %s pending deletions", cleared)
+            except Exception as e:
+                logger.warning("Retrying pending deletions failed: %s", e)
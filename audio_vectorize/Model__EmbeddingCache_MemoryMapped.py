@@ -0,0 +1,145 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class EmbeddingCacheModel():
+    def __init__(self, directory:str, growth_rows:int=4096):
+        """
+            vectors keyed by (model name, text hash), one memory-mapped float32 matrix per model.
+            Rows are appended, the key -> row index is an append-only text file next to it.
+            Several processes can share a directory, writers take a file lock and allocate rows
+            after reading what the others appended
+        """
+        self.directory=directory
+        self.growth_rows=growth_rows
+        self.lock=threading.Lock()
+        self.stores:Dict[str,dict]={}
+        self.hits=0
+        self.misses=0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def textHash(text:str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _store(self, model_name:str, dimension:Optional[int]=None) -> Optional[dict]:
+        store=self.stores.get(model_name)
+        if store:
+            return store
+
+        path=os.path.join(self.directory, hashlib.sha1(model_name.encode()).hexdigest()[:16])
+        meta_path=os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta:
+                dimension=json.load(meta)["dimension"]
+        elif dimension is None:
+            return None
+        else:
+            os.makedirs(path, exist_ok=True)
+            # renamed into place, another process never reads it half written
+            temporary=f"{meta_path}.{os.getpid()}"
+            with open(temporary, "w") as meta:
+                json.dump({"model_name":model_name,"dimension":dimension}, meta)
+            os.replace(temporary, meta_path)
+
+        keys_path=os.path.join(path, "keys.txt")
+        vectors_path=os.path.join(path, "vectors.f32")
+        open(vectors_path, "ab").close()
+        store={"dimension":dimension,"rows":{},"next_row":0,"keys_path":keys_path,"keys_offset":0,"vectors_path":vectors_path,"keys":open(keys_path, "a"),"lock":open(os.path.join(path, "lock"), "a"),"matrix":None,"capacity":0}
+        self._refresh(store)
+        self.stores[model_name]=store
+        return store
+
+    def _refresh(self, store:dict):
+        """
+            reads the keys appended since the last look, by this or another process. Only whole lines
+            count, a line is written once its vector is on disk
+        """
+        size=os.path.getsize(store["keys_path"])
+        if size>store["keys_offset"]:
+            with open(store["keys_path"], "rb") as keys:
+                keys.seek(store["keys_offset"])
+                data=keys.read(size-store["keys_offset"])
+            end=data.rfind(b"\n")+1
+            for line in data[:end].decode().splitlines():
+                key, _, row=line.partition("\t")
+                if row:
+                    store["rows"][key]=int(row)
+                    store["next_row"]=max(store["next_row"], int(row)+1)
+            store["keys_offset"]+=end
+        if store["matrix"] is None or store["next_row"]>store["capacity"]:
+            self._map(store, max(store["next_row"], os.path.getsize(store["vectors_path"])//(4*store["dimension"])))
+
+    def _map(self, store:dict, capacity:int):
+        if store["matrix"] is not None:
+            store["matrix"].flush()
+            store["matrix"]=None
+        if capacity==0:
+            return
+        size=capacity*store["dimension"]*4
+        if os.path.getsize(store["vectors_path"])<size:
+            with open(store["vectors_path"], "r+b") as vectors:
+                vectors.truncate(size)
+        store["matrix"]=np.memmap(store["vectors_path"], dtype=np.float32, mode="r+", shape=(capacity, store["dimension"]))
+        store["capacity"]=capacity
+
+    def getMany(self, model_name:str, hashes:Sequence[str]) -> List[Optional[np.ndarray]]:
+        with self.lock:
+            store=self._store(model_name)
+            if store:
+                self._refresh(store)
+            found:List[Optional[np.ndarray]]=[]
+            for key in hashes:
+                row=store["rows"].get(key) if store else None
+                found.append(None if row is None else np.array(store["matrix"][row]))
+            hits=sum(vector is not None for vector in found)
+            self.hits+=hits
+            self.misses+=len(found)-hits
+            return found
+
+    def putMany(self, model_name:str, hashes:Sequence[str], vectors:Sequence[Sequence[float]]):
+        if not hashes:
+            return
+        with self.lock:
+            store=self._store(model_name, len(vectors[0]))
+            fcntl.flock(store["lock"], fcntl.LOCK_EX)
+            try:
+                # rows other processes took since the last look are not handed out again
+                self._refresh(store)
+                new=list({key:vector for key, vector in zip(hashes, vectors) if key not in store["rows"]}.items())
+                if not new:
+                    return
+                first=store["next_row"]
+                if first+len(new)>store["capacity"]:
+                    self._map(store, first+len(new)+self.growth_rows)
+                store["matrix"][first:first+len(new)]=np.asarray([vector for _, vector in new], dtype=np.float32)
+                store["matrix"].flush()
+                # rows are only visible once their vectors are on disk
+                store["keys"].write("".join(f"{key}\t{first+offset}\n" for offset, (key, _) in enumerate(new)))
+                store["keys"].flush()
+                for offset, (key, _) in enumerate(new):
+                    store["rows"][key]=first+offset
+                store["next_row"]=first+len(new)
+                store["keys_offset"]=os.path.getsize(store["keys_path"])
+            finally:
+                fcntl.flock(store["lock"], fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        lookups=self.hits+self.misses
+        with self.lock:
+            entries={model_name:len(store["rows"]) for model_name, store in self.stores.items()}
+        return {"hits":self.hits,"misses":self.misses,"hit_rate":self.hits/lookups if lookups else 0.0,"entries":entries}
+
+    def close(self):
+        with self.lock:
+            for store in self.stores.values():
+                self._map(store, 0)
+                store["keys"].close()
+                store["lock"].close()
+            self.stores={}
@@ -0,0 +1,241 @@
+"""
+    one process owns the embedding model and serves every API worker over a unix socket
+
+    python -m audio_vectorize.Model__EmbeddingServer_Socket
+    uvicorn audio_vectorize.main:app --workers 4   # with EMBEDDING_SERVER_ADDRESS set
+"""
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from langchain_core.embeddings import Embeddings
+
+from audio_vectorize.Model__Metrics_Prometheus import timed
+
+
+logger=logging.getLogger(__name__)
+
+DEFAULT_ADDRESS="/tmp/audio_vectorize_embeddings.sock"
+
+
+class EmbedRequest(NamedTuple):
+    connection:Connection
+    lock:threading.Lock
+    request_id:int
+    texts:List[str]
+
+
+class EmbeddingServerModel():
+    def __init__(self, model:Embeddings, address:str=DEFAULT_ADDRESS, authkey:Optional[bytes]=None, max_batch:int=256, max_wait:float=0.01):
+        """
+            model : the one in-memory copy of the embedding model, usually HuggingFaceEmbeddingsModel
+            max_batch : texts from concurrent requests are coalesced into one model call up to this many
+            max_wait : how long the first request of a batch waits for others to join it
+        """
+        self.model=model
+        self.address=address
+        self.authkey=authkey
+        self.max_batch=max_batch
+        self.max_wait=max_wait
+        self.requests:"queue.Queue[EmbedRequest]"=queue.Queue()
+        self.listener:Optional[Listener]=None
+        self.stopped=threading.Event()
+        # tokenizers are not safe to call from two threads, token counts wait for the batch
+        self.model_lock=threading.Lock()
+        self.batches=0
+        self.texts=0
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self.listener=Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        threading.Thread(target=self._batch, name="embedding-batcher", daemon=True).start()
+        logger.info("Embedding server for %s listening on %s", self.model.model_name, self.address)
+        while not self.stopped.is_set():
+            try:
+                connection=self.listener.accept()
+            except Exception as e:
+                if self.stopped.is_set():
+                    break
+                logger.warning("Rejected embedding client: %s", e)
+                continue
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.listener:
+            self.listener.close()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _serve(self, connection:Connection):
+        """
+            one thread per API worker connection, it only reads, replies are sent by the batcher
+        """
+        lock=threading.Lock()
+        try:
+            while True:
+                message=connection.recv()
+                if message[0]=="embed":
+                    _, request_id, texts=message
+                    self.requests.put(EmbedRequest(connection, lock, request_id, texts))
+                elif message[0]=="count":
+                    _, request_id, texts=message
+                    reply=self._count(request_id, texts)
+                    with lock:
+                        connection.send(reply)
+                elif message[0]=="info":
+                    with lock:
+                        connection.send(("info", message[1], {"model_name":self.model.model_name,"batches":self.batches,"texts":self.texts}))
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def _count(self, request_id:int, texts:List[str]) -> tuple:
+        count_tokens=getattr(self.model, "countTokens", None)
+        if count_tokens is None:
+            return ("tokens", request_id, [max(1, len(text)//4) for text in texts])
+        try:
+            with self.model_lock:
+                return ("tokens", request_id, list(count_tokens(texts)))
+        except Exception as e:
+            logger.error("Counting tokens failed: %s", e)
+            return ("error", request_id, str(e))
+
+    def _collect(self) -> List[EmbedRequest]:
+        batch=[self.requests.get()]
+        size=len(batch[0].texts)
+        deadline=time.monotonic()+self.max_wait
+        while size<self.max_batch:
+            try:
+                request=self.requests.get(timeout=max(0.0, deadline-time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(request)
+            size+=len(request.texts)
+        return batch
+
+    def _batch(self):
+        while not self.stopped.is_set():
+            batch=self._collect()
+            texts=[text for request in batch for text in request.texts]
+            try:
+                with timed("embedding_server"), self.model_lock:
+                    vectors=np.asarray(self.model.embed_documents(texts), dtype=np.float32)
+                self.batches+=1
+                self.texts+=len(texts)
+                logger.debug("Embedded %s texts from %s requests in one batch", len(texts), len(batch))
+                replies=[]
+                start=0
+                for request in batch:
+                    replies.append(("vectors", request.request_id, vectors[start:start+len(request.texts)]))
+                    start+=len(request.texts)
+            except Exception as e:
+                logger.error("Embedding batch failed: %s", e)
+                replies=[("error", request.request_id, str(e)) for request in batch]
+
+            for request, reply in zip(batch, replies):
+                try:
+                    with request.lock:
+                        request.connection.send(reply)
+                except (EOFError, OSError) as e:
+                    logger.warning("Embedding client went away: %s", e)
+
+
+class RemoteEmbeddingsModel(Embeddings):
+    def __init__(self, address:str=DEFAULT_ADDRESS, authkey:Optional[bytes]=None):
+        """
+            embeddings served by an EmbeddingServerModel process, one connection per calling thread
+            so concurrent uploads reach the server together and share its batches
+        """
+        self.address=address
+        self.authkey=authkey
+        self.local=threading.local()
+        self.request_ids=itertools.count(1)
+        self._model_name:Optional[str]=None
+
+    def _connection(self) -> Connection:
+        connection=getattr(self.local, "connection", None)
+        if connection is None:
+            connection=self.local.connection=Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        return connection
+
+    def _call(self, kind:str, *args):
+        request_id=next(self.request_ids)
+        for attempt in range(2):
+            connection=self._connection()
+            try:
+                connection.send((kind, request_id, *args))
+                reply, reply_id, payload=connection.recv()
+                break
+            except (EOFError, OSError):
+                # the server restarted, reconnect once
+                connection.close()
+                self.local.connection=None
+                if attempt:
+                    raise
+        if reply_id!=request_id:
+            raise Exception(f"Embedding server replied to request {reply_id}, expected {request_id}")
+        if reply=="error":
+            raise Exception(f"Embedding server error: {payload}")
+        return payload
+
+    def info(self) -> dict:
+        return self._call("info")
+
+    @property
+    def model_name(self) -> str:
+        if self._model_name is None:
+            self._model_name=self.info()["model_name"]
+        return self._model_name
+
+    def embed_documents(self, texts:List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._call("embed", list(texts)).tolist()
+
+    def embed_query(self, text:str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def countTokens(self, texts:List[str]) -> List[int]:
+        """
+            tokens each text costs the served model, counted by its tokenizer in the server
+        """
+        if not texts:
+            return []
+        return self._call("count", list(texts))
+
+    def get_embedding(self, text):
+        return self.embed_query(text)
+
+
+def main():
+    from audio_vectorize.Model__Embedding_HuggingFace import HuggingFaceEmbeddingsModel
+    from audio_vectorize.Model__EmbeddingCache_MemoryMapped import EmbeddingCacheModel
+
+    _:bool=load_dotenv(find_dotenv())
+    logging.basicConfig(level=os.getenv('LOG_LEVEL','INFO').upper(),format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    authkey=os.getenv('EMBEDDING_SERVER_AUTHKEY')
+    model=HuggingFaceEmbeddingsModel(os.getenv('EMBEDDING_MODEL_NAME'),batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE','32')),max_tokens_per_batch=int(os.getenv('EMBEDDING_MAX_TOKENS_PER_BATCH','16384')),cache=EmbeddingCacheModel(os.getenv('EMBEDDING_CACHE_DIR','.cache/embeddings')))
+    model.load()
+    server=EmbeddingServerModel(model,os.getenv('EMBEDDING_SERVER_ADDRESS',DEFAULT_ADDRESS),authkey.encode() if authkey else None,max_batch=int(os.getenv('EMBEDDING_SERVER_MAX_BATCH','256')),max_wait=float(os.getenv('EMBEDDING_SERVER_MAX_WAIT_MS','10'))/1000)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        model.cache.close()
+
+
+if __name__=="__main__":
+    main()
@@ -1,11 +1,97 @@
-from langchain_community.embeddings import HuggingFaceEmbeddings as BaseEmbeddings
-import sentence_transformers
-class HuggingFaceEmbeddingsModel():
-    def __init__(self):
-        self.embeddings = BaseEmbeddings()
+from langchain_core.embeddings import Embeddings
+from typing import Dict, List, Optional
+import logging
+import threading
+
+from audio_vectorize.Model__EmbeddingCache_MemoryMapped import EmbeddingCacheModel
+
+
+logger=logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME="sentence-transformers/all-mpnet-base-v2"
+
+
+class HuggingFaceEmbeddingsModel(Embeddings):
+    def __init__(self, model_name:Optional[str]=None, batch_size:int=32, max_tokens_per_batch:int=16384, cache:Optional[EmbeddingCacheModel]=None):
+        """
+            batch_size : max texts sent to the model at once
+            max_tokens_per_batch : a batch is closed early once its texts add up to this many tokens
+            cache : optional vector cache, only texts it has not seen are embedded
+            the model weights, and sentence_transformers itself, are loaded on first use or by load()
+        """
+        self.model_name = model_name or DEFAULT_MODEL_NAME
+        self.batch_size = batch_size
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.cache = cache
+        self._embeddings = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    # importing this pulls in sentence_transformers and torch, seconds on a cold start
+                    from langchain_community.embeddings import HuggingFaceEmbeddings as BaseEmbeddings
+                    logger.info("Loading embedding model %s", self.model_name)
+                    self._embeddings = BaseEmbeddings(model_name=self.model_name, encode_kwargs={"batch_size":self.batch_size})
+        return self._embeddings
+
+    @property
+    def embeddings(self):
+        return self.load()
 
     def get_embedding(self, text):
-        return self.embeddings.embed_query(text)
-    
+        return self.embed_query(text)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def countTokens(self, texts:List[str]) -> List[int]:
+        """
+            tokens each text costs the model, texts longer than the model limit get truncated by it
+        """
+        client=self.embeddings.client
+        tokenizer=getattr(client, "tokenizer", None)
+        if tokenizer is None:
+            return [max(1, len(text)//4) for text in texts]
+        limit=getattr(client, "max_seq_length", None) or float("inf")
+        return [min(len(ids), limit) for ids in tokenizer(texts, add_special_tokens=True)["input_ids"]]
+
+    def batches(self, texts:List[str]) -> List[List[str]]:
+        batches:List[List[str]]=[]
+        current:List[str]=[]
+        current_tokens=0
+        for text, tokens in zip(texts, self.countTokens(texts)):
+            if current and (len(current)>=self.batch_size or current_tokens+tokens>self.max_tokens_per_batch):
+                batches.append(current)
+                current, current_tokens=[], 0
+            current.append(text)
+            current_tokens+=tokens
+        if current:
+            batches.append(current)
+        return batches
+
     def embed_documents(self, texts):
-        return self.embeddings.embed_documents(texts)
\ No newline at end of file
+        # identical texts are embedded once
+        unique:Dict[str,str]={}
+        for text in texts:
+            unique.setdefault(EmbeddingCacheModel.textHash(text), text)
+        hashes=list(unique)
+
+        vectors:Dict[str,List[float]]={}
+        if self.cache:
+            for key, vector in zip(hashes, self.cache.getMany(self.model_name, hashes)):
+                if vector is not None:
+                    vectors[key]=vector.tolist()
+
+        missing=[key for key in hashes if key not in vectors]
+        if missing:
+            logger.info("Embedding %s of %s texts", len(missing), len(texts))
+            embedded:List[List[float]]=[]
+            for batch in self.batches([unique[key] for key in missing]):
+                embedded.extend(self.embeddings.embed_documents(batch))
+            vectors.update(zip(missing, embedded))
+            if self.cache:
+                self.cache.putMany(self.model_name, missing, embedded)
+
+        return [vectors[EmbeddingCacheModel.textHash(text)] for text in texts]
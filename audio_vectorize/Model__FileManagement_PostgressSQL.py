@@ -1,10 +1,22 @@
-from typing import Optional
+from typing import Any, Dict, Hashable, List, Optional, Tuple
 
 from sqlmodel import Field, SQLModel,UUID,create_engine,Session,Uuid,select,update,Relationship
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import and_, delete, func, insert, inspect, or_, text, tuple_
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from fastapi import UploadFile
+import base64
+import json
+import logging
 import uuid
 
-from datetime import datetime
+from audio_vectorize.Model__Cache_LRU import LRUCacheModel
+from audio_vectorize.Model__Metrics_Prometheus import timed
+
+logger=logging.getLogger(__name__)
+
+from datetime import datetime, timedelta
 
 class User(SQLModel,table=True):
     email:str=Field(primary_key=True)
@@ -14,7 +26,7 @@ class User(SQLModel,table=True):
 
 class Database(SQLModel, table=True):
     id:Optional[uuid.UUID]=Field(default_factory=uuid.uuid4, primary_key=True)
-    email:str=Field(foreign_key="user.email")
+    email:str=Field(foreign_key="user.email",index=True)
     name:str=Field(unique=True)
     created_at:datetime
 
@@ -24,7 +36,7 @@ class Database(SQLModel, table=True):
 class Collection(SQLModel, table=True):
     id:Optional[uuid.UUID]=Field(default_factory=uuid.uuid4, primary_key=True)
     name: str=Field(unique=True)
-    database_id:uuid.UUID=Field(foreign_key="database.id")
+    database_id:uuid.UUID=Field(foreign_key="database.id",index=True)
     created_at:datetime
 
     database:Database=Relationship(back_populates="collections")
@@ -39,22 +51,132 @@ class File(SQLModel,table=True):
     format:str
     created_at: datetime
     updated_at: datetime
-    collection_id:uuid.UUID=Field(foreign_key="collection.id")
+    collection_id:uuid.UUID=Field(foreign_key="collection.id",index=True)
+    # ingesting until its vectors are all written, partial when that failed part way
+    status:str=Field(default="complete",sa_column_kwargs={"server_default":"complete"})
+    content_hash:Optional[str]=Field(default=None,index=True)
 
     collection:Collection=Relationship(back_populates="files")
 
+class Deletion(SQLModel,table=True):
+    """
+        tombstone written in the same transaction as a delete, lists the vector store data that has
+        to go too and stays until that is done, failed attempts are retried
+    """
+    id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True)
+    kind:str
+    target_id:str
+    # json list of {"database", "collection", "collections", "file_ids"} vector store targets
+    targets:str
+    created_at:datetime
+    attempts:int=0
+    last_error:Optional[str]=None
+
+class Job(SQLModel,table=True):
+    """
+        last saved state of an ingestion job, lets any worker answer for a job another one runs
+    """
+    id:str=Field(primary_key=True)
+    status:str
+    # the job as json, files and their stages included
+    data:str
+    updated_at:datetime=Field(index=True)
+
+def asyncConnectionString(connection_string:str) -> str:
+    """
+        same database through an async driver, asyncpg for postgres and aiosqlite for sqlite
+    """
+    url=make_url(connection_string)
+    if url.get_backend_name()=="sqlite":
+        return url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    query=dict(url.query)
+    # asyncpg takes ssl instead of libpq's sslmode and has no channel_binding
+    if "sslmode" in query:
+        query["ssl"]=query.pop("sslmode")
+    query.pop("channel_binding",None)
+    return url.set(drivername="postgresql+asyncpg",query=query).render_as_string(hide_password=False)
+
+def encodeCursor(database_name:str, collection_name:str) -> str:
+    """
+        opaque keyset cursor, the (database name, collection name) of the last row of a page
+    """
+    return base64.urlsafe_b64encode(json.dumps([database_name,collection_name]).encode()).decode()
+
+def decodeCursor(cursor:str) -> Tuple[str,str]:
+    try:
+        database_name,collection_name=json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return database_name,collection_name
+    except Exception:
+        raise Exception("Invalid cursor")
+
+
 class FileManagementModel():
-    def __init__(self,connection_string):
+    def __init__(self,connection_string,pool_size:int=5,max_overflow:int=10,pool_pre_ping:bool=True,pool_recycle:int=1800,cache:Optional[LRUCacheModel]=None):
+        """
+            connects to db using env connection string, sync and async engines share the pool settings.
+            Database and collection lookups are read through cache when one is given, writes made
+            through this model invalidate it, the cache ttl bounds staleness from other processes
+        """
+        pool={}
+        if make_url(connection_string).get_backend_name()!="sqlite":
+            pool={"pool_size":pool_size,"max_overflow":max_overflow,"pool_pre_ping":pool_pre_ping,"pool_recycle":pool_recycle}
+        self.engine=create_engine(connection_string,**pool)
+        self.async_connection_string=asyncConnectionString(connection_string)
+        self.async_pool=pool
+        self._async_engine=None
+        self.cache=cache
+
+    @property
+    def async_engine(self):
+        """
+            created on first use so the async driver is only needed by callers of the async methods
+        """
+        if self._async_engine is None:
+            self._async_engine=create_async_engine(self.async_connection_string,**self.async_pool)
+        return self._async_engine
+
+    def asyncSession(self) -> AsyncSession:
+        return AsyncSession(self.async_engine,expire_on_commit=False)
+
+    async def close(self):
+        self.engine.dispose()
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+
+    def _cacheGet(self, key:Hashable) -> Any:
+        return self.cache.get(key) if self.cache else None
+
+    def _cachePut(self, key:Hashable, value:Any):
+        if self.cache:
+            self.cache.put(key, value)
+
+    def _invalidate(self, database_ids=(), collection_ids=(), emails=()):
         """
-            connects to db using env connection string
+            drops every cached lookup that involves one of the given rows
         """
-        self.engine=create_engine(connection_string)
+        if not self.cache:
+            return
+        database_ids={str(id) for id in database_ids}
+        collection_ids={str(id) for id in collection_ids}
+        emails=set(emails)
+        def stale(key):
+            if key[0]=="database":
+                return key[1] in database_ids
+            if key[0]=="collection":
+                return key[1] in collection_ids
+            if key[0]=="database_and_collection":
+                return key[1] in database_ids or key[2] in collection_ids
+            return key[0]=="listing" and key[1] in emails
+        self.cache.invalidate(stale)
+
+    def cacheStats(self) -> Optional[dict]:
+        return self.cache.stats() if self.cache else None
 
     def getFile(self, file_id:str):
         """
             returns file info from SQL database
         """
-        print("Getting file ", file_id, " from postgresQL")
+        logger.debug("Getting file %s from postgresQL", file_id)
         with Session(self.engine) as session:
             file=session.get(File, file_id)
             return file if file else Exception("File not found")
@@ -65,60 +187,237 @@ class FileManagementModel():
             adds file info to SQL database, auto handles file extension
         """
         
-        print("Adding ",file.filename," to postgresQL")
-        file_extension = file.filename.split('.')[-1]
-    
-        tempFile=File(name=file.filename,size=file.size,type=file.content_type,format=file_extension,created_at=datetime.now(),updated_at=datetime.now(),collection_id=collection_id)
+        logger.info("Adding %s to postgresQL", file.filename)
+        tempFile=self._newFile(file,collection_id)
 
-        with Session(self.engine) as session:
+        with timed("postgres_write"), Session(self.engine) as session:
             session.add(tempFile)
             session.commit()
             session.refresh(tempFile)
         return tempFile
     
         
-    def updateFile(self, file:UploadFile,file_id):
+    def _updatedValues(self, file:UploadFile, format:Optional[str], content_hash:Optional[str]) -> dict:
+        """
+            the row of a replaced file, format from the probed header like new rows, extension as
+            the fallback, and the hash of the new bytes
+        """
+        return {"name":file.filename,"size":file.size,"type":file.content_type,"format":(format or file.filename.split('.')[-1]).lower(),"content_hash":content_hash,"status":"complete","updated_at":datetime.now()}
+
+    def updateFile(self, file:UploadFile,file_id,format:Optional[str]=None,content_hash:Optional[str]=None):
         """
             updates file info in SQL database
         """
-        print("Updating ", file.filename, " in postgresQL")
-        file_extension = file.filename.split('.')[-1]
+        logger.info("Updating %s in postgresQL", file.filename)
         try:
-            with Session(self.engine) as session:
+            with timed("postgres_write"), Session(self.engine) as session:
                 #newFile=File(file_id,name=file.filename,size=file.size,type=file.content_type,format=file_extension,updated_at=datetime.now())
                 stmt = (
                 update(File)
-                .where(File.id == file_id)
-                .values(
-                    name=file.filename,
-                    size=file.size,
-                    type=file.content_type,
-                    format=file_extension,
-                    updated_at=datetime.now()
-                    )
+                .where(File.id == uuid.UUID(str(file_id)))
+                .values(**self._updatedValues(file,format,content_hash))
                 )
                 session.exec(stmt)
                 session.commit()
-            print("Updated successfully\n")
+            logger.debug("Updated successfully")
             return file
         except Exception as e:
-            print(e)
+            logger.error(e)
             raise Exception({"Error":e,"details":"Error in updating file"})
     
-    def deleteFile(self, file:UploadFile):
+    def _newFile(self,file:UploadFile,collection_id:str) -> File:
+        file_extension = file.filename.split('.')[-1]
+        return File(name=file.filename,size=file.size,type=file.content_type,format=file_extension,created_at=datetime.now(),updated_at=datetime.now(),collection_id=collection_id)
+
+    async def addFileAsync(self,file:UploadFile,collection_id:str) -> File:
+        logger.info("Adding %s to postgresQL", file.filename)
+        tempFile=self._newFile(file,collection_id)
+        with timed("postgres_write"):
+            async with self.asyncSession() as session:
+                session.add(tempFile)
+                await session.commit()
+                await session.refresh(tempFile)
+        return tempFile
+
+    def _fileRows(self,files,collection_id:str) -> List[dict]:
+        now=datetime.now()
+        return [{"id":uuid.uuid4(),"name":file.filename,"size":file.size,"type":file.content_type,"format":(getattr(file,"format",None) or file.filename.split('.')[-1]).lower(),"created_at":now,"updated_at":now,"collection_id":uuid.UUID(str(collection_id)),"status":"ingesting","content_hash":getattr(file,"sha256",None)} for file in files]
+
+    def addFiles(self,files,collection_id:str) -> List[File]:
         """
-            deletes file info in SQL database
+            adds every file in one transaction and one INSERT ... RETURNING, rows come back in input order
+        """
+        if not files:
+            return []
+        logger.info("Adding %s files to postgresQL", len(files))
+        with timed("postgres_write"), Session(self.engine,expire_on_commit=False) as session:
+            result=session.scalars(insert(File).returning(File,sort_by_parameter_order=True),self._fileRows(files,collection_id))
+            added=list(result)
+            session.commit()
+        return added
+
+    async def addFilesAsync(self,files,collection_id:str) -> List[File]:
+        if not files:
+            return []
+        logger.info("Adding %s files to postgresQL", len(files))
+        with timed("postgres_write"):
+            async with self.asyncSession() as session:
+                result=await session.scalars(insert(File).returning(File,sort_by_parameter_order=True),self._fileRows(files,collection_id))
+                added=list(result)
+                await session.commit()
+        return added
+
+    async def claimUnfinishedFilesAsync(self,collection_id:str,content_hashes:List[str],stale_seconds:float=3600) -> Dict[str,File]:
+        """
+            claims the latest resumable file row of the collection for each content hash, a retried
+            upload of the same bytes carries on with that row instead of adding one. Rows are resumable
+            when partial, or still ingesting after stale_seconds without a status change, younger
+            ingesting rows belong to a job that is still running. A row is claimed by setting it back to
+            ingesting with an update conditional on the status and time it was read with, so of two
+            concurrent retries only one resumes it
+        """
+        content_hashes=[content_hash for content_hash in content_hashes if content_hash]
+        if not content_hashes:
+            return {}
+        now=datetime.now()
+        stale=now-timedelta(seconds=stale_seconds)
+        claimed:Dict[str,File]={}
+        with timed("postgres_write"):
+            async with self.asyncSession() as session:
+                statement=select(File).where(File.collection_id==uuid.UUID(str(collection_id)),File.content_hash.in_(content_hashes),or_(File.status=="partial",and_(File.status=="ingesting",File.updated_at<stale))).order_by(File.created_at.desc())
+                for file in (await session.exec(statement)).all():
+                    if file.content_hash in claimed:
+                        continue
+                    result=await session.exec(update(File).where(File.id==file.id,File.status==file.status,File.updated_at==file.updated_at).values(status="ingesting",updated_at=now))
+                    if result.rowcount==1:
+                        file.status="ingesting"
+                        file.updated_at=now
+                        claimed[file.content_hash]=file
+                await session.commit()
+        return claimed
+
+    async def setFilesStatusAsync(self,file_ids:List[str],status:str):
+        if not file_ids:
+            return
+        with timed("postgres_write"):
+            async with self.asyncSession() as session:
+                await session.exec(update(File).where(File.id.in_([uuid.UUID(str(id)) for id in file_ids])).values(status=status,updated_at=datetime.now()))
+                await session.commit()
+
+    def setFilesStatus(self,file_ids:List[str],status:str):
+        if not file_ids:
+            return
+        with timed("postgres_write"), Session(self.engine) as session:
+            session.exec(update(File).where(File.id.in_([uuid.UUID(str(id)) for id in file_ids])).values(status=status,updated_at=datetime.now()))
+            session.commit()
+
+    def getFiles(self,collection_id:str) -> List[File]:
+        with Session(self.engine,expire_on_commit=False) as session:
+            return list(session.exec(select(File).where(File.collection_id==uuid.UUID(str(collection_id))).order_by(File.created_at,File.id)))
+
+    def importFiles(self,rows:List[dict],collection_id:str,batch_size:int=1000) -> int:
+        """
+            bulk inserts file rows of a snapshot into the collection under the ids given in rows,
+            restore assigns new ones so a snapshot can be imported next to its source. Times and
+            hashes are kept, rows are marked ingesting until their vectors are loaded
         """
-        print("Deleting ", file.file, " in postgresQL")
+        if not rows:
+            return 0
+        collection_id=uuid.UUID(str(collection_id))
+        with timed("postgres_write"), Session(self.engine) as session:
+            for start in range(0,len(rows),batch_size):
+                session.execute(insert(File),[{**row,"id":uuid.UUID(str(row["id"])),"collection_id":collection_id,"status":"ingesting"} for row in rows[start:start+batch_size]])
+            session.commit()
+        logger.info("Imported %s files into collection %s", len(rows), collection_id)
+        return len(rows)
+
+    async def updateFileAsync(self, file:UploadFile,file_id,format:Optional[str]=None,content_hash:Optional[str]=None):
+        logger.info("Updating %s in postgresQL", file.filename)
         try:
-            with Session(self.engine) as session:
-                session.delete(file)
-                session.commit()
-            return {"details":"File deleted"}
+            with timed("postgres_write"):
+                async with self.asyncSession() as session:
+                    stmt = (
+                    update(File)
+                    .where(File.id == uuid.UUID(str(file_id)))
+                    .values(**self._updatedValues(file,format,content_hash))
+                    )
+                    await session.exec(stmt)
+                    await session.commit()
+            logger.debug("Updated successfully")
+            return file
         except Exception as e:
-            print(e)
+            logger.error(e)
             raise Exception({"Error":e,"details":"Error in updating file"})
 
+    def saveJobs(self, jobs:List[Tuple[str,str,str]]):
+        """
+            upserts (id, status, json) job states in one transaction
+        """
+        if not jobs:
+            return
+        now=datetime.now()
+        with timed("postgres_write"), Session(self.engine) as session:
+            for job_id, status, data in jobs:
+                session.merge(Job(id=job_id,status=status,data=data,updated_at=now))
+            session.commit()
+
+    def getJob(self, job_id:str) -> Optional[Job]:
+        with Session(self.engine) as session:
+            return session.get(Job, job_id)
+
+    def pruneJobs(self, before:datetime) -> int:
+        with Session(self.engine) as session:
+            result=session.exec(delete(Job).where(Job.updated_at<before))
+            session.commit()
+        return result.rowcount
+
+    def _tombstone(self, session:Session, kind:str, target_id:str, targets:List[dict]) -> Deletion:
+        deletion=Deletion(kind=kind,target_id=str(target_id),targets=json.dumps(targets),created_at=datetime.now())
+        session.add(deletion)
+        return deletion
+
+    def deleteFile(self, file_id:str) -> Optional[Deletion]:
+        """
+            deletes file info in SQL database
+        """
+        return self.deleteFiles([file_id])
+
+    def deleteFiles(self, file_ids:List[str]) -> Optional[Deletion]:
+        """
+            deletes the file rows in one statement and records a tombstone for their vectors,
+            None when none of them exist
+        """
+        logger.info("Deleting %s files in postgresQL", len(file_ids))
+        ids=[uuid.UUID(str(id)) for id in file_ids]
+        with timed("postgres_write"), Session(self.engine,expire_on_commit=False) as session:
+            rows=session.exec(select(File.id,Collection.name,Database.name).join(Collection,File.collection_id==Collection.id).join(Database,Collection.database_id==Database.id).where(File.id.in_(ids))).all()
+            if not rows:
+                return None
+            targets:Dict[Tuple[str,str],List[str]]={}
+            for file_id,collection_name,database_name in rows:
+                targets.setdefault((database_name,collection_name),[]).append(str(file_id))
+            session.exec(delete(File).where(File.id.in_(ids)))
+            deletion=self._tombstone(session,"files",",".join(str(id) for id in ids),[{"database":database,"collection":collection,"file_ids":group} for (database,collection),group in targets.items()])
+            session.commit()
+        return deletion
+
+    def getDeletions(self, limit:int=100) -> List[Deletion]:
+        """
+            tombstones whose vector store side is still to be done, oldest first
+        """
+        with Session(self.engine,expire_on_commit=False) as session:
+            return list(session.exec(select(Deletion).order_by(Deletion.created_at).limit(limit)).all())
+
+    def finishDeletion(self, deletion_id):
+        with Session(self.engine) as session:
+            session.exec(delete(Deletion).where(Deletion.id==uuid.UUID(str(deletion_id))))
+            session.commit()
+
+    def failDeletion(self, deletion_id, error:str):
+        with Session(self.engine) as session:
+            session.exec(update(Deletion).where(Deletion.id==uuid.UUID(str(deletion_id))).values(attempts=Deletion.attempts+1,last_error=error[:1000]))
+            session.commit()
+
     # def createDatabaseAndCollection(self,email:str,database:str,collection:str):
     #     database=Database(email=email,name=database,created_at=datetime.now())
     #     collection=Collection(name=collection, email=email, created_at=datetime.now())
@@ -143,20 +442,41 @@ class FileManagementModel():
 # Databse Actions
             
     def getDatabase(self, database_id:str) -> Database:
-        print("Fetching database with id ", database_id)
+        key=("database",str(database_id))
+        database=self._cacheGet(key)
+        if database:
+            return database
+        logger.debug("Fetching database with id %s", database_id)
         with Session(self.engine) as session:
             stmt=select(Database).where(Database.id==database_id)
             database=session.exec(stmt).first()
             if database:
-                print("Fetched successfully\n")
+                logger.debug("Fetched successfully")
+                self._cachePut(key, database)
                 return database
-        print("Database not found with id ", database_id)
+        logger.warning("Database not found with id %s", database_id)
         raise Exception("Database not found")
     
+    async def getDatabaseAsync(self, database_id:str) -> Database:
+        key=("database",str(database_id))
+        database=self._cacheGet(key)
+        if database:
+            return database
+        logger.debug("Fetching database with id %s", database_id)
+        async with self.asyncSession() as session:
+            stmt=select(Database).where(Database.id==uuid.UUID(str(database_id)))
+            database=(await session.exec(stmt)).first()
+            if database:
+                logger.debug("Fetched successfully")
+                self._cachePut(key, database)
+                return database
+        logger.warning("Database not found with id %s", database_id)
+        raise Exception("Database not found")
+
     def createDatabase(self, email:str, database:str) -> Database:
         database=Database(email=email, name=database, created_at=datetime.now())
 
-        print("Creating database \n", database)
+        logger.debug("Creating database %s", database)
         with Session(self.engine) as session:
             stmt=select(User).where(User.email==email)
             user=session.exec(stmt).first()
@@ -166,76 +486,215 @@ class FileManagementModel():
             session.add(database)
             session.commit()
             session.refresh(database)
-        print("Database created \n", database)
+        self._invalidate(emails=[email])
+        logger.info("Database created %s", database)
         return database
     
-    def deleteDatabase(self, database_id:str) -> Database:
-        print("Deleting database with id ", database_id)
+    def deleteDatabase(self, database_id:str) -> Optional[Deletion]:
+        """
+            deletes the database, its collections and their files with one statement per table and
+            records a tombstone for the vector store database, None when it does not exist
+        """
+        logger.info("Deleting database with id %s", database_id)
+        database_id=uuid.UUID(str(database_id))
+        with timed("postgres_write"), Session(self.engine,expire_on_commit=False) as session:
+            database=session.get(Database, database_id)
+            if not database:
+                return None
+            collections=session.exec(select(Collection.id,Collection.name).where(Collection.database_id==database_id)).all()
+            session.exec(delete(File).where(File.collection_id.in_(select(Collection.id).where(Collection.database_id==database_id))))
+            session.exec(delete(Collection).where(Collection.database_id==database_id))
+            session.exec(delete(Database).where(Database.id==database_id))
+            deletion=self._tombstone(session,"database",database_id,[{"database":database.name,"collections":[name for _,name in collections]}])
+            session.commit()
+        self._invalidate(database_ids=[database_id],collection_ids=[id for id,_ in collections],emails=[database.email])
+        logger.info("Database deleted with id %s", database_id)
+        return deletion
+
+
+    def getDatabaseAndCollection(self, database_id:str, collection_id:str) -> Tuple[Database,Collection]:
+        """
+            both rows in one query, fails unless the collection belongs to the database
+        """
+        key=("database_and_collection",str(database_id),str(collection_id))
+        cached=self._cacheGet(key)
+        if cached:
+            return cached
+        logger.debug("Fetching database %s and collection %s", database_id, collection_id)
         with Session(self.engine) as session:
-            stmt=select(Database).where(Database.id==database_id)
-            database=session.exec(stmt).first()
-            if database:
-                session.delete(database)
-                session.commit()
-        print("Database deleted with id ", database_id)
-        return database
-        # print("Deleting database with id ", database_id)
-        # with Session(self.engine) as session:
-        #     session.delete(Database)
-        #     session.commit()
-        # print("Database deleted with id ", database_id)
-        # return {"Success":True,"message":"Database deleted"}
+            stmt=(
+                select(Database,Collection)
+                .join(Collection,Collection.database_id==Database.id)
+                .where(Database.id==uuid.UUID(str(database_id)),Collection.id==uuid.UUID(str(collection_id)))
+            )
+            row=session.exec(stmt).first()
+            if row:
+                logger.debug("Fetched successfully")
+                self._cachePut(key, (row[0],row[1]))
+                return row[0],row[1]
+        logger.warning("Collection %s not found in database %s", collection_id, database_id)
+        raise Exception("Collection not found in database")
+
+    async def getDatabaseAndCollectionAsync(self, database_id:str, collection_id:str) -> Tuple[Database,Collection]:
+        """
+            both rows in one query, fails unless the collection belongs to the database
+        """
+        key=("database_and_collection",str(database_id),str(collection_id))
+        cached=self._cacheGet(key)
+        if cached:
+            return cached
+        logger.debug("Fetching database %s and collection %s", database_id, collection_id)
+        async with self.asyncSession() as session:
+            stmt=(
+                select(Database,Collection)
+                .join(Collection,Collection.database_id==Database.id)
+                .where(Database.id==uuid.UUID(str(database_id)),Collection.id==uuid.UUID(str(collection_id)))
+            )
+            row=(await session.exec(stmt)).first()
+            if row:
+                logger.debug("Fetched successfully")
+                self._cachePut(key, (row[0],row[1]))
+                return row[0],row[1]
+        logger.warning("Collection %s not found in database %s", collection_id, database_id)
+        raise Exception("Collection not found in database")
 
 
 ## Collection actions
     def createCollection(self, name:str, database_id:str) -> Collection:
         collection=Collection(name=name, database_id=database_id, created_at=datetime.now())
 
-        print("Creating collection \n", collection)
+        logger.debug("Creating collection %s", collection)
         with Session(self.engine) as session:
             session.add(collection)
             session.commit()
             session.refresh(collection)
-        print("Collection created \n", collection)
+            database=session.get(Database, collection.database_id)
+        self._invalidate(emails=[database.email] if database else [])
+        logger.info("Collection created %s", collection)
         return collection
     
     def getCollection(self, collection_id:str) -> Collection:
-        print("Fetching collection with id ", collection_id)
+        key=("collection",str(collection_id))
+        collection=self._cacheGet(key)
+        if collection:
+            return collection
+        logger.debug("Fetching collection with id %s", collection_id)
         with Session(self.engine) as session:
             stmt=select(Collection).where(Collection.id==collection_id)
             collection=session.exec(stmt).first()
             if collection:
-                print("Fetched successfully\n")
+                logger.debug("Fetched successfully")
+                self._cachePut(key, collection)
                 return collection
-        print("Collection not found with id ", collection_id)
+        logger.warning("Collection not found with id %s", collection_id)
         raise Exception("Collection not found")
     
-    def deleteCollection(self, collection_id:str)  -> Collection:
-        print("Deleting collection with id ", collection_id)
-        with Session(self.engine) as session:
-            stmt=select(Collection).where(Collection.id==collection_id)
-            collection=session.exec(stmt).first()
+    async def getCollectionAsync(self, collection_id:str) -> Collection:
+        key=("collection",str(collection_id))
+        collection=self._cacheGet(key)
+        if collection:
+            return collection
+        logger.debug("Fetching collection with id %s", collection_id)
+        async with self.asyncSession() as session:
+            stmt=select(Collection).where(Collection.id==uuid.UUID(str(collection_id)))
+            collection=(await session.exec(stmt)).first()
             if collection:
-                session.delete(collection)
-                session.commit()
-        print("Collection deleted with id ", collection_id)
-        return collection
+                logger.debug("Fetched successfully")
+                self._cachePut(key, collection)
+                return collection
+        logger.warning("Collection not found with id %s", collection_id)
+        raise Exception("Collection not found")
+    
+    def deleteCollection(self, collection_id:str) -> Optional[Deletion]:
+        """
+            deletes the collection and its files with one statement per table and records a
+            tombstone for the vector store collection, None when it does not exist
+        """
+        logger.info("Deleting collection with id %s", collection_id)
+        collection_id=uuid.UUID(str(collection_id))
+        with timed("postgres_write"), Session(self.engine,expire_on_commit=False) as session:
+            row=session.exec(select(Collection.name,Database.name,Database.email).join(Database,Collection.database_id==Database.id).where(Collection.id==collection_id)).first()
+            if not row:
+                return None
+            collection_name,database_name,email=row
+            session.exec(delete(File).where(File.collection_id==collection_id))
+            session.exec(delete(Collection).where(Collection.id==collection_id))
+            deletion=self._tombstone(session,"collection",collection_id,[{"database":database_name,"collection":collection_name}])
+            session.commit()
+        self._invalidate(collection_ids=[collection_id],emails=[email])
+        logger.info("Collection deleted with id %s", collection_id)
+        return deletion
     
 
     ## Database and Collection Actions
     
-    def getDatabaseAndCollections(self, email:str):
-        print("Fetching databases and collection with ",email)
+    def getDatabaseAndCollections(self, email:str, limit:int=100, cursor:Optional[str]=None, with_stats:bool=False) -> Tuple[List[dict],Optional[str]]:
+        """
+            one page of the user's collections with their database, ordered by (database name,
+            collection name) and continued with the returned cursor. with_stats adds the file
+            count and total size of every collection, aggregated in SQL
+        """
+        # stats move with every upload, only the plain listing is cached
+        key=("listing",email,limit,cursor)
+        cached=None if with_stats else self._cacheGet(key)
+        if cached is not None:
+            return cached
+        logger.debug("Fetching databases and collection with %s", email)
+        columns=[Database.id,Database.email,Database.name,Database.created_at,Collection.id,Collection.name,Collection.created_at]
+        query=select(*columns).join(Collection,Collection.database_id==Database.id).where(Database.email==email)
+        if cursor:
+            query=query.where(tuple_(Database.name,Collection.name)>tuple_(*decodeCursor(cursor)))
+        if with_stats:
+            query=query.add_columns(func.count(File.id),func.coalesce(func.sum(File.size),0)).outerjoin(File,File.collection_id==Collection.id).group_by(*columns)
+        query=query.order_by(Database.name,Collection.name).limit(limit+1)
+
         with Session(self.engine) as session:
-            query=select(Database.collections).where(Database.email==email).join(Collection, isouter=False).distinct()
-            result=session.exec(query).all()
-            print("Fetched successfully\n")
-            return result
-    
+            rows=session.exec(query).all()
+        logger.debug("Fetched successfully")
+
+        page=[]
+        for row in rows[:limit]:
+            item={
+                "Database":{"id":str(row[0]),"email":row[1],"name":row[2],"created_at":row[3].isoformat()},
+                "Collection":{"id":str(row[4]),"name":row[5],"database_id":str(row[0]),"created_at":row[6].isoformat()},
+            }
+            if with_stats:
+                item["Collection"]["files"]=row[7]
+                item["Collection"]["size"]=int(row[8])
+            page.append(item)
+        next_cursor=encodeCursor(rows[limit-1][2],rows[limit-1][5]) if len(rows)>limit else None
+        if not with_stats:
+            self._cachePut(key,(page,next_cursor))
+        return page,next_cursor
+
 
     def createTable(self):
         """
             creates table in db
         """
         SQLModel.metadata.create_all(self.engine)
-        
\ No newline at end of file
+        self._addMissingColumns()
+        # create_all skips tables that already exist, add indexes declared after they were created
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine,checkfirst=True)
+        
+
+    def _addMissingColumns(self):
+        """
+            create_all does not alter existing tables, columns added to a model later are added here
+        """
+        inspector=inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in SQLModel.metadata.sorted_tables:
+                existing={column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    definition=f'"{column.name}" {column.type.compile(dialect=self.engine.dialect)}'
+                    if column.server_default is not None:
+                        definition+=f" DEFAULT '{column.server_default.arg}'"
+                        if not column.nullable:
+                            definition+=" NOT NULL"
+                    logger.info("Adding column %s.%s", table.name, column.name)
+                    connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {definition}'))
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple
+
+
+class CheckpointChunk(NamedTuple):
+    index:int
+    start_ms:int
+    end_ms:int
+    text:str
+
+
+class IngestCheckpointModel():
+    def __init__(self, path:str, max_age_seconds:float=7*24*3600):
+        """
+            transcript of every finished chunk of a file still being transcribed, keyed by the
+            upload digest, so a retry of the same bytes resumes after the last finished chunk.
+            Checkpoints are cleared once the file is done, abandoned ones after max_age_seconds
+        """
+        directory=os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path=path
+        self.max_age_seconds=max_age_seconds
+        self.lock=threading.Lock()
+        self.connection=sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS checkpoint_chunk (key TEXT NOT NULL, chunk_index INTEGER NOT NULL, start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (key, chunk_index))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS checkpoint_chunk_created_at ON checkpoint_chunk (created_at)")
+        self.resumed=0
+        self.prune()
+
+    def resume(self, key:str) -> List[CheckpointChunk]:
+        """
+            the finished chunks from the start of the file up to the first gap. Chunks finish out of
+            order, the ones after the gap are dropped since resuming renumbers everything after it
+        """
+        with self.lock:
+            rows=self.connection.execute("SELECT chunk_index, start_ms, end_ms, text FROM checkpoint_chunk WHERE key=? ORDER BY chunk_index", (key,)).fetchall()
+            done=[]
+            for row in rows:
+                if row[0]!=len(done):
+                    break
+                done.append(CheckpointChunk(*row))
+            if len(done)<len(rows):
+                self.connection.execute("DELETE FROM checkpoint_chunk WHERE key=? AND chunk_index>=?", (key, len(done)))
+            if done:
+                self.resumed+=1
+            return done
+
+    def save(self, key:str, index:int, start_ms:int, end_ms:int, text:str):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO checkpoint_chunk (key, chunk_index, start_ms, end_ms, text, created_at) VALUES (?,?,?,?,?,?)", (key, index, start_ms, end_ms, text, time.time()))
+
+    def clear(self, key:str):
+        with self.lock:
+            self.connection.execute("DELETE FROM checkpoint_chunk WHERE key=?", (key,))
+
+    def prune(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM checkpoint_chunk WHERE key IN (SELECT key FROM checkpoint_chunk GROUP BY key HAVING MAX(created_at)<?)", (time.time()-self.max_age_seconds,))
+
+    def stats(self) -> dict:
+        with self.lock:
+            files, chunks=self.connection.execute("SELECT COUNT(DISTINCT key), COUNT(*) FROM checkpoint_chunk").fetchone()
+        return {"files":files,"chunks":chunks,"resumed":self.resumed}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
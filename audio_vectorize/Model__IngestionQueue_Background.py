@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import UploadFile
+from sqlmodel import SQLModel
+
+from audio_vectorize.Model__AudioProbe_Headers import AudioInfo
+from audio_vectorize.Model__Metrics_Prometheus import FILES
+from audio_vectorize.Model__UploadSpool_Disk import UploadSpoolModel
+
+
+logger=logging.getLogger(__name__)
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+class IngestFile(SQLModel):
+    filename:str
+    size:int
+    content_type:Optional[str]=None
+    sha256:Optional[str]=None
+    format:Optional[str]=None
+    sample_rate:Optional[int]=None
+    channels:Optional[int]=None
+    duration_ms:Optional[int]=None
+    stage:str="queued"
+    status:str="pending"
+    file_id:Optional[str]=None
+    error:Optional[str]=None
+    stage_seconds:Dict[str,float]={}
+    stage_started_at:Optional[datetime]=None
+
+    def enter(self, stage:str):
+        """
+            moves file to next pipeline stage and records time spent in the previous one
+        """
+        now=datetime.now()
+        if self.stage_started_at:
+            self.stage_seconds[self.stage]=(now-self.stage_started_at).total_seconds()
+        self.stage=stage
+        self.stage_started_at=now
+
+
+class IngestJob(SQLModel):
+    id:str
+    status:str="queued"
+    database:str
+    collection:str
+    collection_id:str
+    chunk_size:int
+    chunk_overlap:int
+    created_at:datetime
+    updated_at:datetime
+    files:List[IngestFile]=[]
+
+    def refreshStatus(self):
+        statuses={file.status for file in self.files}
+        if statuses<={"done"}:
+            self.status="done"
+        elif statuses<={"done","failed"}:
+            self.status="failed" if statuses=={"failed"} else "partial"
+        elif statuses=={"pending"}:
+            self.status="queued"
+        else:
+            self.status="running"
+        self.updated_at=datetime.now()
+
+
+class IngestionQueueModel():
+    def __init__(self, pipeline:Callable[[IngestJob,IngestFile,UploadFile],Awaitable[Any]], workers:int=2, max_pending:int=100, spool:Optional[UploadSpoolModel]=None, max_jobs:int=1000, finalize:Optional[Callable[[IngestJob,List[Tuple[IngestFile,Any]]],Awaitable[None]]]=None, store=None, save_seconds:float=1.0, retention_seconds:float=7*24*3600):
+        """
+            spools uploads to disk and runs pipeline(job, file, upload) on a bounded pool of workers,
+            finalize(job, [(file, pipeline result)]) then runs once per job for the files that made it.
+            store : optional job store shared by every API worker (saveJobs, getJob, pruneJobs), jobs
+                    are saved on every status change and every save_seconds while they run, so any
+                    worker can answer for them. Saved jobs are pruned after retention_seconds
+        """
+        self.pipeline=pipeline
+        self.finalize=finalize
+        self.workers=workers
+        self.max_pending=max_pending
+        self.max_jobs=max_jobs
+        self.spool=spool or UploadSpoolModel()
+
+        self.jobs:OrderedDict[str,IngestJob]=OrderedDict()
+        self.remaining:Dict[str,int]={}
+        self.results:Dict[str,List[Tuple[IngestFile,Any]]]={}
+        self.pending=0
+        self.queue:asyncio.Queue=asyncio.Queue()
+        self.tasks:List[asyncio.Task]=[]
+
+        self.store=store
+        self.save_seconds=save_seconds
+        self.retention_seconds=retention_seconds
+        self.unsaved:Dict[str,IngestJob]={}
+        self.changed:Optional[asyncio.Event]=None
+        self.saver:Optional[asyncio.Task]=None
+
+    def start(self):
+        logger.info("Starting %s ingestion workers", self.workers)
+        self.tasks=[asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.store is not None:
+            self.changed=asyncio.Event()
+            self.saver=asyncio.create_task(self._saveLoop())
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks=[]
+        if self.saver:
+            self.saver.cancel()
+            await asyncio.gather(self.saver, return_exceptions=True)
+            self.saver=None
+            await self._saveUnsaved()
+
+    def getJob(self, job_id:str) -> Optional[IngestJob]:
+        """
+            the job from this worker's memory, or as last saved by whichever worker runs it.
+            Reads the store, call it off the event loop
+        """
+        job=self.jobs.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        record=self.store.getJob(job_id)
+        return IngestJob.model_validate_json(record.data) if record else None
+
+    def _changed(self, job:IngestJob):
+        if self.changed is not None:
+            self.unsaved[job.id]=job
+            self.changed.set()
+
+    async def _saveUnsaved(self):
+        # serialized on the loop, where jobs change, written from a thread
+        unsaved, self.unsaved=self.unsaved, {}
+        jobs=[(job.id, job.status, job.model_dump_json()) for job in unsaved.values()]
+        if not jobs:
+            return
+        try:
+            await asyncio.to_thread(lambda: self.store.saveJobs(jobs))
+        except Exception:
+            for job_id, job in unsaved.items():
+                self.unsaved.setdefault(job_id, job)
+            raise
+
+    async def _saveLoop(self):
+        pruned=0.0
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), self.save_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            # stages move inside the pipeline without a status change
+            for job in self.jobs.values():
+                if job.status in ("queued","running"):
+                    self.unsaved[job.id]=job
+            try:
+                await self._saveUnsaved()
+                if time.monotonic()-pruned>3600:
+                    pruned=time.monotonic()
+                    before=datetime.now()-timedelta(seconds=self.retention_seconds)
+                    await asyncio.to_thread(lambda: self.store.pruneJobs(before))
+            except Exception as e:
+                logger.warning("Saving ingestion jobs failed: %s", e)
+            # at most one write per save_seconds
+            await asyncio.sleep(self.save_seconds)
+
+    async def submit(self, audiofiles:List[UploadFile], database:str, collection:str, collection_id:str, chunk_size:int, chunk_overlap:int, probes:Optional[List[AudioInfo]]=None) -> IngestJob:
+        """
+            spools every upload to disk and queues it, returns the job right away.
+            probes are the header infos of the uploads, kept on the job's files
+        """
+        if self.pending+len(audiofiles)>self.max_pending:
+            raise IngestionQueueFull(f"Ingestion queue is full, {self.pending}/{self.max_pending} files pending")
+        self.pending+=len(audiofiles)
+
+        now=datetime.now()
+        job=IngestJob(id=str(uuid.uuid4()),database=database,collection=collection,collection_id=collection_id,chunk_size=chunk_size,chunk_overlap=chunk_overlap,created_at=now,updated_at=now)
+        try:
+            spooled=await self.spool.spool(audiofiles, job.id)
+        except Exception:
+            self.pending-=len(audiofiles)
+            raise
+        job.files=[IngestFile(filename=upload.filename,size=upload.size,content_type=upload.content_type,sha256=upload.sha256,stage_started_at=now) for upload in spooled]
+        for jobfile, info in zip(job.files, probes or []):
+            jobfile.format=info.format
+            jobfile.sample_rate=info.sample_rate
+            jobfile.channels=info.channels
+            jobfile.duration_ms=info.duration_ms
+
+        self._remember(job)
+        self._changed(job)
+        self.remaining[job.id]=len(job.files)
+        self.results[job.id]=[]
+        for jobfile, upload in zip(job.files, spooled):
+            self.queue.put_nowait((job, jobfile, upload))
+        logger.info("Queued job %s with %s files", job.id, len(job.files))
+        return job
+
+    def _remember(self, job:IngestJob):
+        self.jobs[job.id]=job
+        while len(self.jobs)>self.max_jobs:
+            oldest=next(iter(self.jobs.values()))
+            if oldest.status in ("queued","running"):
+                break
+            self.jobs.popitem(last=False)
+
+    async def _worker(self):
+        while True:
+            job, jobfile, spooled=await self.queue.get()
+            jobfile.status="running"
+            job.refreshStatus()
+            self._changed(job)
+            try:
+                upload=self.spool.open(spooled)
+                try:
+                    result=await self.pipeline(job, jobfile, upload)
+                finally:
+                    await upload.close()
+                if self.finalize:
+                    self.results[job.id].append((jobfile, result))
+                else:
+                    self._done(jobfile)
+            except Exception as e:
+                self._failed(job, jobfile, e)
+            finally:
+                self.pending-=1
+                self.spool.remove([spooled])
+                self.remaining[job.id]-=1
+                if not self.remaining[job.id]:
+                    del self.remaining[job.id]
+                    await self._finalize(job)
+                job.refreshStatus()
+                self._changed(job)
+                self.queue.task_done()
+
+    async def _finalize(self, job:IngestJob):
+        results=self.results.pop(job.id)
+        if not results or not self.finalize:
+            return
+        try:
+            await self.finalize(job, results)
+            for jobfile, _ in results:
+                self._done(jobfile)
+        except Exception as e:
+            for jobfile, _ in results:
+                self._failed(job, jobfile, e)
+
+    def _done(self, jobfile:IngestFile):
+        jobfile.enter("done")
+        jobfile.status="done"
+        FILES.inc(status="done")
+
+    def _failed(self, job:IngestJob, jobfile:IngestFile, error:Exception):
+        logger.warning("Ingestion failed for %s in job %s: %s", jobfile.filename, job.id, error)
+        jobfile.status="failed"
+        jobfile.error=str(error)
+        FILES.inc(status="failed")
@@ -0,0 +1,447 @@
+import itertools
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+logger=logging.getLogger(__name__)
+
+TOKEN=re.compile(r"\w+")
+PHRASE=re.compile(r'"([^"]+)"')
+
+
+def tokenize(text:str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def _varintCounts(values:np.ndarray) -> np.ndarray:
+    counts=np.ones(len(values), dtype=np.int64)
+    for bits in range(7, 64, 7):
+        counts+=values>=np.uint64(1<<bits)
+    return counts
+
+
+def encodeVarints(values:Sequence[int]) -> bytes:
+    """
+        LEB128, 7 bits a byte with the high bit set on every byte but a value's last
+    """
+    values=np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    counts=_varintCounts(values)
+    starts=np.cumsum(counts)-counts
+    byte_index=np.arange(counts.sum())-np.repeat(starts, counts)
+    shifted=np.repeat(values, counts)>>(np.uint64(7)*byte_index.astype(np.uint64))
+    more=byte_index<np.repeat(counts, counts)-1
+    return ((shifted&np.uint64(0x7f))|(more.astype(np.uint64)<<np.uint64(7))).astype(np.uint8).tobytes()
+
+
+def decodeVarints(data:bytes) -> np.ndarray:
+    raw=np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.int64)
+    ends=np.flatnonzero(raw<0x80)
+    starts=np.concatenate(([0], ends[:-1]+1))
+    byte_index=np.arange(len(raw))-np.repeat(starts, ends-starts+1)
+    parts=(raw&0x7f).astype(np.uint64)<<(np.uint64(7)*byte_index.astype(np.uint64))
+    # the 7 bit groups of a value never overlap, summing them is or-ing them
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+
+def encodeBlobs(value_lists:Sequence[List[int]]) -> List[bytes]:
+    """
+        varint blobs of many value lists in one vectorized pass, a batch has thousands of short
+        posting lists and numpy's per call overhead would dominate encoding them one by one
+    """
+    values=np.fromiter(itertools.chain.from_iterable(value_lists), dtype=np.uint64)
+    encoded=encodeVarints(values)
+    byte_ends=np.cumsum(_varintCounts(values))
+    value_ends=np.cumsum([len(value_list) for value_list in value_lists])
+    ends=[0]+[int(byte_ends[end-1]) for end in value_ends]
+    return [encoded[ends[index]:ends[index+1]] for index in range(len(value_lists))]
+
+
+def decodeBlobs(blobs:Sequence[bytes]) -> List[List[int]]:
+    raw=b"".join(blobs)
+    values=decodeVarints(raw).tolist()
+    # every value ends with exactly one byte under 0x80
+    counts=np.add.reduceat(np.frombuffer(raw, dtype=np.uint8)<0x80, np.cumsum([0]+[len(blob) for blob in blobs[:-1]])).tolist() if blobs else []
+    lists=[]
+    start=0
+    for count in counts:
+        lists.append(values[start:start+count])
+        start+=count
+    return lists
+
+
+def postingValues(docs:Sequence[int], positions:Sequence[Sequence[int]]) -> List[int]:
+    """
+        count, doc deltas, term frequencies, then the position deltas of every doc, as separate
+        streams so a long list decodes in a few vectorized passes
+    """
+    values=[len(docs)]
+    previous=0
+    for doc in docs:
+        values.append(doc-previous)
+        previous=doc
+    values.extend(len(doc_positions) for doc_positions in positions)
+    for doc_positions in positions:
+        previous=0
+        for position in doc_positions:
+            values.append(position-previous)
+            previous=position
+    return values
+
+
+def parseValues(values:List[int]) -> Tuple[List[int],List[List[int]]]:
+    count=values[0]
+    docs=list(itertools.accumulate(values[1:1+count]))
+    positions=[]
+    start=1+2*count
+    for tf in values[1+count:1+2*count]:
+        positions.append(list(itertools.accumulate(values[start:start+tf])))
+        start+=tf
+    return docs, positions
+
+
+class Postings(NamedTuple):
+    docs:np.ndarray         # ascending doc numbers
+    tfs:np.ndarray
+    offsets:np.ndarray      # positions of docs[i] are positions[offsets[i]:offsets[i+1]]
+    positions:np.ndarray
+
+
+def encodePostings(docs:Sequence[int], positions:Sequence[Sequence[int]]) -> bytes:
+    return encodeVarints(postingValues(docs, positions))
+
+
+def decodePostings(data:bytes) -> Postings:
+    values=decodeVarints(data)
+    count=int(values[0])
+    docs=np.cumsum(values[1:1+count])
+    tfs=values[1+count:1+2*count]
+    offsets=np.concatenate(([0], np.cumsum(tfs)))
+    running=np.cumsum(values[1+2*count:])
+    # positions restart at every doc
+    base=np.concatenate(([0], running))[offsets[:-1]]
+    return Postings(docs, tfs, offsets, running-np.repeat(base, tfs))
+
+
+def reciprocalRankFusion(rankings:Sequence[Sequence[str]], k:int=60) -> List[Tuple[str,float]]:
+    """
+        ids of several rankings merged by the sum of 1 / (k + rank) over the rankings they are in
+    """
+    scores:Dict[str,float]=defaultdict(float)
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, 1):
+            scores[id]+=1/(k+rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class CollectionState():
+    def __init__(self, generation:int, lengths:np.ndarray):
+        self.generation=generation
+        # token count by doc number, 0 for docs that were removed or never existed
+        self.lengths=lengths
+        self.documents=int(np.count_nonzero(lengths))
+        self.average_length=float(lengths.sum())/self.documents if self.documents else 0.0
+
+    def update(self, generation:int, docs:Sequence[int], lengths:Sequence[int]) -> "CollectionState":
+        """
+            state after a write made by this process, without reading every length again
+        """
+        grown=np.zeros(max(len(self.lengths), max(docs, default=-1)+1), dtype=np.int64)
+        grown[:len(self.lengths)]=self.lengths
+        grown[list(docs)]=lengths
+        return CollectionState(generation, grown)
+
+
+class LexicalIndexModel():
+    def __init__(self, path:str, k1:float=1.2, b:float=0.75, merge_segments:int=16, text_key:str="text"):
+        """
+            BM25 inverted index of chunk texts per (database, collection), kept in sync by the vector
+            database as chunks are written and deleted. Every write adds a segment of varint delta
+            encoded postings with positions, merge_segments segments of a level are merged into one
+            of the next level, which also drops removed chunks. Quoted parts of a query must match
+            as exact phrases. Queries never touch the embedding model
+        """
+        directory=os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path=path
+        self.k1=k1
+        self.b=b
+        self.merge_segments=merge_segments
+        self.text_key=text_key
+        self.lock=threading.Lock()
+        self.states:Dict[int,CollectionState]={}
+        self.connection=sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS lexical_collection (id INTEGER PRIMARY KEY, database TEXT NOT NULL, name TEXT NOT NULL, next_doc INTEGER NOT NULL DEFAULT 0, next_segment INTEGER NOT NULL DEFAULT 0, generation INTEGER NOT NULL DEFAULT 0, UNIQUE (database, name))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS lexical_chunk (collection_id INTEGER NOT NULL, doc INTEGER NOT NULL, chunk_id TEXT NOT NULL, file_id TEXT, length INTEGER NOT NULL, PRIMARY KEY (collection_id, doc)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS lexical_chunk_chunk_id ON lexical_chunk (collection_id, chunk_id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS lexical_chunk_file_id ON lexical_chunk (collection_id, file_id)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS lexical_segment (collection_id INTEGER NOT NULL, segment INTEGER NOT NULL, level INTEGER NOT NULL, PRIMARY KEY (collection_id, segment))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS lexical_posting (collection_id INTEGER NOT NULL, term TEXT NOT NULL, segment INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (collection_id, term, segment)) WITHOUT ROWID")
+
+    def _collectionId(self, database:str, collection:str, create:bool=False) -> Optional[int]:
+        row=self.connection.execute("SELECT id FROM lexical_collection WHERE database=? AND name=?", (database, collection)).fetchone()
+        if row:
+            return row[0]
+        if not create:
+            return None
+        return self.connection.execute("INSERT INTO lexical_collection (database, name) VALUES (?,?)", (database, collection)).lastrowid
+
+    def _state(self, collection_id:int) -> CollectionState:
+        generation, next_doc=self.connection.execute("SELECT generation, next_doc FROM lexical_collection WHERE id=?", (collection_id,)).fetchone()
+        state=self.states.get(collection_id)
+        if state is None or state.generation!=generation:
+            # another process wrote to the collection, or it was never read here
+            lengths=np.zeros(next_doc, dtype=np.int64)
+            rows=self.connection.execute("SELECT doc, length FROM lexical_chunk WHERE collection_id=?", (collection_id,)).fetchall()
+            if rows:
+                docs, doc_lengths=zip(*rows)
+                lengths[list(docs)]=doc_lengths
+            state=self.states[collection_id]=CollectionState(generation, lengths)
+        return state
+
+    def _updateState(self, collection_id:int, generation:int, docs:Sequence[int], lengths:Sequence[int]):
+        state=self.states.get(collection_id)
+        if state is not None and state.generation==generation:
+            self.states[collection_id]=state.update(generation+1, docs, lengths)
+
+    def add(self, database:str, collection:str, documents:Sequence[dict]):
+        """
+            indexes chunk documents that have been written, with their _id and file id, as one new segment
+        """
+        if not documents:
+            return
+        tokenized=[tokenize(document.get(self.text_key) or "") for document in documents]
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                collection_id=self._collectionId(database, collection, create=True)
+                next_doc, segment, generation=self.connection.execute("SELECT next_doc, next_segment, generation FROM lexical_collection WHERE id=?", (collection_id,)).fetchone()
+                terms:Dict[str,Tuple[List[int],List[List[int]]]]=defaultdict(lambda: ([], []))
+                for offset, tokens in enumerate(tokenized):
+                    positions:Dict[str,List[int]]=defaultdict(list)
+                    for position, token in enumerate(tokens):
+                        positions[token].append(position)
+                    for term, term_positions in positions.items():
+                        terms[term][0].append(next_doc+offset)
+                        terms[term][1].append(term_positions)
+                lengths=[max(1, len(tokens)) for tokens in tokenized]
+                self.connection.executemany("INSERT INTO lexical_chunk (collection_id, doc, chunk_id, file_id, length) VALUES (?,?,?,?,?)",
+                    [(collection_id, next_doc+offset, str(document["_id"]), document.get("id"), length) for offset, (document, length) in enumerate(zip(documents, lengths))])
+                blobs=encodeBlobs([postingValues(docs, positions) for docs, positions in terms.values()])
+                self.connection.executemany("INSERT INTO lexical_posting (collection_id, term, segment, data) VALUES (?,?,?,?)",
+                    [(collection_id, term, segment, blob) for term, blob in zip(terms, blobs)])
+                self.connection.execute("INSERT INTO lexical_segment (collection_id, segment, level) VALUES (?,?,0)", (collection_id, segment))
+                self.connection.execute("UPDATE lexical_collection SET next_doc=?, next_segment=?, generation=generation+1 WHERE id=?", (next_doc+len(documents), segment+1, collection_id))
+                self._updateState(collection_id, generation, range(next_doc, next_doc+len(documents)), lengths)
+                self._merge(collection_id)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def _merge(self, collection_id:int):
+        """
+            tiered merging, queries read at most merge_segments segments a level
+        """
+        while True:
+            full=self.connection.execute("SELECT level FROM lexical_segment WHERE collection_id=? GROUP BY level HAVING COUNT(*)>=? ORDER BY level LIMIT 1", (collection_id, self.merge_segments)).fetchone()
+            if not full:
+                return
+            level=full[0]
+            segments=[row[0] for row in self.connection.execute("SELECT segment FROM lexical_segment WHERE collection_id=? AND level=?", (collection_id, level))]
+            merged=self.connection.execute("SELECT next_segment FROM lexical_collection WHERE id=?", (collection_id,)).fetchone()[0]
+            live=self._state(collection_id).lengths>0
+            placeholders=",".join("?"*len(segments))
+            rows=self.connection.execute(f"SELECT term, data FROM lexical_posting WHERE collection_id=? AND segment IN ({placeholders}) ORDER BY term, segment", (collection_id, *segments)).fetchall()
+            # segments hold increasing doc ranges, concatenating them in segment order keeps docs sorted
+            merged_postings:Dict[str,Tuple[List[int],List[List[int]]]]={}
+            for (term, _), values in zip(rows, decodeBlobs([data for _, data in rows])):
+                docs, positions=merged_postings.setdefault(term, ([], []))
+                for doc, doc_positions in zip(*parseValues(values)):
+                    if doc<len(live) and live[doc]:
+                        docs.append(doc)
+                        positions.append(doc_positions)
+            merged_postings={term:postings for term, postings in merged_postings.items() if postings[0]}
+            blobs=encodeBlobs([postingValues(docs, positions) for docs, positions in merged_postings.values()])
+            rows=[(collection_id, term, merged, blob) for term, blob in zip(merged_postings, blobs)]
+            self.connection.execute(f"DELETE FROM lexical_posting WHERE collection_id=? AND segment IN ({placeholders})", (collection_id, *segments))
+            self.connection.execute(f"DELETE FROM lexical_segment WHERE collection_id=? AND segment IN ({placeholders})", (collection_id, *segments))
+            self.connection.executemany("INSERT INTO lexical_posting (collection_id, term, segment, data) VALUES (?,?,?,?)", rows)
+            self.connection.execute("INSERT INTO lexical_segment (collection_id, segment, level) VALUES (?,?,?)", (collection_id, merged, level+1))
+            self.connection.execute("UPDATE lexical_collection SET next_segment=next_segment+1 WHERE id=?", (collection_id,))
+            logger.debug("Merged %s lexical segments of level %s into %s", len(segments), level, merged)
+
+    def _remove(self, database:str, collection:str, column:str, values:Sequence[str]):
+        if not values:
+            return
+        with self.lock:
+            collection_id=self._collectionId(database, collection)
+            if collection_id is None:
+                return
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                generation=self.connection.execute("SELECT generation FROM lexical_collection WHERE id=?", (collection_id,)).fetchone()[0]
+                removed:List[int]=[]
+                for start in range(0, len(values), 500):
+                    batch=[str(value) for value in values[start:start+500]]
+                    placeholders=",".join("?"*len(batch))
+                    removed.extend(row[0] for row in self.connection.execute(f"SELECT doc FROM lexical_chunk WHERE collection_id=? AND {column} IN ({placeholders})", (collection_id, *batch)))
+                    self.connection.execute(f"DELETE FROM lexical_chunk WHERE collection_id=? AND {column} IN ({placeholders})", (collection_id, *batch))
+                # postings of removed docs are dropped at their segment's next merge
+                self.connection.execute("UPDATE lexical_collection SET generation=generation+1 WHERE id=?", (collection_id,))
+                self._updateState(collection_id, generation, removed, [0]*len(removed))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def removeChunks(self, database:str, collection:str, chunk_ids:Sequence[str]):
+        self._remove(database, collection, "chunk_id", chunk_ids)
+
+    def removeFiles(self, database:str, collection:str, file_ids:Sequence[str]):
+        self._remove(database, collection, "file_id", file_ids)
+
+    def drop(self, database:str, collection:Optional[str]=None):
+        """
+            forgets a collection, or every collection of the database
+        """
+        with self.lock:
+            query="SELECT id FROM lexical_collection WHERE database=?"+(" AND name=?" if collection is not None else "")
+            ids=[row[0] for row in self.connection.execute(query, (database,) if collection is None else (database, collection))]
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for collection_id in ids:
+                    for table in ("lexical_posting","lexical_segment","lexical_chunk"):
+                        self.connection.execute(f"DELETE FROM {table} WHERE collection_id=?", (collection_id,))
+                    self.connection.execute("DELETE FROM lexical_collection WHERE id=?", (collection_id,))
+                    self.states.pop(collection_id, None)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def rebuild(self, database:str, collection:str, documents:Iterable[dict], batch_size:int=1000) -> int:
+        """
+            indexes an existing collection from scratch, e.g. chunks written before the index existed
+        """
+        self.drop(database, collection)
+        indexed=0
+        batch:List[dict]=[]
+        for document in documents:
+            batch.append(document)
+            if len(batch)==batch_size:
+                self.add(database, collection, batch)
+                indexed+=len(batch)
+                batch=[]
+        self.add(database, collection, batch)
+        return indexed+len(batch)
+
+    def _postings(self, collection_id:int, term:str) -> List[Postings]:
+        return [decodePostings(row[0]) for row in self.connection.execute("SELECT data FROM lexical_posting WHERE collection_id=? AND term=?", (collection_id, term))]
+
+    def search(self, database:str, collection:str, query:str, k:int=4, file_id:Optional[str]=None) -> List[Tuple[str,float]]:
+        """
+            top k (chunk id, BM25 score), every quoted phrase of the query has to appear in a chunk
+            for it to match
+        """
+        terms=list(dict.fromkeys(tokenize(query)))
+        phrases=[tokenize(phrase) for phrase in PHRASE.findall(query)]
+        phrases=[phrase for phrase in phrases if phrase]
+        if not terms:
+            return []
+        with self.lock:
+            collection_id=self._collectionId(database, collection)
+            if collection_id is None:
+                return []
+            state=self._state(collection_id)
+            postings={term:self._postings(collection_id, term) for term in terms}
+            allowed=None
+            if file_id is not None:
+                allowed=np.array([row[0] for row in self.connection.execute("SELECT doc FROM lexical_chunk WHERE collection_id=? AND file_id=?", (collection_id, str(file_id)))], dtype=np.int64)
+        if not state.documents:
+            return []
+
+        docs_by_term:Dict[str,np.ndarray]={}
+        all_docs:List[np.ndarray]=[]
+        all_scores:List[np.ndarray]=[]
+        for term, segments in postings.items():
+            if not segments:
+                docs_by_term[term]=np.zeros(0, dtype=np.int64)
+                continue
+            docs=np.concatenate([segment.docs for segment in segments])
+            tfs=np.concatenate([segment.tfs for segment in segments]).astype(np.float64)
+            live=(docs<len(state.lengths))
+            live[live]=state.lengths[docs[live]]>0
+            docs, tfs=docs[live], tfs[live]
+            docs_by_term[term]=docs
+            if not len(docs):
+                continue
+            idf=math.log(1+(state.documents-len(docs)+0.5)/(len(docs)+0.5))
+            norm=self.k1*(1-self.b+self.b*state.lengths[docs]/state.average_length)
+            all_docs.append(docs)
+            all_scores.append(idf*tfs*(self.k1+1)/(tfs+norm))
+        if not all_docs:
+            return []
+        docs, inverse=np.unique(np.concatenate(all_docs), return_inverse=True)
+        scores=np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        keep=np.ones(len(docs), dtype=bool)
+        if allowed is not None:
+            keep&=np.isin(docs, allowed)
+        for phrase in phrases:
+            keep&=np.isin(docs, self._phraseDocs(phrase, postings, docs_by_term, docs[keep]))
+        docs, scores=docs[keep], scores[keep]
+        if not len(docs):
+            return []
+        top=np.argsort(-scores, kind="stable")[:k]
+
+        with self.lock:
+            placeholders=",".join("?"*len(top))
+            chunk_ids=dict(self.connection.execute(f"SELECT doc, chunk_id FROM lexical_chunk WHERE collection_id=? AND doc IN ({placeholders})", (collection_id, *[int(doc) for doc in docs[top]])).fetchall())
+        return [(chunk_ids[int(docs[position])], float(scores[position])) for position in top if int(docs[position]) in chunk_ids]
+
+    def _phraseDocs(self, phrase:List[str], postings:Dict[str,List[Postings]], docs_by_term:Dict[str,np.ndarray], candidates:np.ndarray) -> np.ndarray:
+        """
+            candidate docs where the words of the phrase appear at consecutive positions
+        """
+        for term in phrase:
+            candidates=np.intersect1d(candidates, docs_by_term.get(term, np.zeros(0, dtype=np.int64)))
+        if len(phrase)==1 or not len(candidates):
+            return candidates
+        wanted=set(int(doc) for doc in candidates)
+        # positions of every phrase word in the candidate docs, shifted back to where the phrase starts
+        starts:Dict[int,set]={}
+        for offset, term in enumerate(phrase):
+            found:Dict[int,set]=defaultdict(set)
+            for segment in postings[term]:
+                for index in np.flatnonzero(np.isin(segment.docs, candidates)):
+                    doc=int(segment.docs[index])
+                    if doc in wanted:
+                        found[doc].update(int(position)-offset for position in segment.positions[segment.offsets[index]:segment.offsets[index+1]])
+            starts=found if not offset else {doc:positions&found.get(doc, set()) for doc, positions in starts.items()}
+        return np.array([doc for doc, positions in starts.items() if positions], dtype=np.int64)
+
+    def stats(self) -> dict:
+        with self.lock:
+            collections, =self.connection.execute("SELECT COUNT(*) FROM lexical_collection").fetchone()
+            chunks, =self.connection.execute("SELECT COUNT(*) FROM lexical_chunk").fetchone()
+            segments, =self.connection.execute("SELECT COUNT(*) FROM lexical_segment").fetchone()
+            postings, posting_bytes=self.connection.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)),0) FROM lexical_posting").fetchone()
+        return {"collections":collections,"chunks":chunks,"segments":segments,"postings":postings,"posting_bytes":posting_bytes}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,144 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+
+logger=logging.getLogger(__name__)
+
+DEFAULT_BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0,120.0,300.0)
+
+
+def _labels(names:Sequence[str], values:Tuple[str,...], extra:str="") -> str:
+    pairs=[f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{"+",".join(pairs)+"}" if pairs else ""
+
+
+class Counter():
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=()):
+        self.name=name
+        self.help=help
+        self.labelnames=tuple(labelnames)
+        self.values:Dict[Tuple[str,...],float]={}
+        self.lock=threading.Lock()
+
+    def inc(self, amount:float=1.0, **labels):
+        key=tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key]=self.values.get(key,0.0)+amount
+
+    def render(self) -> List[str]:
+        lines=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames,key)} {value}")
+        return lines
+
+
+class Histogram():
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=(), buckets:Sequence[float]=DEFAULT_BUCKETS):
+        self.name=name
+        self.help=help
+        self.labelnames=tuple(labelnames)
+        self.buckets=tuple(sorted(buckets))
+        # per label set : counts per bucket (last one is +Inf), sum, count
+        self.values:Dict[Tuple[str,...],list]={}
+        self.lock=threading.Lock()
+
+    def observe(self, value:float, **labels):
+        key=tuple(str(labels[name]) for name in self.labelnames)
+        index=bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series=self.values.get(key)
+            if series is None:
+                series=self.values[key]=[[0]*(len(self.buckets)+1),0.0,0]
+            series[0][index]+=1
+            series[1]+=value
+            series[2]+=1
+
+    def render(self) -> List[str]:
+        lines=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative=0
+                for bound, bucket in zip(self.buckets+(math.inf,), counts):
+                    cumulative+=bucket
+                    le='le="+Inf"' if bound==math.inf else f'le="{float(bound)!r}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames,key,le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames,key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames,key)} {count}")
+        return lines
+
+
+class MetricsRegistryModel():
+    def __init__(self):
+        """
+            counters and histograms rendered in the prometheus text exposition format
+        """
+        self.metrics:Dict[str,object]={}
+        self.lock=threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name:str, help:str, labelnames:Sequence[str]=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name:str, help:str, labelnames:Sequence[str]=(), buckets:Sequence[float]=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics=list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render())+"\n"
+
+
+REGISTRY=MetricsRegistryModel()
+
+STAGE_SECONDS=REGISTRY.histogram("audio_vectorize_stage_seconds","Time spent in each pipeline stage",["stage"])
+AUDIO_SECONDS=REGISTRY.counter("audio_vectorize_audio_seconds_total","Seconds of audio transcribed")
+CHUNKS=REGISTRY.counter("audio_vectorize_chunks_total","Audio chunks transcribed, by where the text came from",["source"])
+FILES=REGISTRY.counter("audio_vectorize_files_total","Uploaded files by ingestion outcome",["status"])
+DOCUMENTS=REGISTRY.counter("audio_vectorize_documents_total","Text chunks written to the vector store")
+
+
+@contextmanager
+def timed(stage:str) -> Iterator[None]:
+    """
+        span around one stage, observed into the stage histogram and logged at debug level
+    """
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds=time.perf_counter()-start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        logger.debug("%s took %.3f s", stage, seconds)
+
+
+class StageTimer():
+    """
+        accumulates the time of one stage spread over many short steps, e.g. every window
+        of a streaming decode, and observes the total once
+    """
+    def __init__(self, stage:str):
+        self.stage=stage
+        self.seconds=0.0
+
+    @contextmanager
+    def step(self) -> Iterator[None]:
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds+=time.perf_counter()-start
+
+    def observe(self):
+        STAGE_SECONDS.observe(self.seconds, stage=self.stage)
+        logger.debug("%s took %.3f s", self.stage, self.seconds)
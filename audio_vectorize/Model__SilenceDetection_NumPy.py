@@ -0,0 +1,138 @@
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+
+SAMPLE_DTYPES={1:np.int8, 2:np.int16, 4:np.int32}
+BLOCK_FRAMES=1<<20
+
+
+class SilenceDetectionModel():
+    def __init__(self, frame_rate:int, channels:int=1, sample_width:int=2):
+        """
+            pydub.silence on a raw sample array, every window rms comes from a
+            prefix sum of squares instead of one audioop call per millisecond.
+            Results are the same ranges pydub returns for the same audio
+        """
+        if sample_width not in SAMPLE_DTYPES:
+            raise Exception(f"Unsupported sample width {sample_width}")
+        self.frame_rate=frame_rate
+        self.channels=channels
+        self.sample_width=sample_width
+        self.max_possible_amplitude=float(1<<(8*sample_width-1))
+        # squares of 32 bit samples overflow int64 sums, audioop uses doubles for them too
+        self.square_dtype=np.float64 if sample_width==4 else np.int64
+
+    def samples(self, data) -> np.ndarray:
+        """
+            raw PCM bytes -> interleaved sample array, no copy
+        """
+        data=memoryview(data)
+        usable=len(data)-len(data)%(self.sample_width*self.channels)
+        return np.frombuffer(data[:usable], dtype=SAMPLE_DTYPES[self.sample_width])
+
+    def lengthMs(self, samples:np.ndarray) -> int:
+        return round(1000*(len(samples)//self.channels)/self.frame_rate)
+
+    def squareSum(self, samples:np.ndarray) -> float:
+        total=0
+        for block in range(0, len(samples), BLOCK_FRAMES):
+            part=samples[block:block+BLOCK_FRAMES].astype(self.square_dtype)
+            total+=np.dot(part, part).item()
+        return total
+
+    def dBFS(self, samples:np.ndarray) -> float:
+        """
+            same as AudioSegment.dBFS, including audioop's integer rms
+        """
+        if not len(samples):
+            return -math.inf
+        rms=int(math.sqrt(self.squareSum(samples)/len(samples)))
+        if not rms:
+            return -math.inf
+        return 20*math.log10(rms/self.max_possible_amplitude)
+
+    def _msSquareSums(self, samples:np.ndarray, length_ms:int) -> Tuple[np.ndarray,np.ndarray]:
+        """
+            prefix sums of squares at every millisecond boundary pydub slices on
+        """
+        frames=len(samples)//self.channels
+        boundaries=(np.arange(length_ms+1, dtype=np.float64)*(self.frame_rate/1000.0)).astype(np.int64)
+        sample_boundaries=np.minimum(boundaries, frames)*self.channels
+
+        prefix=np.zeros(length_ms+1, dtype=self.square_dtype)
+        running=0
+        position=0
+        # square in blocks so a multi-hour array never gets an int64 copy of itself
+        for block_start in range(0, len(samples), BLOCK_FRAMES*self.channels):
+            block=samples[block_start:block_start+BLOCK_FRAMES*self.channels].astype(self.square_dtype)
+            cumulative=np.cumsum(block*block)
+            block_end=block_start+len(block)
+            stop=np.searchsorted(sample_boundaries, block_end, side="right")
+            inside=sample_boundaries[position:stop]-block_start
+            prefix[position:stop]=running+np.where(inside>0, cumulative[np.maximum(inside-1,0)], 0)
+            running+=cumulative[-1].item()
+            position=stop
+        prefix[position:]=running
+        return prefix, boundaries
+
+    def detectSilence(self, samples:np.ndarray, min_silence_len:int=1000, silence_thresh:float=-16, seek_step:int=1) -> List[List[int]]:
+        length_ms=self.lengthMs(samples)
+        if length_ms<min_silence_len:
+            return []
+
+        threshold=10**(silence_thresh/20)*self.max_possible_amplitude
+        prefix, boundaries=self._msSquareSums(samples, length_ms)
+
+        last_slice_start=length_ms-min_silence_len
+        starts=np.arange(0, last_slice_start+1, seek_step, dtype=np.int64)
+        if last_slice_start%seek_step:
+            starts=np.append(starts, last_slice_start)
+        ends=starts+min_silence_len
+
+        counts=(boundaries[ends]-boundaries[starts])*self.channels
+        sums=prefix[ends]-prefix[starts]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rms=np.floor(np.sqrt(np.where(counts>0, sums/np.maximum(counts,1), 0.0)))
+        silence_starts=starts[rms<=threshold]
+        if not len(silence_starts):
+            return []
+
+        # a new range begins where pydub's loop would see a gap
+        gaps=np.diff(silence_starts)
+        breaks=np.flatnonzero((gaps!=seek_step)&(gaps>min_silence_len))
+        range_starts=np.concatenate(([silence_starts[0]], silence_starts[breaks+1]))
+        range_ends=np.concatenate((silence_starts[breaks], [silence_starts[-1]]))+min_silence_len
+        return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+    def detectNonsilent(self, samples:np.ndarray, min_silence_len:int=1000, silence_thresh:float=-16, seek_step:int=1) -> List[List[int]]:
+        silent_ranges=self.detectSilence(samples, min_silence_len, silence_thresh, seek_step)
+        length_ms=self.lengthMs(samples)
+        if not silent_ranges:
+            return [[0, length_ms]]
+        if silent_ranges[0][0]==0 and silent_ranges[0][1]==length_ms:
+            return []
+
+        nonsilent_ranges=[]
+        previous_end=0
+        for start, end in silent_ranges:
+            nonsilent_ranges.append([previous_end, start])
+            previous_end=end
+        if silent_ranges[-1][1]!=length_ms:
+            nonsilent_ranges.append([previous_end, length_ms])
+        if nonsilent_ranges[0]==[0, 0]:
+            nonsilent_ranges.pop(0)
+        return nonsilent_ranges
+
+    def splitOnSilence(self, samples:np.ndarray, min_silence_len:int=1000, silence_thresh:float=-16, keep_silence:int=100, seek_step:int=1) -> List[List[int]]:
+        """
+            chunk boundaries in ms, same as split_on_silence, slice the audio with them
+        """
+        length_ms=self.lengthMs(samples)
+        output_ranges=[[start-keep_silence, end+keep_silence] for start, end in self.detectNonsilent(samples, min_silence_len, silence_thresh, seek_step)]
+        for current, following in zip(output_ranges, output_ranges[1:]):
+            if following[0]<current[1]:
+                current[1]=(current[1]+following[0])//2
+                following[0]=current[1]
+        return [[max(start,0), min(end,length_ms)] for start, end in output_ranges]
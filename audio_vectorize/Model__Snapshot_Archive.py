@@ -0,0 +1,287 @@
+"""
+    collection snapshots, the file rows, chunks and embeddings of one collection in a directory that
+    can be copied between environments and loaded again without transcribing or embedding anything
+
+    <path>/manifest.json            written last, a snapshot without one is incomplete
+    <path>/files.jsonl.gz           File rows
+    <path>/chunks-00000.jsonl.gz    chunk documents without their embeddings, shard_rows a shard
+    <path>/vectors-00000.npy        their embeddings in the snapshot dtype, np.load(mmap_mode="r") ready
+    <path>/scales-00000.npy         per-row scales of int8 vectors
+
+    python -m audio_vectorize.Model__Snapshot_Archive export <database_id> <collection_id> <path>
+    python -m audio_vectorize.Model__Snapshot_Archive import <database_id> <collection_id> <path> [--reembed]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from audio_vectorize.Model__VectorStorage_Quantized import STORAGE_DTYPES, VectorStorageModel
+
+
+logger=logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT="audio_vectorize.snapshot"
+SNAPSHOT_VERSION=1
+MANIFEST="manifest.json"
+FILES="files.jsonl.gz"
+# File columns a snapshot carries, the collection is the one it is imported into
+FILE_FIELDS=("id","name","size","type","format","created_at","updated_at","status","content_hash")
+
+
+def writeJsonLines(path:str, rows:Iterable[dict], compresslevel:int=6):
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel) as output:
+        for row in rows:
+            output.write(json.dumps(row, default=str, ensure_ascii=False))
+            output.write("\n")
+
+
+def readJsonLines(path:str) -> List[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+
+def readManifest(path:str) -> dict:
+    manifest_path=os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise Exception(f"No snapshot at {path}, {MANIFEST} is missing")
+    with open(manifest_path) as source:
+        manifest=json.load(source)
+    if manifest.get("format")!=SNAPSHOT_FORMAT or manifest.get("version")!=SNAPSHOT_VERSION:
+        raise Exception(f"Unsupported snapshot {manifest.get('format')} version {manifest.get('version')}")
+    return manifest
+
+
+def listSnapshots(directory:str) -> List[dict]:
+    """
+        name and summary of every complete snapshot in directory
+    """
+    if not os.path.isdir(directory):
+        return []
+    snapshots=[]
+    for name in sorted(os.listdir(directory)):
+        try:
+            manifest=readManifest(os.path.join(directory, name))
+        except Exception:
+            continue
+        snapshots.append({"name":name,**{key:manifest[key] for key in ("created_at","database","collection","embedding_model","dtype","dimension","chunks")},"files":manifest["files"]["count"]})
+    return snapshots
+
+
+class SnapshotModel():
+    def __init__(self, files_database, vector_database, embeddings=None, cache=None, workers:int=4, shard_rows:int=10000, compresslevel:int=6):
+        """
+            embeddings : the model chunks are embedded with, its name goes into the manifest and has
+                         to match on import unless the import re-embeds with it
+            cache : optional embedding cache, seeded with the vectors of float32 snapshots so quantized
+                    storage can rescore imported chunks
+            workers : shards compressed or loaded at once, each holds up to shard_rows chunks in memory
+        """
+        self.files_database=files_database
+        self.vector_database=vector_database
+        self.embeddings=embeddings
+        self.cache=cache
+        self.workers=workers
+        self.shard_rows=shard_rows
+        self.compresslevel=compresslevel
+
+    def export(self, database:str, collection:str, collection_id:str, path:str, dtype:Optional[str]=None) -> dict:
+        """
+            writes a snapshot of the collection to path, embeddings are kept in dtype, by default the
+            vector store's own mode. Shards are compressed on the pool while the next one is read
+        """
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            raise Exception(f"Snapshot already exists at {path}")
+        storage=VectorStorageModel(dtype or self.vector_database.storage.dtype)
+        os.makedirs(path, exist_ok=True)
+        started=time.perf_counter()
+
+        files=self.files_database.getFiles(collection_id)
+        writeJsonLines(os.path.join(path, FILES), [{field:getattr(file, field) for field in FILE_FIELDS} for file in files], self.compresslevel)
+
+        shards:List[dict]=[]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="snapshot-export") as pool:
+            pending:List[Future]=[]
+            for number, documents in enumerate(self.vector_database.Iter_Chunks(database, collection, self.shard_rows)):
+                if len(pending)>=self.workers:
+                    shards.append(pending.pop(0).result())
+                pending.append(pool.submit(self._writeShard, path, number, documents, storage))
+            shards.extend(future.result() for future in pending)
+
+        manifest={
+            "format":SNAPSHOT_FORMAT,
+            "version":SNAPSHOT_VERSION,
+            "created_at":datetime.now().isoformat(),
+            "database":database,
+            "collection":collection,
+            "embedding_model":self.embeddings.model_name if self.embeddings else None,
+            "dtype":storage.dtype,
+            "dimension":shards[0]["dimension"] if shards else None,
+            "files":{"path":FILES,"count":len(files)},
+            "chunks":sum(shard["rows"] for shard in shards),
+            "shards":shards,
+        }
+        temporary=os.path.join(path, MANIFEST+".tmp")
+        with open(temporary, "w") as output:
+            json.dump(manifest, output, indent=2)
+        os.replace(temporary, os.path.join(path, MANIFEST))
+        logger.info("Exported %s files and %s chunks of %s.%s to %s in %s s", len(files), manifest["chunks"], database, collection, path, round(time.perf_counter()-started,2))
+        return manifest
+
+    def _writeShard(self, path:str, number:int, documents:List[dict], storage:VectorStorageModel) -> dict:
+        source=self.vector_database.storage
+        vectors=[]
+        for document in documents:
+            vector=source.decode(document)
+            if vector is None:
+                raise Exception(f"Chunk {document.get('_id')} has no embedding")
+            vectors.append(vector)
+            source.strip(document)
+            document.pop("_id", None)
+        values, scales=storage.quantize(vectors)
+        shard={"chunks":f"chunks-{number:05d}.jsonl.gz","vectors":f"vectors-{number:05d}.npy","scales":f"scales-{number:05d}.npy" if scales is not None else None,"rows":len(documents),"dimension":int(values.shape[1])}
+        np.save(os.path.join(path, shard["vectors"]), values)
+        if scales is not None:
+            np.save(os.path.join(path, shard["scales"]), scales.astype(np.float32))
+        writeJsonLines(os.path.join(path, shard["chunks"]), documents, self.compresslevel)
+        return shard
+
+    def restore(self, path:str, database:str, collection:str, collection_id:str, reembed:bool=False) -> dict:
+        """
+            loads a snapshot into a collection, the file rows go into the files database while the
+            pool loads the shards into the vector store. Files get new ids so a snapshot can be loaded
+            next to its source, they stay ingesting until every shard is in and are left partial when
+            one fails. reembed embeds the chunk texts with the current model instead of loading the
+            stored vectors, for snapshots taken under another model
+        """
+        manifest=readManifest(path)
+        model_name=self.embeddings.model_name if self.embeddings else None
+        if reembed and not self.embeddings:
+            raise Exception("Re-embedding a snapshot needs an embedding model")
+        if not reembed and manifest["embedding_model"] and model_name and manifest["embedding_model"]!=model_name:
+            raise Exception(f"Snapshot was embedded with {manifest['embedding_model']}, not {model_name}, import it with reembed")
+        started=time.perf_counter()
+
+        files=readJsonLines(os.path.join(path, manifest["files"]["path"]))
+        ids={str(file["id"]):str(uuid.uuid4()) for file in files}
+        rows=[{field:file.get(field) for field in FILE_FIELDS} for file in files]
+        for row in rows:
+            row["id"]=ids[str(row["id"])]
+            row["created_at"]=datetime.fromisoformat(row["created_at"])
+            row["updated_at"]=datetime.fromisoformat(row["updated_at"])
+
+        failure:Optional[Exception]=None
+        files_written=False
+        chunks=0
+        with ThreadPoolExecutor(max_workers=self.workers+1, thread_name_prefix="snapshot-import") as pool:
+            files_future=pool.submit(self.files_database.importFiles, rows, collection_id)
+            shard_futures=[pool.submit(self._loadShard, path, shard, manifest, database, collection, ids, reembed) for shard in manifest["shards"]]
+            try:
+                files_future.result()
+                files_written=True
+            except Exception as e:
+                failure=e
+                for future in shard_futures:
+                    future.cancel()
+            for future in shard_futures:
+                if future.cancelled():
+                    continue
+                try:
+                    chunks+=future.result()
+                except Exception as e:
+                    failure=failure or e
+
+        if failure:
+            logger.error("Importing snapshot %s into %s.%s failed: %s", path, database, collection, failure)
+            if files_written:
+                self.files_database.setFilesStatus(list(ids.values()), "partial")
+            else:
+                # no rows point at the chunks that made it in
+                self.vector_database.Delete_Files(list(ids.values()), database, collection)
+            raise failure
+
+        statuses:Dict[str,List[str]]={}
+        for row, file in zip(rows, files):
+            statuses.setdefault(file.get("status") or "complete", []).append(row["id"])
+        for status, file_ids in statuses.items():
+            self.files_database.setFilesStatus(file_ids, status)
+        seconds=time.perf_counter()-started
+        logger.info("Imported %s files and %s chunks from %s into %s.%s in %s s", len(rows), chunks, path, database, collection, round(seconds,2))
+        return {"files":len(rows),"chunks":chunks,"reembedded":reembed,"seconds":seconds,"file_ids":ids}
+
+    def _loadShard(self, path:str, shard:dict, manifest:dict, database:str, collection:str, ids:Dict[str,str], reembed:bool) -> int:
+        documents=readJsonLines(os.path.join(path, shard["chunks"]))
+        for document in documents:
+            if "id" in document:
+                document["id"]=ids.get(str(document["id"]), document["id"])
+        if reembed:
+            vectors=self.embeddings.embed_documents([document.get("text","") for document in documents])
+        else:
+            values=np.load(os.path.join(path, shard["vectors"]), mmap_mode="r")
+            if len(values)!=len(documents):
+                raise Exception(f"Shard {shard['vectors']} has {len(values)} vectors for {len(documents)} chunks")
+            vectors=VectorStorageModel.dequantize(values, np.load(os.path.join(path, shard["scales"])) if shard.get("scales") else None)
+            if self.cache and manifest["dtype"]=="float32" and manifest["embedding_model"]:
+                hashed=[(document["content_hash"], vector) for document, vector in zip(documents, vectors) if document.get("content_hash")]
+                self.cache.putMany(manifest["embedding_model"], [key for key, _ in hashed], [vector for _, vector in hashed])
+        return self.vector_database.Import_Chunks(documents, vectors, database, collection)
+
+
+def main():
+    from dotenv import load_dotenv, find_dotenv
+    from audio_vectorize.Model__FileManagement_PostgressSQL import FileManagementModel
+    from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import MongoDBAtlas
+    from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel
+    from audio_vectorize.Model__Embedding_HuggingFace import HuggingFaceEmbeddingsModel
+    from audio_vectorize.Model__EmbeddingServer_Socket import RemoteEmbeddingsModel
+
+    parser=argparse.ArgumentParser(description="export a collection to a snapshot or import one into a collection")
+    parser.add_argument("action", choices=["export","import"])
+    parser.add_argument("database_id")
+    parser.add_argument("collection_id")
+    parser.add_argument("path")
+    parser.add_argument("--reembed", action="store_true", help="embed the chunk texts again instead of loading the stored vectors")
+    parser.add_argument("--dtype", choices=STORAGE_DTYPES, help="embedding dtype of an export, the vector storage mode by default")
+    parser.add_argument("--workers", type=int)
+    args=parser.parse_args()
+
+    _:bool=load_dotenv(find_dotenv())
+    logging.basicConfig(level=os.getenv('LOG_LEVEL','INFO').upper(),format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    files_database=FileManagementModel(os.getenv('NEON_CONNECTION_STRING'))
+    files_database.createTable()
+    try:
+        # the same check as the HTTP routes, a collection id of another database is refused
+        database, collection=files_database.getDatabaseAndCollection(args.database_id,args.collection_id)
+    except Exception as e:
+        parser.error(str(e))
+    lexical=LexicalIndexModel(os.getenv('LEXICAL_INDEX_PATH','.cache/lexical.sqlite3')) if os.getenv('LEXICAL_INDEX','true').lower()=="true" else None
+    vector_database=MongoDBAtlas(os.getenv('MONGODBATLAS_CONNECTION_STRING'),storage=VectorStorageModel(os.getenv('VECTOR_STORAGE','float32')),lexical=lexical)
+    # the embedding cache belongs to the API process or the embedding server, this one does not write to it
+    if os.getenv('EMBEDDING_SERVER_ADDRESS'):
+        authkey=os.getenv('EMBEDDING_SERVER_AUTHKEY')
+        embeddings=RemoteEmbeddingsModel(os.getenv('EMBEDDING_SERVER_ADDRESS'),authkey.encode() if authkey else None)
+    else:
+        embeddings=HuggingFaceEmbeddingsModel(os.getenv('EMBEDDING_MODEL_NAME'),batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE','32')),max_tokens_per_batch=int(os.getenv('EMBEDDING_MAX_TOKENS_PER_BATCH','16384')))
+    snapshots=SnapshotModel(files_database,vector_database,embeddings,workers=args.workers or int(os.getenv('SNAPSHOT_WORKERS','4')))
+    try:
+        if args.action=="export":
+            manifest=snapshots.export(database.name,collection.name,args.collection_id,args.path,args.dtype)
+            print(json.dumps({key:value for key, value in manifest.items() if key!="shards"},indent=2))
+        else:
+            result=snapshots.restore(args.path,database.name,collection.name,args.collection_id,args.reembed)
+            print(json.dumps({key:value for key, value in result.items() if key!="file_ids"},indent=2))
+    finally:
+        if lexical:
+            lexical.close()
+
+
+if __name__=="__main__":
+    main()
@@ -1,5 +1,9 @@
+import logging
+
 from google.cloud import speech
 
+logger=logging.getLogger(__name__)
+
 class GoogleSpeechToText():
     def __init__(self) -> None:
         self.client = speech.SpeechClient()
@@ -15,7 +19,7 @@ class GoogleSpeechToText():
         operation = self.client.long_running_recognize(config=config, audio=audio)
         response = operation.result()
         for result in response.results:
-            print(f"Transcript: {result.alternatives[0].transcript}")
+            logger.debug("Transcript: %s", result.alternatives[0].transcript)
         return response.results[0].alternatives[0].transcript
     """
         audio = speech.RecognitionAudio(content=audio_file.content)
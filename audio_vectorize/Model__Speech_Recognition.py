@@ -1,51 +1,193 @@
 import speech_recognition as sr
-import io
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from typing import List
+import asyncio
+import hashlib
+import json
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
+from audio_vectorize.Model__AudioStream_FFmpeg import AudioStreamModel
+from audio_vectorize.Model__IngestCheckpoint_SQLite import IngestCheckpointModel
+from audio_vectorize.Model__Metrics_Prometheus import AUDIO_SECONDS, CHUNKS, timed
+from audio_vectorize.Model__TextChunker_Recursive import Transcript
+from audio_vectorize.Model__TranscriptionCache_SQLite import TranscriptionCacheModel
 
 
-class SpeechRecognitionModel():
-    def __init__(self):
+logger=logging.getLogger(__name__)
+
+
+class GoogleRecognizer():
+    """
+        default recognizer backend, any object with recognize(sr.AudioData) -> str can replace it
+    """
+    def __init__(self, language:str="en-US"):
         self.r = sr.Recognizer()
+        self.language = language
+
+    def recognize(self, audio:sr.AudioData) -> str:
+        return self.r.recognize_google(audio, language=self.language)
+
+    def settings(self) -> dict:
+        return {"backend":"google","language":self.language}
+
+
+def _recognizeChunk(recognizer, pcm:bytes, sample_rate:int, sample_width:int) -> str:
+    """
+        runs inside the pool, kept at module level so process pools can pickle it
+    """
+    return recognizer.recognize(sr.AudioData(pcm, sample_rate, sample_width))
+
+
+class SpeechRecognitionModel():
+    def __init__(self, recognizer=None, max_workers:int=4, executor:str="thread", stream:AudioStreamModel=None, cache:TranscriptionCacheModel=None, checkpoints:IngestCheckpointModel=None):
+        """
+            recognizer : backend with recognize(sr.AudioData) -> str, defaults to google
+            max_workers : max chunks recognized at the same time
+            executor : "thread" or "process" pool for recognition calls
+            stream : decoder/silence splitter feeding PCM chunks to the recognizer
+            cache : optional transcript cache, whole files and single chunks are looked up before recognizing
+            checkpoints : optional per chunk progress, a failed file is resumed after its last finished chunk
+        """
+        self.recognizer = recognizer or GoogleRecognizer()
+        self.stream = stream or AudioStreamModel()
+        self.cache = cache
+        self.checkpoints = checkpoints
+        self.max_workers = max_workers
+        if executor == "process":
+            self.executor:Executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif executor == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speech-recognition")
+        else:
+            raise Exception(f"Unknown executor {executor}, expected thread or process")
+
+    def settingsKey(self) -> str:
+        """
+            everything besides the audio that changes a transcript, part of every cache key
+        """
+        recognizer=getattr(self.recognizer, "settings", None)
+        return json.dumps({
+            "recognizer":recognizer() if recognizer else type(self.recognizer).__name__,
+            "sample_rate":self.stream.sample_rate,
+            "channels":self.stream.channels,
+            "min_silence_len":self.stream.min_silence_len,
+            "silence_offset":self.stream.silence_offset,
+            "keep_silence":self.stream.keep_silence,
+            "max_chunk_ms":self.stream.max_chunk_ms,
+        }, sort_keys=True)
+
+    def fileKey(self, source, sha256:Optional[str]=None) -> str:
+        """
+            hash of the uploaded bytes, a hit skips decoding as well as recognition.
+            sha256 is the upload's digest when it was already hashed while spooling
+        """
+        if sha256 is None:
+            content=hashlib.sha256()
+            source.seek(0)
+            for block in iter(lambda: source.read(1024*1024), b""):
+                content.update(block)
+            source.seek(0)
+            sha256=content.hexdigest()
+        digest=hashlib.sha256(self.settingsKey().encode())
+        digest.update(sha256.encode())
+        return "file:"+digest.hexdigest()
+
+    def chunkKey(self, pcm:bytes) -> str:
+        """
+            hash of the decoded PCM, re-encoded or partly edited uploads still hit on unchanged chunks
+        """
+        digest=hashlib.sha256(self.settingsKey().encode())
+        digest.update(pcm)
+        return "chunk:"+digest.hexdigest()
+
+    def _nextChunk(self, chunks):
+        chunk=next(chunks, None)
+        if chunk is None or not self.cache:
+            return chunk, None, None
+        key=self.chunkKey(chunk.data)
+        return chunk, key, self.cache.get(key)
+
+    async def audioToText(self, audiofile, sha256:Optional[str]=None) -> Transcript:
+        """
+            transcript of the whole file, chunk transcripts joined in audio order with the time
+            range each came from
+        """
+        logger.debug("Transcribing %s", audiofile.filename)
+        file_key=None
+        if self.cache or self.checkpoints:
+            file_key=await asyncio.to_thread(self.fileKey, audiofile.file, sha256)
+        if self.cache:
+            cached=await asyncio.to_thread(self.cache.get, file_key)
+            if cached is not None:
+                logger.debug("Transcription cache hit for %s", audiofile.filename)
+                return Transcript.loads(cached)
+
+        # chunk index : (text, start ms, end ms)
+        transcriptions:Dict[int,Tuple[str,int,int]]={}
+        start_ms=0
+        if self.checkpoints:
+            done=await asyncio.to_thread(self.checkpoints.resume, file_key)
+            if done:
+                transcriptions.update((chunk.index, (chunk.text, chunk.start_ms, chunk.end_ms)) for chunk in done)
+                start_ms=done[-1].end_ms
+                logger.info("Resuming %s after %s finished chunks at %s ms", audiofile.filename, len(done), start_ms)
+
+        loop=asyncio.get_running_loop()
+        # decoding and splitting run in a thread, one chunk at a time, so at most
+        # max_workers chunks are held in memory besides the decode window
+        chunks=self.stream.chunks(audiofile.file, start_ms, len(transcriptions))
+        semaphore=asyncio.Semaphore(self.max_workers)
+        tasks:List[asyncio.Future]=[]
+
+        async def checkpoint(chunk, text):
+            if self.checkpoints:
+                await asyncio.to_thread(self.checkpoints.save, file_key, chunk.index, chunk.start_ms, chunk.end_ms, text)
+
+        async def transcribe(chunk, key):
+            try:
+                with timed("recognize"):
+                    text=await loop.run_in_executor(self.executor, _recognizeChunk, self.recognizer, chunk.data, self.stream.sample_rate, self.stream.sample_width)
+                CHUNKS.inc(source="recognized")
+                AUDIO_SECONDS.inc((chunk.end_ms-chunk.start_ms)/1000)
+                if key:
+                    await asyncio.to_thread(self.cache.put, key, text)
+                await checkpoint(chunk, text)
+                transcriptions[chunk.index]=(text, chunk.start_ms, chunk.end_ms)
+            finally:
+                semaphore.release()
+
+        try:
+            while True:
+                await semaphore.acquire()
+                failed=[task for task in tasks if task.done() and task.exception()]
+                if failed:
+                    semaphore.release()
+                    break
+                chunk, key, cached=await asyncio.to_thread(self._nextChunk, chunks)
+                if chunk is None:
+                    semaphore.release()
+                    break
+                if cached is not None:
+                    await checkpoint(chunk, cached)
+                    transcriptions[chunk.index]=(cached, chunk.start_ms, chunk.end_ms)
+                    CHUNKS.inc(source="cache")
+                    AUDIO_SECONDS.inc((chunk.end_ms-chunk.start_ms)/1000)
+                    semaphore.release()
+                    continue
+                tasks.append(asyncio.ensure_future(transcribe(chunk, key)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.to_thread(chunks.close)
+        logger.info("Transcribed %s chunks of %s, recognized %s", len(transcriptions), audiofile.filename, len(tasks))
+
+        # chunks finish out of order, join them back by index
+        transcription=Transcript.join([transcriptions[index] for index in sorted(transcriptions)])
+        if self.cache:
+            await asyncio.to_thread(self.cache.put, file_key, transcription.dumps())
+        if self.checkpoints:
+            await asyncio.to_thread(self.checkpoints.clear, file_key)
+        return transcription
 
-    async def audioToText(self, audiofile):
-        transcriptions:List[str]=[]
-        wav_chunks:List[io.BytesIO]=[]
-        # read file 
-        format=audiofile.filename.split('.')[-1]
-        print("File format", format)
-        audio_data = io.BytesIO(await audiofile.read())
-        print("file reading done : ",audio_data)
-        audio:AudioSegment = AudioSegment.from_file(audio_data, format=format)
-        print("audio segment done : ", audio)
-
-
-        # split file in chunk
-        audiochunks = split_on_silence(audio,
-        min_silence_len = 1000,
-        # adjust this per requirement
-        silence_thresh = audio.dBFS-14,
-        # keep the silence for 1 second, adjustable as well
-        keep_silence=500,
-        )
-
-
-        # loop, convert chunks to wav and store in array
-        for i, chunk in enumerate(audiochunks):
-            wav_chunk=io.BytesIO()
-            chunk.export(wav_chunk, format="wav")
-            wav_chunk.seek(0)
-            wav_chunks.append(wav_chunk)
-        print("conversion to wav done, next step transcribing chunks ")
-
-        
-        for wav_data in wav_chunks:
-            # recognize audio using Sphinx
-            with sr.AudioFile(wav_data) as source:
-                audio = self.r.record(source)
-                text = self.r.recognize_google(audio)
-                transcriptions.append(text)        
-
-        return ' '.join(transcriptions)
\ No newline at end of file
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,179 @@
+import bisect
+import json
+from collections import deque
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+
+# (start char, end char, start ms, end ms) of the text of one audio chunk inside a transcript
+Segment=Tuple[int,int,int,int]
+
+
+class Transcript(str):
+    """
+        transcript text that remembers which audio time range every part of it came from
+    """
+    segments:List[Segment]
+
+    def __new__(cls, text:str, segments:Sequence[Segment]=()):
+        transcript=super().__new__(cls, text)
+        transcript.segments=[tuple(segment) for segment in segments]
+        transcript._starts=[segment[0] for segment in transcript.segments]
+        transcript._ends=[segment[1] for segment in transcript.segments]
+        return transcript
+
+    @classmethod
+    def join(cls, parts:Sequence[Tuple[str,int,int]], separator:str=" ") -> "Transcript":
+        """
+            parts are (text, start ms, end ms) in audio order
+        """
+        segments=[]
+        position=0
+        for text, start_ms, end_ms in parts:
+            if segments:
+                position+=len(separator)
+            segments.append((position, position+len(text), start_ms, end_ms))
+            position+=len(text)
+        return cls(separator.join(text for text, _, _ in parts), segments)
+
+    def dumps(self) -> str:
+        return json.dumps({"text":str(self),"segments":self.segments})
+
+    @classmethod
+    def loads(cls, value:str) -> "Transcript":
+        # plain strings are transcripts cached before segments were kept
+        if value.startswith('{"text": '):
+            stored=json.loads(value)
+            return cls(stored["text"], stored["segments"])
+        return cls(value)
+
+    def audioRange(self, start:int, end:int) -> Optional[Tuple[int,int]]:
+        """
+            audio time range (ms) covered by the characters start:end, None without segments
+        """
+        if not self.segments:
+            return None
+        first=bisect.bisect_right(self._ends, start)
+        last=bisect.bisect_left(self._starts, end)-1
+        first=min(first, len(self.segments)-1)
+        last=max(last, first)
+        return self.segments[first][2], self.segments[last][3]
+
+
+class TextChunk(NamedTuple):
+    text:str
+    start:int   # character offsets into the source text
+    end:int
+    size:int    # in the chunker's unit, characters or tokens
+
+
+class TextChunkerModel():
+    def __init__(self, chunk_size:int=500, chunk_overlap:int=50, length:Optional[Callable[[List[str]],List[int]]]=None, separators:Sequence[str]=("\n\n","\n"," ","")):
+        """
+            the chunks of langchain's RecursiveCharacterTextSplitter (keep_separator) in one pass over
+            the text, yielded as they are completed. Pieces are (start, end) offsets into the source,
+            only the text of finished chunks is copied out of it.
+            length : sizes of a list of texts, e.g. the embedding model's token counter, characters by default.
+            Token sizes of neighbouring pieces are summed, close to but not exactly the joined count
+        """
+        if chunk_overlap>=chunk_size:
+            raise Exception(f"Chunk overlap {chunk_overlap} must be smaller than chunk size {chunk_size}")
+        self.chunk_size=chunk_size
+        self.chunk_overlap=chunk_overlap
+        self.length=length
+        self.separators=tuple(separators)
+
+    def _sizes(self, text:str, spans:List[Tuple[int,int]]) -> List[int]:
+        if self.length is None:
+            return [end-start for start, end in spans]
+        return self.length([text[start:end] for start, end in spans])
+
+    def _spans(self, text:str, start:int, end:int, separator:str) -> Iterator[List[Tuple[int,int]]]:
+        """
+            batches of (start, end) pieces of text[start:end], every piece after the first starts
+            with the separator, single characters for the empty separator
+        """
+        spans:List[Tuple[int,int]]=[]
+        position=start
+        search=start
+        while position<end:
+            if not separator:
+                found=position+1 if position+1<end else -1
+            else:
+                found=text.find(separator, search, end)
+            if found==-1:
+                spans.append((position, end))
+                break
+            if found>position:
+                spans.append((position, found))
+            position=found
+            search=found+len(separator)
+            if len(spans)==512:
+                yield spans
+                spans=[]
+        if spans:
+            yield spans
+
+    def _split(self, text:str, start:int, end:int, separators:Sequence[str]) -> Iterator[TextChunk]:
+        """
+            splits on the first separator found in text[start:end] and merges runs of pieces under
+            chunk_size, a larger piece ends the run and is split again with the separators after it
+        """
+        separator=separators[-1]
+        remaining:Sequence[str]=()
+        for index, candidate in enumerate(separators):
+            if not candidate:
+                separator=candidate
+                break
+            if text.find(candidate, start, end)!=-1:
+                separator=candidate
+                remaining=separators[index+1:]
+                break
+
+        run:List[Tuple[int,int,int]]=[]
+        for spans in self._spans(text, start, end, separator):
+            for (piece_start, piece_end), size in zip(spans, self._sizes(text, spans)):
+                if size<self.chunk_size:
+                    run.append((piece_start, piece_end, size))
+                    continue
+                if run:
+                    yield from self._merge(text, run)
+                    run=[]
+                if remaining:
+                    yield from self._split(text, piece_start, piece_end, remaining)
+                else:
+                    yield TextChunk(text[piece_start:piece_end], piece_start, piece_end, size)
+        if run:
+            yield from self._merge(text, run)
+
+    def _merge(self, text:str, run:List[Tuple[int,int,int]]) -> Iterator[TextChunk]:
+        window:deque=deque()
+        total=0
+        for piece in run:
+            if total+piece[2]>self.chunk_size:
+                if window:
+                    chunk=self._chunk(text, window, total)
+                    if chunk:
+                        yield chunk
+                    # the tail of the finished chunk starts the next one as its overlap
+                    while total>self.chunk_overlap or (total+piece[2]>self.chunk_size and total>0):
+                        total-=window.popleft()[2]
+            window.append(piece)
+            total+=piece[2]
+        if window:
+            chunk=self._chunk(text, window, total)
+            if chunk:
+                yield chunk
+
+    def _chunk(self, text:str, window, size:int) -> Optional[TextChunk]:
+        start=window[0][0]
+        end=window[-1][1]
+        while start<end and text[start].isspace():
+            start+=1
+        while end>start and text[end-1].isspace():
+            end-=1
+        if start==end:
+            return None
+        return TextChunk(text[start:end], start, end, size)
+
+    def chunks(self, text:str) -> Iterator[TextChunk]:
+        yield from self._split(text, 0, len(text), self.separators)
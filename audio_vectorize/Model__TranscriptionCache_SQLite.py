@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class TranscriptionCacheModel():
+    def __init__(self, path:str, max_bytes:int=512*1024*1024):
+        """
+            persistent key -> transcript store, least recently used entries are evicted past max_bytes.
+            Workers may share the file, the total size is read in the write transaction of every put
+        """
+        directory=os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path=path
+        self.max_bytes=max_bytes
+        self.lock=threading.Lock()
+        self.connection=sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS transcription (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS transcription_accessed_at ON transcription (accessed_at)")
+
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def get(self, key:str) -> Optional[str]:
+        with self.lock:
+            row=self.connection.execute("SELECT value FROM transcription WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self.connection.execute("UPDATE transcription SET accessed_at=? WHERE key=?", (time.time(), key))
+            return row[0]
+
+    def put(self, key:str, value:str):
+        size=len(key)+len(value.encode())
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, no other worker changes the total before the commit
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute("INSERT OR REPLACE INTO transcription (key, value, size, accessed_at) VALUES (?,?,?,?)", (key, value, size, time.time()))
+                total=self.connection.execute("SELECT COALESCE(SUM(size),0) FROM transcription").fetchone()[0]
+                if total>self.max_bytes:
+                    self._evict(total)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self, total:int):
+        while total>self.max_bytes:
+            oldest=self.connection.execute("SELECT key, size FROM transcription ORDER BY accessed_at LIMIT 256").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total<=self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM transcription WHERE key=?", (key,))
+                total-=size
+                self.evictions+=1
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size=self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM transcription").fetchone()
+        lookups=self.hits+self.misses
+        return {"hits":self.hits,"misses":self.misses,"hit_rate":self.hits/lookups if lookups else 0.0,"evictions":self.evictions,"entries":entries,"bytes":size,"max_bytes":self.max_bytes}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
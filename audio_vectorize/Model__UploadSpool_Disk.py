@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import List, NamedTuple, Optional
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+
+SPOOL_BLOCK_SIZE=1024*1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class SpooledUpload(NamedTuple):
+    path:str
+    filename:str
+    content_type:Optional[str]
+    size:int
+    sha256:str
+
+
+class UploadSpoolModel():
+    def __init__(self, directory:Optional[str]=None, max_file_bytes:Optional[int]=None, max_request_bytes:Optional[int]=None, block_size:int=SPOOL_BLOCK_SIZE):
+        """
+            copies uploads to files on disk in fixed size blocks and hashes them on the way,
+            memory per upload stays at one block whatever the size of the file
+        """
+        self.directory=directory or os.path.join(tempfile.gettempdir(),"audio_vectorize_spool")
+        self.max_file_bytes=max_file_bytes
+        self.max_request_bytes=max_request_bytes
+        self.block_size=block_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def checkSizes(self, sizes:List[Optional[int]]):
+        """
+            rejects a request from the sizes it declares, before anything is copied or decoded
+        """
+        for size in sizes:
+            if size is not None and self.max_file_bytes is not None and size>self.max_file_bytes:
+                raise UploadTooLarge(f"File of {size} bytes is over the limit of {self.max_file_bytes} bytes")
+        total=sum(size or 0 for size in sizes)
+        if self.max_request_bytes is not None and total>self.max_request_bytes:
+            raise UploadTooLarge(f"Request of {total} bytes is over the limit of {self.max_request_bytes} bytes")
+
+    async def spool(self, audiofiles:List[UploadFile], prefix:str) -> List[SpooledUpload]:
+        """
+            spools every upload to {directory}/{prefix}-{index}, removes them all if one fails
+        """
+        self.checkSizes([audiofile.size for audiofile in audiofiles])
+        spooled:List[SpooledUpload]=[]
+        budget=self.max_request_bytes
+        try:
+            for index, audiofile in enumerate(audiofiles):
+                path=os.path.join(self.directory,f"{prefix}-{index}")
+                upload=await asyncio.to_thread(self._copy, audiofile, path, budget)
+                spooled.append(upload)
+                if budget is not None:
+                    budget-=upload.size
+        except Exception:
+            self.remove(spooled)
+            raise
+        return spooled
+
+    def _copy(self, audiofile:UploadFile, path:str, budget:Optional[int]) -> SpooledUpload:
+        limit=min(limit for limit in (self.max_file_bytes, budget, float("inf")) if limit is not None)
+        digest=hashlib.sha256()
+        size=0
+        audiofile.file.seek(0)
+        try:
+            with open(path,"wb") as spool:
+                for block in iter(lambda: audiofile.file.read(self.block_size), b""):
+                    size+=len(block)
+                    # sizes are not always declared, the copy itself enforces the limits too
+                    if size>limit:
+                        raise UploadTooLarge(f"{audiofile.filename} is over the upload size limit")
+                    digest.update(block)
+                    spool.write(block)
+        except Exception:
+            os.remove(path)
+            raise
+        return SpooledUpload(path,audiofile.filename,audiofile.content_type,size,digest.hexdigest())
+
+    def open(self, upload:SpooledUpload) -> UploadFile:
+        """
+            the spooled copy as an UploadFile backed by the file on disk, close it when done
+        """
+        headers=Headers({"content-type":upload.content_type}) if upload.content_type else None
+        return UploadFile(open(upload.path,"rb"),size=upload.size,filename=upload.filename,headers=headers)
+
+    def remove(self, uploads:List[SpooledUpload]):
+        for upload in uploads:
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
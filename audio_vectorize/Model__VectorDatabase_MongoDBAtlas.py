@@ -1,17 +1,112 @@
-from langchain_mongodb import MongoDBAtlasVectorSearch
-from pymongo import MongoClient
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import itertools
+import logging
+import time
+from typing import Iterable, Iterator, Optional
 
+import numpy as np
 from sqlmodel import SQLModel
 
+from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel
+from audio_vectorize.Model__Metrics_Prometheus import DOCUMENTS, timed
+from audio_vectorize.Model__TextChunker_Recursive import TextChunkerModel, Transcript
+from audio_vectorize.Model__VectorStorage_Quantized import VectorStorageModel
+
+logger=logging.getLogger(__name__)
+
 class Collection(SQLModel):
     database:str
     collection:str
 
 
+def contentHash(text:str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def textChunker(chunk_size:int, chunk_overlap:int, chunk_unit:str="characters", embedding_model=None) -> TextChunkerModel:
+    """
+        chunk_unit "tokens" sizes chunks with the embedding model's tokenizer, about 4 characters
+        a token when the model has none
+    """
+    if chunk_unit=="characters":
+        return TextChunkerModel(chunk_size, chunk_overlap)
+    if chunk_unit!="tokens":
+        raise Exception(f"Unknown chunk unit {chunk_unit}, expected characters or tokens")
+    count_tokens=getattr(embedding_model, "countTokens", None) or (lambda texts: [max(1, len(text)//4) for text in texts])
+    return TextChunkerModel(chunk_size, chunk_overlap, length=count_tokens)
+
+
+def chunkPosition(document:dict) -> dict:
+    return {key:document[key] for key in ("start_char","end_char","start_ms","end_ms") if key in document}
+
+
+def chunkDocuments(text:str, metadata:dict, chunker:TextChunkerModel) -> Iterator[dict]:
+    """
+        chunk documents of one transcript, with their character offsets and the audio time range
+        they were spoken in when the transcript knows it
+    """
+    for chunk in chunker.chunks(text):
+        document={"text":chunk.text,**metadata,"content_hash":contentHash(chunk.text),"start_char":chunk.start,"end_char":chunk.end}
+        audio_range=text.audioRange(chunk.start, chunk.end) if isinstance(text, Transcript) else None
+        if audio_range:
+            document["start_ms"], document["end_ms"]=audio_range
+        yield document
+
+
 class MongoDBAtlas():
-    def __init__(self, connection_string):
-        self.client=MongoClient(connection_string)
+    def __init__(self, connection_string, client=None, storage:Optional[VectorStorageModel]=None, lexical:Optional[LexicalIndexModel]=None, versions_database:str="audio_vectorize", version_seconds:float=1.0):
+        """
+            client : optional already built client, e.g. a mongomock one for local runs
+            storage : how chunk embeddings are written, float32 arrays by default
+            lexical : optional BM25 index kept in step with every chunk written or deleted
+            versions_database : holds the collection_versions counters every writer bumps
+            version_seconds : how long a process trusts the version it last read
+        """
+        self.client=client or MongoClient(connection_string)
+        self.storage=storage or VectorStorageModel()
+        self.lexical=lexical
+        self.transactions_supported=True
+        self.versions_database=versions_database
+        self.version_seconds=version_seconds
+        # (database, collection) -> (version, monotonic time it was read)
+        self.versions={}
+
+    def _Versions(self):
+        return self.client[self.versions_database]["collection_versions"]
+
+    def Collection_Version(self, database, collection):
+        """
+        counter bumped on every write by any process, lets caches and local indexes notice changes.
+        Writes from other processes show within version_seconds, this process's own at once
+        """
+        cached=self.versions.get((database,collection))
+        if cached and time.monotonic()-cached[1]<self.version_seconds:
+            return cached[0]
+        document=self._Versions().find_one({"_id":f"{database}.{collection}"},{"version":1})
+        version=document["version"] if document else 0
+        self.versions[(database,collection)]=(version,time.monotonic())
+        return version
+
+    def _Touch(self, database, collection):
+        document=self._Versions().find_one_and_update({"_id":f"{database}.{collection}"},{"$inc":{"version":1},"$set":{"database":database,"collection":collection}},upsert=True,return_document=ReturnDocument.AFTER)
+        self.versions[(database,collection)]=(document["version"],time.monotonic())
+
+    def _Lexical(self, operation, *args):
+        """
+        the lexical index is secondary, a failed update is logged and repaired with Rebuild_Lexical_Index
+        """
+        if not self.lexical:
+            return
+        try:
+            with timed("lexical_index"):
+                getattr(self.lexical, operation)(*args)
+        except Exception as e:
+            logger.warning("Lexical index %s failed for %s.%s: %s", operation, args[0], args[1] if len(args)>1 else "*", e)
 
     def Get_Database_And_Collection_Names(self):
         """
@@ -29,14 +124,14 @@ class MongoDBAtlas():
             Adds a collection and db, if db exists adds collection in it
         """
         try:
-            print("Creating database and collection in MongoDBAtlas")
+            logger.info("Creating database and collection in MongoDBAtlas")
             db=self.client[collection.database]
             collextion=db[collection.collection]
-            print("Successfully created ", collextion)
+            logger.debug("Successfully created %s", collextion)
 
             return collextion
         except Exception as e:
-            print(e)
+            logger.error(e)
             return {"success":False,"Error":e,"details":"Error in creating collection"}
 
     
@@ -46,88 +141,340 @@ class MongoDBAtlas():
         """
         get file or document in MongoDBAtlast in specified collection, provide all parameters
         """
-        print("\nInside Model__VectorDatabase_MongoDBAtlas : Get_File\n")
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Get_File")
         try:
             collection=self.client[database][collection]
-            print("Getting file from collection", collection)
+            logger.debug("Getting file from collection %s", collection)
             doc=collection.find({"id":file_id})
-            print("Successfully got file from collection", collection)
+            logger.debug("Successfully got file from collection %s", collection)
             return doc
         except Exception as e:
-            print("Error in Model MongoDBVector Get")
-            print(e)
+            logger.error("Error in Model MongoDBVector Get: %s", e)
             return {"success":False,"Error":e,"details":"Error in getting file"}
 
-    def Insert_Files(self,file,metadata,database,collection,embedding_model,index_name,chunk_size,chunk_overlap):
+    def Insert_Files(self,file,metadata,database,collection,embedding_model,index_name,chunk_size,chunk_overlap,chunk_unit="characters"):
         """
         insert files or documents in MongoDBAtlast in specified collection, provide all parameters
         """
-        print("\nInside Model__VectorDatabase_MongoDBAtlas : Insert_Files\n")
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Insert_Files")
 
         try:
-            collection=self.client[database][collection]
-            print("Inserting in collection", collection)
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            doc=text_splitter.create_documents([file],[metadata])
-            docs=text_splitter.split_documents(doc)
-            print(docs)
-            MongoDBAtlasVectorSearch.from_documents(docs,embedding_model,collection=collection,index_name=index_name)
-            print("Successfully inserted in collection", collection)
-            return {"success":True,"details":"File successfully inserted in collection"}
+            result=self.Bulk_Insert_Files([(file,metadata)],database,collection,embedding_model,chunk_size,chunk_overlap,chunk_unit=chunk_unit)
+            logger.debug("Successfully inserted in collection %s", collection)
+            return {"success":True,"details":"File successfully inserted in collection",**result}
         except Exception as e:
-            print("Error in Model MongoDBVector Insert")
-            print(e)
+            logger.error("Error in Model MongoDBVector Insert: %s", e)
             raise Exception({"success":False,"Error":e,"details":"Error in uploading files"})
+
+    def Bulk_Insert_Files(self,files,database,collection,embedding_model,chunk_size,chunk_overlap,batch_size=256,resume_ids=(),chunk_unit="characters"):
+        """
+        insert chunks of many files at once, files is a list of (text, metadata).
+        Chunks are generated, embedded batch_size at a time and written while the next batch
+        is embedded, with an unordered insert_many. resume_ids are files a previous attempt already
+        wrote some chunks of, those chunks are neither embedded nor written again. Chunks of theirs
+        the new chunking no longer has, left by an attempt on another transcript or chunk settings,
+        are deleted once the new ones are in
+        """
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Bulk_Insert_Files")
+        started=time.perf_counter()
+        self._Touch(database,collection)
+        collection=self.client[database][collection]
+        chunker=textChunker(chunk_size, chunk_overlap, chunk_unit, embedding_model)
+        docs=itertools.chain.from_iterable(chunkDocuments(text, metadata, chunker) for text, metadata in files)
+        moved=[]
+        stale=[]
+        if resume_ids:
+            docs=self._Unwritten(collection,docs,resume_ids,moved,stale)
+
+        def write(to_insert):
+            with timed("mongo_write"):
+                result=collection.insert_many(to_insert,ordered=False)
+            self._Lexical("add",database,collection.name,to_insert)
+            return result
+
+        inserted=0
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="mongodb-writer") as writer:
+            pending=None
+            while True:
+                with timed("text_split"):
+                    batch=list(itertools.islice(docs, batch_size))
+                if not batch:
+                    break
+                with timed("embedding"):
+                    vectors=embedding_model.embed_documents([doc["text"] for doc in batch])
+                to_insert=[{**doc,**fields} for doc,fields in zip(batch,self.storage.encode(vectors))]
+                # one write in flight, the next batch embeds while it runs
+                if pending:
+                    inserted+=len(pending.result().inserted_ids)
+                pending=writer.submit(write,to_insert)
+            if pending:
+                inserted+=len(pending.result().inserted_ids)
+        if moved or stale:
+            with timed("mongo_write"):
+                self._Swap_Chunks(collection, stale, [], moved)
+            self._Lexical("removeChunks",database,collection.name,[str(_id) for _id in stale])
+
+        self._Touch(database,collection.name)
+        DOCUMENTS.inc(inserted)
+        seconds=time.perf_counter()-started
+        docs_per_second=inserted/seconds if seconds else 0.0
+        logger.info("Bulk inserted %s chunks from %s files in %s s, %s docs/s, deleted %s stale", inserted, len(files), round(seconds,2), round(docs_per_second,1), len(stale))
+        return {"inserted":inserted,"deleted":len(stale),"files":len(files),"seconds":seconds,"docs_per_second":docs_per_second}
         
-    def Update_Files(self, file, file_id, database, collection, embedding_model, index_name, chunk_size, chunk_overlap):
+    def _Unwritten(self, collection, docs:Iterable[dict], resume_ids, moved:list, stale:list) -> Iterator[dict]:
         """
-        update files or documents in MongoDBAtlast in specified collection, provide all parameters
+            drops the chunks already in the collection for the given file ids, matched by file id and
+            content hash, a text repeated n times in a file is only dropped as often as it was written.
+            Once docs run out, moved has the (_id, position) of kept chunks at other offsets and stale
+            the _id of written chunks no doc matched
         """
-        print("\nInside Model__VectorDatabase_MongoDBAtlas : Update_Files\n")
+        written=defaultdict(list)
+        for document in collection.find({"id":{"$in":[str(id) for id in resume_ids]}},{"_id":1,"id":1,"content_hash":1,"start_char":1,"end_char":1,"start_ms":1,"end_ms":1}):
+            written[(document["id"],document.get("content_hash"))].append(document)
+        logger.info("Resuming %s files, %s chunks already written", len(resume_ids), sum(len(documents) for documents in written.values()))
+        for doc in docs:
+            key=(doc.get("id"),doc["content_hash"])
+            if written[key]:
+                existing=written[key].pop()
+                position=chunkPosition(doc)
+                if any(existing.get(field)!=value for field, value in position.items()):
+                    moved.append((existing["_id"],position))
+                continue
+            yield doc
+        stale.extend(existing["_id"] for documents in written.values() for existing in documents)
+
+    def Update_Files(self, file, file_id, database, collection, embedding_model, index_name, chunk_size, chunk_overlap, chunk_unit="characters"):
+        """
+        update files or documents in MongoDBAtlast in specified collection, provide all parameters,
+        only chunks whose content changed are embedded, inserted or deleted, unchanged chunks that
+        moved only get their offsets and times rewritten
+        """
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Update_Files")
         metadata={"id":file_id}
         
 
         try:
+            self._Touch(database,collection)
             collection=self.client[database][collection]
-            collection.delete_many({"id":file_id})
-            print("Updating in collection", collection)
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            doc=text_splitter.create_documents([file], [metadata])
-            docs=text_splitter.split_documents(doc)
-            print(docs)
-            MongoDBAtlasVectorSearch.from_documents(docs, embedding_model, collection=collection, index_name=index_name)
-            print("Successfully updated in collection", collection)
-            return {"success":True,"details":"File successfully updated in collection"}
+            logger.debug("Updating in collection %s", collection)
+            chunker=textChunker(chunk_size, chunk_overlap, chunk_unit, embedding_model)
+
+            # chunks already stored, hashed from their text when they predate content_hash
+            stored=defaultdict(list)
+            for existing in collection.find({"id":file_id},{"_id":1,"content_hash":1,"text":1,"start_char":1,"end_char":1,"start_ms":1,"end_ms":1}):
+                stored[existing.get("content_hash") or contentHash(existing.get("text",""))].append(existing)
+
+            added=[]
+            moved=[]
+            unchanged=0
+            with timed("text_split"):
+                for doc in chunkDocuments(file, metadata, chunker):
+                    if stored[doc["content_hash"]]:
+                        existing=stored[doc["content_hash"]].pop()
+                        unchanged+=1
+                        position=chunkPosition(doc)
+                        if any(existing.get(key)!=value for key, value in position.items()):
+                            moved.append((existing["_id"],position))
+                    else:
+                        added.append(doc)
+            stale=[existing["_id"] for documents in stored.values() for existing in documents]
+
+            with timed("embedding"):
+                vectors=embedding_model.embed_documents([doc["text"] for doc in added]) if added else []
+            new_docs=[{**doc,**fields} for doc,fields in zip(added,self.storage.encode(vectors))]
+            with timed("mongo_write"):
+                self._Swap_Chunks(collection, stale, new_docs, moved)
+            self._Lexical("removeChunks",database,collection.name,[str(_id) for _id in stale])
+            self._Lexical("add",database,collection.name,new_docs)
+            self._Touch(database,collection.name)
+            DOCUMENTS.inc(len(new_docs))
+            logger.info("Updated collection %s, inserted %s deleted %s unchanged %s moved %s", collection, len(new_docs), len(stale), unchanged, len(moved))
+            return {"success":True,"details":"File successfully updated in collection","inserted":len(new_docs),"deleted":len(stale),"unchanged":unchanged,"moved":len(moved)}
         except Exception as e:
-            print("Error in Model MongoDBVector Update")
-            print(e)
+            logger.error("Error in Model MongoDBVector Update: %s", e)
             raise Exception({"error":str(e)})
+
+    def _Move_Chunks(self, collection, moved, session=None):
+        """
+        rewrites offsets and times of chunks whose text did not change, in one bulk write
+        """
+        if not moved:
+            return
+        try:
+            collection.bulk_write([UpdateOne({"_id":_id},{"$set":position}) for _id, position in moved], ordered=False, session=session)
+        except TypeError:
+            # mongomock's bulk builder does not take every argument newer pymongo operations pass
+            for _id, position in moved:
+                collection.update_one({"_id":_id},{"$set":position}, session=session)
+
+    def _Swap_Chunks(self, collection, stale_ids, new_docs, moved=()):
+        """
+        inserts new chunks, moves unchanged ones and deletes stale ones in one transaction so searches never
+        see a half updated file. Without transactions (standalone server, mongomock) new chunks go in before
+        stale ones go out, the file is never left without vectors
+        """
+        if not stale_ids and not new_docs and not moved:
+            return
+        if self.transactions_supported:
+            try:
+                with self.client.start_session() as session:
+                    with session.start_transaction():
+                        if new_docs:
+                            collection.insert_many(new_docs, session=session)
+                        self._Move_Chunks(collection, moved, session)
+                        if stale_ids:
+                            collection.delete_many({"_id":{"$in":stale_ids}}, session=session)
+                return
+            except NotImplementedError:
+                self.transactions_supported=False
+            except OperationFailure as e:
+                # IllegalOperation, transactions need a replica set or mongos
+                if e.code!=20:
+                    raise
+                self.transactions_supported=False
+            logger.info("Transactions not supported, swapping chunks without one")
+        if new_docs:
+            collection.insert_many(new_docs)
+        self._Move_Chunks(collection, moved)
+        if stale_ids:
+            collection.delete_many({"_id":{"$in":stale_ids}})
     
     def Delete_File(self,file_id,database,collection):
         """
         delete files or documents in MongoDBAtlast in specified collection, provide all parameters
         """
-        print("\nInside Model__VectorDatabase_MongoDBAtlas : Delete_File\n")
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Delete_File")
 
-        collection=self.client[database][collection]
-        collection.delete_many({"id":file_id})
-        print("Successfully deleted in collection", collection)
+        self.Delete_Files([file_id],database,collection)
         return {"success":True,"details":"File successfully deleted in collection"}
+
+    def Delete_Files(self,file_ids,database,collection):
+        """
+        deletes the chunks of all the given files with one delete_many
+        """
+        result=self.client[database][collection].delete_many({"id":{"$in":list(file_ids)}})
+        self._Lexical("removeFiles",database,collection,list(file_ids))
+        self._Touch(database,collection)
+        logger.debug("Deleted %s chunks of %s files in collection %s", result.deleted_count, len(file_ids), collection)
+        return result.deleted_count
+
+    def Drop_Collection(self,database,collection):
+        """
+        drops the collection with its chunks and indexes, a missing collection is not an error
+        """
+        self.client[database].drop_collection(collection)
+        self._Lexical("drop",database,collection)
+        self._Touch(database,collection)
+        logger.debug("Dropped collection %s in database %s", collection, database)
+
+    def Drop_Database(self,database,collections=()):
+        """
+        drops the database, collections are the ones whose cached results have to go stale too
+        """
+        self.client.drop_database(database)
+        self._Lexical("drop",database)
+        self._Versions().update_many({"database":database},{"$inc":{"version":1}})
+        for key in [key for key in self.versions if key[0]==database]:
+            del self.versions[key]
+        for name in collections:
+            self._Touch(database,name)
+        logger.debug("Dropped database %s", database)
     
+    def Query_Files(self, vector, database, collection, index_name, k=4, file_id=None, num_candidates=None):
+        """
+        top k chunks closest to vector using the Atlas vector search index, optionally only the
+        chunks of one file (the index has to declare "id" as a filter field for that).
+        With quantized storage and exact vectors at hand, k*oversample candidates are fetched and
+        the top k by exact cosine are returned, by quantized score when some have no exact vector
+        """
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Query_Files")
+        limit=k*self.storage.oversample if self.storage.rescoring else k
+        search={"index":index_name,"path":self.storage.embedding_key,"queryVector":vector,"numCandidates":max(num_candidates or k*10,limit),"limit":limit}
+        if file_id:
+            search["filter"]={"id":file_id}
+        pipeline=[{"$vectorSearch":search},{"$project":{self.storage.embedding_key:0,self.storage.scale_key:0,"score":{"$meta":"vectorSearchScore"}}}]
+        results=[]
+        for document in self.client[database][collection].aggregate(pipeline):
+            document["_id"]=str(document["_id"])
+            results.append(document)
+        if self.storage.rescoring and results:
+            query=np.asarray(vector, dtype=np.float32)
+            query/=np.linalg.norm(query) or 1.0
+            # atlas cosine scores are (1 + cosine) / 2
+            scores=self.storage.rescore(query, [document.get("content_hash") for document in results], [document.get("text") for document in results], np.array([document["score"]*2-1 for document in results]))
+            for document, score in zip(results, scores):
+                document["score"]=float(score+1)/2
+            results=sorted(results, key=lambda document: -document["score"])[:k]
+        return results
+
+    def Get_Chunks(self, chunk_ids, database, collection):
+        """
+        chunks by _id in the given order, without their embeddings, e.g. the hits of a lexical search
+        """
+        ids=[ObjectId(id) if ObjectId.is_valid(id) else id for id in chunk_ids]
+        found={str(document["_id"]):document for document in self.client[database][collection].find({"_id":{"$in":ids}},{self.storage.embedding_key:0,self.storage.scale_key:0})}
+        results=[]
+        for id in chunk_ids:
+            document=found.get(str(id))
+            if document:
+                document["_id"]=str(document["_id"])
+                results.append(document)
+        return results
+
+    def Iter_Chunks(self, database, collection, batch_size=10000):
+        """
+        every chunk of the collection with its stored embedding, batch_size documents at a time in _id order
+        """
+        batch=[]
+        for document in self.client[database][collection].find({}).sort("_id",1).batch_size(min(batch_size,10000)):
+            batch.append(document)
+            if len(batch)>=batch_size:
+                yield batch
+                batch=[]
+        if batch:
+            yield batch
+
+    def Import_Chunks(self, documents, vectors, database, collection, batch_size=1000):
+        """
+        writes already chunked documents with their vectors, encoded with this store's storage mode,
+        e.g. the chunks of a snapshot
+        """
+        self._Touch(database,collection)
+        inserted=0
+        for start in range(0,len(documents),batch_size):
+            to_insert=[{**doc,**fields} for doc,fields in zip(documents[start:start+batch_size],self.storage.encode(vectors[start:start+batch_size]))]
+            with timed("mongo_write"):
+                result=self.client[database][collection].insert_many(to_insert,ordered=False)
+            self._Lexical("add",database,collection,to_insert)
+            inserted+=len(result.inserted_ids)
+        self._Touch(database,collection)
+        DOCUMENTS.inc(inserted)
+        return inserted
+
+    def Rebuild_Lexical_Index(self, database, collection):
+        """
+        indexes every chunk already in the collection, for collections written before the lexical index
+        """
+        if not self.lexical:
+            raise Exception("No lexical index configured")
+        documents=self.client[database][collection].find({},{"_id":1,"id":1,self.lexical.text_key:1})
+        indexed=self.lexical.rebuild(database,collection,documents)
+        self._Touch(database,collection)
+        return indexed
+
     # Database operations
 
     def Get_Database(self, database):
         """
         get database in MongoDBAtlast, provide all parameters
         """
-        print("\nInside Model__VectorDatabase_MongoDBAtlas : Get_Database\n")
+        logger.debug("Inside Model__VectorDatabase_MongoDBAtlas : Get_Database")
 
         try:
             db=self.client[database]
-            print("Successfully got database", db)
+            logger.debug("Successfully got database %s", db)
             return db
         except Exception as e:
-            print("Error in Model MongoDBVector Get")
-            print(e)
+            logger.error("Error in Model MongoDBVector Get: %s", e)
             raise Exception({"success":False,"Error":e,"details":"Error in getting database"})
         
\ No newline at end of file
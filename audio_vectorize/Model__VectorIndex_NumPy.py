@@ -0,0 +1,81 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from audio_vectorize.Model__VectorStorage_Quantized import VectorStorageModel
+
+
+logger=logging.getLogger(__name__)
+
+
+class CollectionIndex():
+    def __init__(self, version:int, vectors:np.ndarray, file_ids:np.ndarray, documents:List[dict], inverse_norms:Optional[np.ndarray]=None):
+        self.version=version
+        self.vectors=vectors
+        self.inverse_norms=np.ones(len(vectors), dtype=np.float32) if inverse_norms is None else inverse_norms
+        self.file_ids=file_ids
+        self.documents=documents
+
+
+class VectorIndexModel():
+    def __init__(self, text_key:str="text", embedding_key:str="embedding", storage:Optional[VectorStorageModel]=None):
+        """
+            in-process brute force cosine index per (database, collection), rebuilt from the mongo
+            collection when its version moves, for offline use or when Atlas search is unavailable.
+            storage : how vectors are decoded and held, quantized modes keep the matrix in their
+            dtype and rescore the top candidates
+        """
+        self.text_key=text_key
+        self.embedding_key=embedding_key
+        self.storage=storage or VectorStorageModel(embedding_key=embedding_key)
+        self.indexes:Dict[Tuple[str,str],CollectionIndex]={}
+        self.lock=threading.Lock()
+
+    def build(self, collection, database:str, name:str, version:int=0) -> CollectionIndex:
+        logger.debug("Building local vector index for %s.%s", database, name)
+        documents=[]
+        vectors=[]
+        for document in collection.find({}):
+            vector=self.storage.decode(document)
+            if vector is None:
+                continue
+            vectors.append(vector)
+            document["_id"]=str(document["_id"])
+            documents.append(self.storage.strip(document))
+
+        matrix, inverse_norms=self.storage.pack(vectors)
+        index=CollectionIndex(version, matrix, np.array([str(document.get("id")) for document in documents]), documents, inverse_norms)
+        with self.lock:
+            self.indexes[(database,name)]=index
+        logger.debug("Local vector index built with %s chunks", len(documents))
+        return index
+
+    def get(self, database:str, name:str) -> Optional[CollectionIndex]:
+        return self.indexes.get((database,name))
+
+    def drop(self, database:str, name:Optional[str]=None):
+        with self.lock:
+            for key in [key for key in self.indexes if key[0]==database and (name is None or key[1]==name)]:
+                del self.indexes[key]
+
+    def search(self, index:CollectionIndex, vector:List[float], k:int=4, file_id:Optional[str]=None) -> List[dict]:
+        """
+            top k chunks by cosine similarity, optionally only the chunks of one file
+        """
+        candidates=np.flatnonzero(index.file_ids==str(file_id)) if file_id else np.arange(len(index.documents))
+        if not len(candidates):
+            return []
+        query=np.asarray(vector, dtype=np.float32)
+        query/=np.linalg.norm(query) or 1.0
+        scores=self.storage.scan(index.vectors, index.inverse_norms, query, candidates if file_id else None)
+        limit=min(k*self.storage.oversample if self.storage.rescoring else k, len(candidates))
+        top=np.argpartition(-scores, limit-1)[:limit]
+        if self.storage.rescoring:
+            # quantized scores pick the candidates, exact ones order them
+            documents=[index.documents[candidates[position]] for position in top]
+            scores[top]=self.storage.rescore(query, [document.get("content_hash") for document in documents], [document.get(self.text_key) for document in documents], scores[top])
+        k=min(k, limit)
+        top=top[np.argsort(-scores[top])][:k]
+        return [{**index.documents[candidates[position]], "score":float(scores[position])} for position in top]
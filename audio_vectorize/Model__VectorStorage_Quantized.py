@@ -0,0 +1,160 @@
+import logging
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype, USER_DEFINED_SUBTYPE, VECTOR_SUBTYPE
+
+
+logger=logging.getLogger(__name__)
+
+STORAGE_DTYPES=("float32","float16","int8")
+
+
+class VectorStorageModel():
+    def __init__(self, dtype:str="float32", embedding_key:str="embedding", scale_key:str="embedding_scale", oversample:int=4, exact:Optional[Callable[[List[str]],List[Optional[np.ndarray]]]]=None, embed:Optional[Callable[[List[str]],List[List[float]]]]=None, block_rows:int=256):
+        """
+            how chunk embeddings are written to mongo and held by the local index
+            float32 : plain arrays, as before
+            float16 : packed half floats in a user defined binary, 2 bytes a value. Atlas cannot
+                      index it, search through the local index
+            int8 : BSON vector binary that Atlas vector indexes read natively, 1 byte a value, the
+                   per-vector scale is kept in scale_key
+            Documents written in another mode still decode, a collection can change mode gradually.
+            exact : content hashes -> unquantized vectors or None, e.g. the embedding cache. Quantized
+                    searches fetch k*oversample candidates and rescore them with these
+            embed : chunk texts -> vectors, e.g. the embedding model, for the candidates exact does
+                    not know
+        """
+        if dtype not in STORAGE_DTYPES:
+            raise Exception(f"Unknown vector storage {dtype}, expected one of {', '.join(STORAGE_DTYPES)}")
+        self.dtype=dtype
+        self.embedding_key=embedding_key
+        self.scale_key=scale_key
+        self.oversample=oversample
+        self.exact=exact
+        self.embed=embed
+        self.block_rows=block_rows
+
+    @property
+    def quantized(self) -> bool:
+        return self.dtype!="float32"
+
+    @property
+    def atlas_searchable(self) -> bool:
+        """
+            Atlas vector indexes read float arrays and BSON vectors, not the float16 binary
+        """
+        return self.dtype!="float16"
+
+    @property
+    def rescoring(self) -> bool:
+        return self.quantized and (self.exact is not None or self.embed is not None) and self.oversample>1
+
+    def encode(self, vectors:Sequence[Sequence[float]]) -> List[dict]:
+        """
+            embedding fields of one document per vector
+        """
+        if not self.quantized:
+            return [{self.embedding_key:vector.tolist() if isinstance(vector, np.ndarray) else list(vector)} for vector in vectors]
+        if not len(vectors):
+            return []
+        values, scales=self.quantize(vectors)
+        if self.dtype=="float16":
+            return [{self.embedding_key:Binary(row.astype("<f2").tobytes(), USER_DEFINED_SUBTYPE)} for row in values]
+        return [{self.embedding_key:Binary(BinaryVectorDtype.INT8.value+b"\x00"+row.tobytes(), VECTOR_SUBTYPE),self.scale_key:float(scale)} for row, scale in zip(values, scales)]
+
+    def quantize(self, vectors:Sequence[Sequence[float]]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+            matrix in this mode's dtype, with the per-row scales for int8
+        """
+        matrix=np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        if self.dtype=="float16":
+            return matrix.astype(np.float16), None
+        if self.dtype=="float32":
+            return matrix, None
+        scales=np.abs(matrix).max(axis=1)/127
+        scales[scales==0]=1.0
+        return np.rint(matrix/scales[:,None]).astype(np.int8), scales
+
+    @staticmethod
+    def dequantize(values:np.ndarray, scales:Optional[np.ndarray]=None) -> np.ndarray:
+        if scales is None:
+            return np.asarray(values, dtype=np.float32)
+        return np.asarray(values, dtype=np.float32)*np.asarray(scales, dtype=np.float32)[:,None]
+
+    def decode(self, document:dict) -> Optional[np.ndarray]:
+        """
+            float32 vector of a stored document whatever mode wrote it, None when it has none
+        """
+        value=document.get(self.embedding_key)
+        if value is None:
+            return None
+        subtype=getattr(value, "subtype", None)
+        if subtype==VECTOR_SUBTYPE:
+            # dtype byte, padding byte, then the values
+            if value[:1]==BinaryVectorDtype.INT8.value:
+                return np.frombuffer(value, dtype=np.int8, offset=2).astype(np.float32)*np.float32(document.get(self.scale_key, 1.0))
+            if value[:1]==BinaryVectorDtype.FLOAT32.value:
+                return np.frombuffer(value, dtype="<f4", offset=2).astype(np.float32)
+            raise Exception(f"Unsupported BSON vector dtype {value[:1]!r}")
+        if subtype==USER_DEFINED_SUBTYPE:
+            return np.frombuffer(value, dtype="<f2").astype(np.float32)
+        return np.asarray(value, dtype=np.float32)
+
+    def strip(self, document:dict) -> dict:
+        document.pop(self.embedding_key, None)
+        document.pop(self.scale_key, None)
+        return document
+
+    def pack(self, vectors:List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            matrix for the local index and the inverse norm of every row. int8 rows are requantized
+            with their own scale, which cosine scores do not depend on. float16 is widened to float32,
+            numpy has no fast half precision arithmetic and scanning it is ten times slower
+        """
+        matrix=np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        if self.dtype=="int8":
+            scales=np.abs(matrix).max(axis=1, keepdims=True)/127
+            matrix=np.rint(matrix/np.where(scales==0, 1, scales)).astype(np.int8)
+        norms=np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), self.block_rows):
+            norms[start:start+self.block_rows]=np.linalg.norm(matrix[start:start+self.block_rows].astype(np.float32), axis=1)
+        return matrix, 1/np.where(norms==0, 1, norms)
+
+    def scan(self, matrix:np.ndarray, inverse_norms:np.ndarray, query:np.ndarray, rows:Optional[np.ndarray]=None) -> np.ndarray:
+        """
+            cosine of a normalized query with every row, int8 rows are widened block_rows at a time
+            so the float32 copy stays in cache
+        """
+        if rows is not None:
+            return (matrix[rows].astype(np.float32, copy=False)@query)*inverse_norms[rows]
+        if matrix.dtype==np.float32:
+            return (matrix@query)*inverse_norms
+        scores=np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), self.block_rows):
+            scores[start:start+self.block_rows]=matrix[start:start+self.block_rows].astype(np.float32)@query
+        return scores*inverse_norms
+
+    def rescore(self, query:np.ndarray, hashes:Sequence[Optional[str]], texts:Sequence[Optional[str]], scores:np.ndarray) -> np.ndarray:
+        """
+            exact cosine of every candidate, looked up by content hash and embedded from the text
+            when unknown. Quantized scores are kept unless every candidate has an exact vector, a
+            ranking mixing both kinds orders candidates by their quantization error
+        """
+        vectors:List[Optional[np.ndarray]]=[None]*len(hashes)
+        if self.exact:
+            known=[position for position, hash in enumerate(hashes) if hash]
+            for position, vector in zip(known, self.exact([hashes[position] for position in known])):
+                vectors[position]=vector
+        missing=[position for position, vector in enumerate(vectors) if vector is None and texts[position] is not None]
+        if missing and self.embed:
+            try:
+                for position, vector in zip(missing, self.embed([texts[position] for position in missing])):
+                    vectors[position]=vector
+            except Exception as e:
+                logger.warning("Could not embed %s candidates to rescore, keeping quantized scores: %s", len(missing), e)
+        if any(vector is None for vector in vectors):
+            return np.array(scores, dtype=np.float32)
+        matrix=np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms=np.linalg.norm(matrix, axis=1)
+        return (matrix@query)/np.where(norms==0, 1, norms)
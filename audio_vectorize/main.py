@@ -1,17 +1,36 @@
-from fastapi import FastAPI,Request,HTTPException,UploadFile,File,Body,Form,status
-from fastapi.responses import RedirectResponse,JSONResponse
+from fastapi import FastAPI,Request,HTTPException,UploadFile,File,Body,Form,Query,status
+from fastapi.responses import RedirectResponse,JSONResponse,PlainTextResponse
 #from starlette.middleware.sessions import SessionMiddleware
 
 from audio_vectorize.Model__Speech_Recognition import SpeechRecognitionModel
+from audio_vectorize.Model__TranscriptionCache_SQLite import TranscriptionCacheModel
+from audio_vectorize.Model__IngestCheckpoint_SQLite import IngestCheckpointModel
 from audio_vectorize.Model__FileManagement_PostgressSQL import FileManagementModel
 from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import MongoDBAtlas, Collection
 from audio_vectorize.Model__Embedding_HuggingFace import HuggingFaceEmbeddingsModel
+from audio_vectorize.Model__EmbeddingCache_MemoryMapped import EmbeddingCacheModel
+from audio_vectorize.Model__EmbeddingServer_Socket import RemoteEmbeddingsModel
+from audio_vectorize.Model__VectorIndex_NumPy import VectorIndexModel
+from audio_vectorize.Model__VectorStorage_Quantized import VectorStorageModel, STORAGE_DTYPES
+from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel, reciprocalRankFusion
+from audio_vectorize.Model__Cache_LRU import LRUCacheModel
+from audio_vectorize.Model__IngestionQueue_Background import IngestionQueueModel, IngestionQueueFull, IngestJob, IngestFile
+from audio_vectorize.Model__UploadSpool_Disk import UploadSpoolModel, UploadTooLarge
+from audio_vectorize.Model__AudioProbe_Headers import AudioProbeModel, AudioInfo, UnsupportedAudio
+from audio_vectorize.Model__Metrics_Prometheus import REGISTRY
+from audio_vectorize.Model__Components_Lazy import ComponentRegistryModel
+from audio_vectorize.Model__Deletion_Tombstones import DeletionModel
+from audio_vectorize.Model__Snapshot_Archive import SnapshotModel, listSnapshots
+from fastapi.concurrency import run_in_threadpool
 
-from typing import List,Any
+from typing import List,Any,Optional
 
 import os
 from dotenv import load_dotenv, find_dotenv
 import json
+import logging
+
+logger=logging.getLogger(__name__)
 
 audio_file_types = {
     'WAV',  # Windows container format
@@ -31,108 +50,475 @@ app = FastAPI()
 async def startup_event():
 
     _:bool=load_dotenv(find_dotenv())
+    logging.basicConfig(level=os.getenv('LOG_LEVEL','INFO').upper(),format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
     global SpeechToTextModel; global FilesDatabase; global VectorDatabase; global embeddings
-    SpeechToTextModel=SpeechRecognitionModel()
-    FilesDatabase=FileManagementModel(os.getenv('NEON_CONNECTION_STRING'))
-    FilesDatabase.createTable()
+    global TranscriptionCache; global IngestCheckpoints
+    TranscriptionCache=TranscriptionCacheModel(os.getenv('TRANSCRIPTION_CACHE_PATH','.cache/transcriptions.sqlite3'),max_bytes=int(os.getenv('TRANSCRIPTION_CACHE_MAX_MB','512'))*1024*1024)
+    IngestCheckpoints=IngestCheckpointModel(os.getenv('INGEST_CHECKPOINT_PATH','.cache/checkpoints.sqlite3'),max_age_seconds=float(os.getenv('INGEST_CHECKPOINT_MAX_AGE_HOURS','168'))*3600)
+    SpeechToTextModel=SpeechRecognitionModel(max_workers=int(os.getenv('TRANSCRIBE_WORKERS','4')),executor=os.getenv('TRANSCRIBE_EXECUTOR','thread'),cache=TranscriptionCache,checkpoints=IngestCheckpoints)
+    MetadataCache=LRUCacheModel(max_entries=int(os.getenv('METADATA_CACHE_SIZE','4096')),ttl_seconds=float(os.getenv('METADATA_CACHE_TTL','300')))
+
+    def loadFilesDatabase():
+        database=FileManagementModel(os.getenv('NEON_CONNECTION_STRING'),pool_size=int(os.getenv('DB_POOL_SIZE','5')),max_overflow=int(os.getenv('DB_MAX_OVERFLOW','10')),pool_pre_ping=os.getenv('DB_POOL_PRE_PING','true').lower()=="true",pool_recycle=int(os.getenv('DB_POOL_RECYCLE','1800')),cache=MetadataCache)
+        database.createTable()
+        return database
+
+    def loadEmbeddings():
+        # with an embedding server running, every worker shares its single copy of the model
+        if os.getenv('EMBEDDING_SERVER_ADDRESS'):
+            authkey=os.getenv('EMBEDDING_SERVER_AUTHKEY')
+            remote=RemoteEmbeddingsModel(os.getenv('EMBEDDING_SERVER_ADDRESS'),authkey.encode() if authkey else None)
+            logger.info("Using embedding server %s for %s", remote.address, remote.model_name)
+            return remote
+        model=HuggingFaceEmbeddingsModel(os.getenv('EMBEDDING_MODEL_NAME'),batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE','32')),max_tokens_per_batch=int(os.getenv('EMBEDDING_MAX_TOKENS_PER_BATCH','16384')),cache=EmbeddingCache)
+        model.load()
+        return model
+
+    # connecting to the databases and loading the model wait for first use or the warm up
+    global EmbeddingCache; global Components
+    EmbeddingCache=EmbeddingCacheModel(os.getenv('EMBEDDING_CACHE_DIR','.cache/embeddings'))
+    Components=ComponentRegistryModel()
+
+    # quantized embeddings are rescored with the exact vectors this process has embedded and cached,
+    # the other candidates are embedded again, an embedding server answers those from its own cache
+    exact=None if os.getenv('EMBEDDING_SERVER_ADDRESS') else (lambda hashes: EmbeddingCache.getMany(embeddings.model_name,hashes))
+    global VectorStorage
+    VectorStorage=VectorStorageModel(os.getenv('VECTOR_STORAGE','float32'),oversample=int(os.getenv('VECTOR_RESCORE_OVERSAMPLE','4')),exact=exact,embed=lambda texts: embeddings.embed_documents(texts))
+    if not VectorStorage.atlas_searchable and os.getenv('QUERY_INDEX','atlas')!="local":
+        logger.warning("Atlas cannot search %s embeddings, queries use the local index", VectorStorage.dtype)
+    global Lexical
+    Lexical=LexicalIndexModel(os.getenv('LEXICAL_INDEX_PATH','.cache/lexical.sqlite3')) if os.getenv('LEXICAL_INDEX','true').lower()=="true" else None
+    FilesDatabase=Components.register("files_database",loadFilesDatabase)
+    VectorDatabase=Components.register("vector_database",lambda: MongoDBAtlas(os.getenv('MONGODBATLAS_CONNECTION_STRING'),storage=VectorStorage,lexical=Lexical,version_seconds=float(os.getenv('COLLECTION_VERSION_SECONDS','1'))))
+    embeddings=Components.register("embeddings",loadEmbeddings)
+
+    global LocalVectorIndex; global QueryEmbeddings; global QueryResults
+    LocalVectorIndex=VectorIndexModel(storage=VectorStorage)
+    QueryEmbeddings=LRUCacheModel(int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE','1024')))
+    QueryResults=LRUCacheModel(int(os.getenv('QUERY_RESULT_CACHE_SIZE','1024')),ttl_seconds=float(os.getenv('QUERY_RESULT_CACHE_TTL','300')))
+
+    global IngestionQueue; global UploadSpool; global AudioProbe
+    AudioProbe=AudioProbeModel()
+    UploadSpool=UploadSpoolModel(os.getenv('INGEST_SPOOL_DIR'),max_file_bytes=int(os.getenv('MAX_UPLOAD_FILE_MB','2048'))*1024*1024,max_request_bytes=int(os.getenv('MAX_UPLOAD_REQUEST_MB','4096'))*1024*1024)
+    IngestionQueue=IngestionQueueModel(ingestAudio,workers=int(os.getenv('INGEST_WORKERS','2')),max_pending=int(os.getenv('INGEST_MAX_PENDING','100')),spool=UploadSpool,finalize=ingestVectors,store=FilesDatabase,save_seconds=float(os.getenv('JOB_SAVE_SECONDS','1')),retention_seconds=float(os.getenv('JOB_RETENTION_HOURS','168'))*3600)
+    IngestionQueue.start()
+
+    global Deletions
+    Deletions=DeletionModel(FilesDatabase,VectorDatabase,LocalVectorIndex,retry_seconds=float(os.getenv('DELETE_RETRY_SECONDS','60')))
+    Deletions.start()
+
+    global Snapshots; global SnapshotDirectory
+    SnapshotDirectory=os.getenv('SNAPSHOT_DIR','.cache/snapshots')
+    Snapshots=SnapshotModel(FilesDatabase,VectorDatabase,embeddings,None if os.getenv('EMBEDDING_SERVER_ADDRESS') else EmbeddingCache,workers=int(os.getenv('SNAPSHOT_WORKERS','4')),shard_rows=int(os.getenv('SNAPSHOT_SHARD_ROWS','10000')))
+
+    global ReadinessComponents
+    warm_up=os.getenv('WARM_UP','true').lower()=="true"
+    ReadinessComponents=[name for name in os.getenv('READINESS_COMPONENTS',",".join(Components.names()) if warm_up else "").split(",") if name]
+    if warm_up:
+        Components.warmUp()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await IngestionQueue.stop()
+    await Deletions.stop()
+    SpeechToTextModel.close()
+    TranscriptionCache.close()
+    IngestCheckpoints.close()
+    EmbeddingCache.close()
+    if Lexical:
+        Lexical.close()
+    database=Components.loaded("files_database")
+    if database:
+        await database.close()
 
-    VectorDatabase=MongoDBAtlas(os.getenv('MONGODBATLAS_CONNECTION_STRING'))
+@app.middleware("http")
+async def limitUploadSize(request:Request, call_next):
+    """
+        rejects oversized audio uploads from their declared length before the body is parsed
+    """
+    length=request.headers.get("content-length")
+    if request.url.path.startswith("/api/audio/") and length and length.isdigit() and UploadSpool.max_request_bytes is not None:
+        # multipart framing and form fields come on top of the audio bytes
+        if int(length)>UploadSpool.max_request_bytes+1024*1024:
+            return JSONResponse(status_code=413,content={"detail":f"Request of {length} bytes is over the upload size limit"})
+    return await call_next(request)
 
-    embeddings=HuggingFaceEmbeddingsModel()
+def probeUploads(audiofiles:List[UploadFile]) -> List[AudioInfo]:
+    """
+        sniffs every upload's header, unsupported types are refused before anything is spooled or decoded
+    """
+    infos=[]
+    for file in audiofiles:
+        try:
+            info=AudioProbe.probe(file.file)
+        except UnsupportedAudio as e:
+            raise HTTPException(status_code=415, detail=f"{file.filename}: {e}")
+        if info.format not in audio_file_types:
+            raise HTTPException(status_code=415, detail=f"{file.filename}: unsupported audio format {info.format}")
+        infos.append(info)
+    return infos
 
 @app.get("/api")
 def hello_world():
     return {"message": "Hello World"}
 
+@app.get("/healthz")
+def healthz():
+    """
+        liveness, the process is up and serving, says nothing about its backends
+    """
+    return {"status":"ok"}
 
-@app.post("/api/audio/upload")
+@app.get("/readyz")
+def readyz():
+    """
+        readiness, 503 until every component in READINESS_COMPONENTS is warm
+    """
+    ready=Components.ready(ReadinessComponents)
+    return JSONResponse(status_code=200 if ready else 503,content={"ready":ready,"requires":ReadinessComponents,"components":Components.status()})
+
+
+async def requireComponents(*names:str):
+    """
+        builds the named components off the event loop before an async route touches them,
+        503 while one of them cannot be built
+    """
+    try:
+        await Components.loadAsync(list(names))
+    except Exception as e:
+        logger.error("Components %s unavailable: %s", ", ".join(names), e)
+        raise HTTPException(status_code=503, detail=f"Service unavailable, retry later Error={e}")
+
+
+async def ingestAudio(job:IngestJob, jobfile:IngestFile, file:UploadFile):
+    """
+        background pipeline for one spooled upload, files rows and vectors are written per job
+    """
+    jobfile.enter("transcribing")
+    transcription=await SpeechToTextModel.audioToText(file,jobfile.sha256)
+    logger.debug("%s", transcription)
+    jobfile.enter("waiting_for_batch")
+    return transcription
+
+
+async def ingestVectors(job:IngestJob, results):
+    """
+        adds the file rows of every transcribed file of a job in one insert, then embeds and
+        writes all their chunks in one bulk insert. Rows stay "ingesting" until their vectors are
+        written, a retry of the same upload claims a partial row, or one left ingesting for
+        INGEST_STALE_SECONDS by a worker that died, keeps its written chunks and drops the ones
+        the new transcript no longer has
+    """
+    for jobfile, _ in results:
+        jobfile.enter("saving_metadata")
+    await Components.loadAsync(["files_database","vector_database"])
+    unfinished=await FilesDatabase.claimUnfinishedFilesAsync(job.collection_id,[jobfile.sha256 for jobfile, _ in results],float(os.getenv('INGEST_STALE_SECONDS','3600')))
+    resumed=[unfinished.pop(jobfile.sha256,None) for jobfile, _ in results]
+    added=iter(await FilesDatabase.addFilesAsync([jobfile for (jobfile, _), row in zip(results,resumed) if row is None],job.collection_id))
+    uploadedFiles=[row or next(added) for row in resumed]
+
+    for (jobfile, _), uploadedFile in zip(results,uploadedFiles):
+        jobfile.file_id=str(uploadedFile.id)
+        jobfile.enter("embedding")
+    file_ids=[str(uploadedFile.id) for uploadedFile in uploadedFiles]
+    files=[(transcription,{"id":file_id}) for (_, transcription), file_id in zip(results,file_ids)]
+    try:
+        await run_in_threadpool(VectorDatabase.Bulk_Insert_Files,files,job.database,job.collection,embeddings,job.chunk_size,job.chunk_overlap,int(os.getenv('VECTOR_BATCH_SIZE','256')),[str(row.id) for row in resumed if row is not None],os.getenv('CHUNK_UNIT','characters'))
+    except Exception:
+        await FilesDatabase.setFilesStatusAsync(file_ids,"partial")
+        raise
+    await FilesDatabase.setFilesStatusAsync(file_ids,"complete")
+
+
+@app.post("/api/audio/upload", status_code=status.HTTP_202_ACCEPTED)
 async def uploadAudio(audiofiles:List[UploadFile]=File(...),database_id:str=Form(...),collection_id:str=Form(...),chunk_size:int=Form(...),chunk_overlap:int=Form(...)):
-    successful:List[str]=[]
-    print("POST : upload files",len(audiofiles))
+    logger.info("POST : upload files %s", len(audiofiles))
+    await requireComponents("files_database")
 
     # get db and collection name using id's
-    database=FilesDatabase.getDatabase(database_id)
-    if not database:
-        raise HTTPException(status_code=410, detail="No database")
-    collection=FilesDatabase.getCollection(collection_id)
-    if not collection:
-        raise HTTPException(status_code=410, detail="No collection")
     try:
-        for file in audiofiles:
-            print(file)
-            transcription=await SpeechToTextModel.audioToText(file)
-            print(transcription)
-            uploadedFile=FilesDatabase.addFile(file,collection_id)
-            
-            
-            if uploadedFile:
-                metadata={"id":str(uploadedFile.id)}
-                result=VectorDatabase.Insert_Files(transcription,metadata,database.name,collection.name,embeddings,"hf_embeddings",chunk_size,chunk_overlap)
-                successful.append(file.filename)
-                print("\n-----------------------------------------------------------------------\n")
+        database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=410, detail="No database or collection")
+    probes=await run_in_threadpool(probeUploads,audiofiles)
+    try:
+        job=await IngestionQueue.submit(audiofiles,database.name,collection.name,collection_id,chunk_size,chunk_overlap,probes)
+        return {"success":True,"message":"files queued","job_id":job.id,"files":len(job.files)}
+
+    except UploadTooLarge as e:
+        logger.error(e)
+        raise HTTPException(status_code=413, detail=str(e))
+    except IngestionQueueFull as e:
+        logger.error(e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=500,detail=f"Error in queueing audio Error={e}")
+
 
-        return {"success":True,"message":"files uploaded","successful":successful,"unsuccessful":len(audiofiles)-len(successful)}
+@app.get("/api/jobs/{id}")
+def getJob(id:str):
+    """
+        any worker answers, jobs other workers run are read as they last saved them
+    """
+    job=IngestionQueue.getJob(id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
+
+def searchChunks(vector, database:str, collection:str, file_id:Optional[str], k:int, local:bool):
+    """
+        atlas vector search, or the in-process index when asked for, when atlas search fails or
+        when atlas cannot index the storage mode, it finds nothing in float16 fields without erroring
+    """
+    if not local and VectorStorage.atlas_searchable:
+        try:
+            return VectorDatabase.Query_Files(vector,database,collection,"hf_embeddings",k,file_id), "atlas"
+        except Exception as e:
+            logger.warning("Atlas vector search failed, falling back to local index: %s", e)
+
+    version=VectorDatabase.Collection_Version(database,collection)
+    index=LocalVectorIndex.get(database,collection)
+    if index is None or index.version!=version:
+        index=LocalVectorIndex.build(VectorDatabase.client[database][collection],database,collection,version)
+    return LocalVectorIndex.search(index,vector,k,file_id), "local"
+
+
+def searchLexical(question:str, database:str, collection:str, file_id:Optional[str], k:int):
+    """
+        BM25 hits of the lexical index, no embedding involved
+    """
+    hits=Lexical.search(database,collection,question,k,file_id)
+    scores=dict(hits)
+    documents=VectorDatabase.Get_Chunks([id for id,_ in hits],database,collection)
+    for document in documents:
+        document["score"]=scores[document["_id"]]
+    return documents
+
+
+def searchHybrid(vector, question:str, database:str, collection:str, file_id:Optional[str], k:int, local:bool):
+    """
+        vector and lexical results merged by reciprocal rank fusion, the score is the fused one
+    """
+    dense,source=searchChunks(vector,database,collection,file_id,k,local)
+    lexical=searchLexical(question,database,collection,file_id,k)
+    documents={document["_id"]:document for document in lexical+dense}
+    fused=reciprocalRankFusion([[document["_id"] for document in dense],[document["_id"] for document in lexical]],int(os.getenv('RRF_K','60')))[:k]
+    return [{**documents[id],"score":score} for id,score in fused], f"hybrid:{source}"
+
+
+@app.post("/api/query")
+async def queryAudio(question:str=Body(...),database_id:str=Body(...),collection_id:str=Body(...),file_id:Optional[str]=Body(None),k:int=Body(4),local:Optional[bool]=Body(None),mode:str=Body("vector")):
+    """
+        mode : "vector" embeds the question, "lexical" matches its words and quoted phrases with
+        BM25 without the embedding model, "hybrid" fuses both rankings
+    """
+    logger.info("POST : query %s", question)
+    if mode not in ("vector","lexical","hybrid"):
+        raise HTTPException(status_code=400, detail=f"Unknown query mode {mode}, expected vector, lexical or hybrid")
+    if mode!="vector" and not Lexical:
+        raise HTTPException(status_code=400, detail="Lexical index is disabled, set LEXICAL_INDEX=true")
+    await requireComponents("files_database","vector_database")
+    try:
+        database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
     except Exception as e:
-        print(e)
-        raise HTTPException(status_code=500,detail=f"Error in uploading audio Error={e}, {len(successful)}/{len(audiofiles)} successfuly uploaded : List {successful}")
+        logger.error(e)
+        raise HTTPException(status_code=410, detail="No database or collection")
+    if local is None:
+        local=os.getenv('QUERY_INDEX','atlas')=="local"
+
+    try:
+        # results are cached per collection version, any write from this process invalidates them
+        key=(database.name,collection.name,file_id,k,question,local,mode,VectorDatabase.Collection_Version(database.name,collection.name))
+        cached=QueryResults.get(key)
+        if cached:
+            return {"success":True,"message":"query results","cached":True,**cached}
+
+        if mode=="lexical":
+            documents=await run_in_threadpool(searchLexical,question,database.name,collection.name,file_id,k)
+            source="lexical"
+        else:
+            vector=await run_in_threadpool(QueryEmbeddings.getOrLoad,question,lambda: embeddings.embed_query(question))
+            if mode=="hybrid":
+                documents,source=await run_in_threadpool(searchHybrid,vector,question,database.name,collection.name,file_id,k,local)
+            else:
+                documents,source=await run_in_threadpool(searchChunks,vector,database.name,collection.name,file_id,k,local)
+        results=[{"text":document.pop("text",""),"score":document.pop("score",None),"metadata":document} for document in documents]
+        QueryResults.put(key,{"source":source,"results":results})
+        return {"success":True,"message":"query results","cached":False,"source":source,"results":results}
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=500, detail=f"Error in querying audio Error={e}")
+
+
+@app.post("/api/query/lexical/rebuild")
+async def rebuildLexicalIndex(database_id:str=Body(...),collection_id:str=Body(...)):
+    if not Lexical:
+        raise HTTPException(status_code=400, detail="Lexical index is disabled, set LEXICAL_INDEX=true")
+    await requireComponents("files_database","vector_database")
+    database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
+    indexed=await run_in_threadpool(VectorDatabase.Rebuild_Lexical_Index,database.name,collection.name)
+    return {"success":True,"message":"lexical index rebuilt","chunks":indexed}
+
+
+@app.get("/api/query/lexical")
+def getLexicalIndex():
+    return {"success":True,"enabled":Lexical is not None,"stats":Lexical.stats() if Lexical else None}
+
+
+@app.post("/api/query/index/rebuild")
+async def rebuildQueryIndex(database_id:str=Body(...),collection_id:str=Body(...)):
+    await requireComponents("files_database","vector_database")
+    database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
+    version=VectorDatabase.Collection_Version(database.name,collection.name)
+    index=await run_in_threadpool(LocalVectorIndex.build,VectorDatabase.client[database.name][collection.name],database.name,collection.name,version)
+    return {"success":True,"message":"local index rebuilt","chunks":len(index.documents)}
+
+
+def snapshotPath(name:str) -> str:
+    """
+        snapshots live in SNAPSHOT_DIR, a name is one path component
+    """
+    if not name or os.path.basename(name)!=name or name in (".",".."):
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot name {name}")
+    return os.path.join(SnapshotDirectory,name)
+
+
+@app.get("/api/snapshots")
+def getSnapshots():
+    return {"success":True,"snapshots":listSnapshots(SnapshotDirectory)}
+
+
+@app.post("/api/snapshots/export")
+async def exportSnapshot(database_id:str=Body(...),collection_id:str=Body(...),name:str=Body(...),dtype:Optional[str]=Body(None)):
+    """
+        writes the collection's file rows, chunks and embeddings to SNAPSHOT_DIR/name
+    """
+    path=snapshotPath(name)
+    if dtype and dtype not in STORAGE_DTYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown vector storage {dtype}, expected one of {', '.join(STORAGE_DTYPES)}")
+    await requireComponents("files_database")
+    try:
+        database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=410, detail="No database or collection")
+    try:
+        manifest=await run_in_threadpool(Snapshots.export,database.name,collection.name,collection_id,path,dtype)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=440, detail=f"Error in exporting snapshot Error={e}")
+    return {"success":True,"message":"snapshot exported","name":name,"files":manifest["files"]["count"],"chunks":manifest["chunks"],"dtype":manifest["dtype"]}
+
+
+@app.post("/api/snapshots/import")
+async def importSnapshot(database_id:str=Body(...),collection_id:str=Body(...),name:str=Body(...),reembed:bool=Body(False)):
+    """
+        loads SNAPSHOT_DIR/name into the collection, reembed embeds the chunk texts with the current
+        model instead of loading the stored vectors
+    """
+    path=snapshotPath(name)
+    await requireComponents("files_database")
+    try:
+        database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=410, detail="No database or collection")
+    try:
+        result=await run_in_threadpool(Snapshots.restore,path,database.name,collection.name,collection_id,reembed)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=440, detail=f"Error in importing snapshot Error={e}")
+    return {"success":True,"message":"snapshot imported",**result}
+
+
+@app.get("/metrics")
+def getMetrics():
+    return PlainTextResponse(REGISTRY.render(),media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/audio/transcription_cache")
+def getTranscriptionCache():
+    return {"success":True,"stats":TranscriptionCache.stats(),"checkpoints":IngestCheckpoints.stats()}
 
 
 @app.put("/api/audio/update")
 async def updateAudio(audiofiles:List[UploadFile]=File(...),database_id:str=Form(...),collection_id:str=Form(...),file_id:str=Form(...),chunk_size:int=Form(...),chunk_overlap:int=Form(...)):
     successful:List[str]=[]
-    print("POST : upload files",len(audiofiles))
+    logger.info("POST : upload files %s", len(audiofiles))
+    await requireComponents("files_database","vector_database")
 
     # get db and collection name using id's
-    database=FilesDatabase.getDatabase(database_id)
-    if not database:
-        raise HTTPException(status_code=410, detail="No database")
-    collection=FilesDatabase.getCollection(collection_id)
-    if not collection:
-        raise HTTPException(status_code=410, detail="No collection")
     try:
-        for file in audiofiles:
-            transcription=await SpeechToTextModel.audioToText(file)
-            print(transcription)
-            updated=VectorDatabase.Update_Files(transcription,file_id,database.name,collection.name,embeddings,"hf_embeddings",chunk_size,chunk_overlap)
-            updateFile=FilesDatabase.updateFile(file, file_id)
+        database,collection=await FilesDatabase.getDatabaseAndCollectionAsync(database_id,collection_id)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=410, detail="No database or collection")
+    probes=await run_in_threadpool(probeUploads,audiofiles)
+    try:
+        spooled=await UploadSpool.spool(audiofiles,f"update-{file_id}")
+    except UploadTooLarge as e:
+        logger.error(e)
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        for upload, probe in zip(spooled, probes):
+            file=UploadSpool.open(upload)
+            try:
+                transcription=await SpeechToTextModel.audioToText(file,upload.sha256)
+            finally:
+                await file.close()
+            logger.debug("%s", transcription)
+            updated=await run_in_threadpool(VectorDatabase.Update_Files,transcription,file_id,database.name,collection.name,embeddings,"hf_embeddings",chunk_size,chunk_overlap,os.getenv('CHUNK_UNIT','characters'))
+            updateFile=await FilesDatabase.updateFileAsync(file, file_id, probe.format, upload.sha256)
             successful.append(file.filename)
 
             return {"success":True,"message":"files updated"}
 
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail=f"Error in updating audio {len(successful)}/{len(audiofiles)} successfuly updated : List {successful}")
+    finally:
+        UploadSpool.remove(spooled)
     return {"message":"files updated"}
 
+def deletionResult(deletion, message:str) -> dict:
+    """
+        the rows are gone either way, vectors are "pending" when the vector store side failed and
+        is left to the retry loop
+    """
+    return {"success":True,"message":message,"vectors":"deleted" if Deletions.apply(deletion) else "pending"}
+
 @app.delete("/api/audio/{id}")
 def deleteAudio(id:str):
     try:
-        print("DELETE : FastAPI delete")
-        FilesDatabase.deleteFile(id)
+        logger.info("DELETE : FastAPI delete")
+        deletion=FilesDatabase.deleteFile(id)
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail="Error in deleting audio")
+    if deletion is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return deletionResult(deletion,"audio deleted")
 
 
 ###################  Database and Collection EndPoints
 
+@app.get("/api/FileManagement/cache")
+def getMetadataCache():
+    return {"success":True,"stats":FilesDatabase.cacheStats()}
+
+
 @app.get("/api/FileManagement/database_and_collections")
-def getDatabaseAndCollections(email:str):
+def getDatabaseAndCollections(email:str,limit:int=Query(100,ge=1,le=1000),cursor:Optional[str]=None,stats:bool=False):
     try:
-        databaseAndCollections=FilesDatabase.getDatabaseAndCollections(email)
-        databaseAndCollections = [
-            {"Database": dict(row.Database), "Collection": dict(row.Collection)}
-            for row in databaseAndCollections
-        ]
-        for item in databaseAndCollections:
-            print(item)
-
-        return {"success":True,"message":"fetched database and collections","data":databaseAndCollections}
+        databaseAndCollections,next_cursor=FilesDatabase.getDatabaseAndCollections(email,limit,cursor,stats)
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail=f"Internal server error {str(e)}")
+    return {"success":True,"message":"fetched database and collections","data":databaseAndCollections,"next_cursor":next_cursor}
 
 @app.post("/api/FileManagement/create/database")
 def createDatabase(email:str=Body(...),database:str=Body(...)):
@@ -140,17 +526,19 @@ def createDatabase(email:str=Body(...),database:str=Body(...)):
         database= FilesDatabase.createDatabase(email,database)
         return {"success":True,"message":"created database","database":database}
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail=f"Internal server error {e}")
     
 @app.delete("/api/FileManagement/delete/database")
 def deleteDatabase(database_id:str):
     try:
-        FilesDatabase.deleteDatabase(database_id)
+        deletion=FilesDatabase.deleteDatabase(database_id)
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail="Error in deleting database")
-    return {"success":True,"message":"database deleted"}
+    if deletion is None:
+        raise HTTPException(status_code=410, detail="No database")
+    return deletionResult(deletion,"database deleted")
     
     ####
 @app.post("/api/FileManagement/create/collection")
@@ -159,17 +547,19 @@ def createCollection(name:str=Body(...), database_id:str=Body(...)):
         collection= FilesDatabase.createCollection(name, database_id)
         return {"success":True,"message":"created collection","collection":collection}
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail=f"Internal server error {e}")
     
 @app.delete("/api/FileManagement/delete/collection")
 def deleteCollection(collection_id:str):
     try:
-        FilesDatabase.deleteCollection(collection_id)
+        deletion=FilesDatabase.deleteCollection(collection_id)
     except Exception as e:
-        print(e)
+        logger.error(e)
         raise HTTPException(status_code=440, detail="Error in deleting collection")
-    return {"success":True,"message":"collection deleted"}
+    if deletion is None:
+        raise HTTPException(status_code=410, detail="No collection")
+    return deletionResult(deletion,"collection deleted")
     
 
 
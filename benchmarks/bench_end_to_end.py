@@ -0,0 +1,237 @@
+"""
+    end to end ingest throughput through POST /api/audio/upload with every backend replaced by a
+    local stand-in: fixed latency recognizer, SQLite for Neon, mongomock for Atlas, hashed embeddings
+
+    python -m benchmarks.bench_end_to_end --requests 8 --files 2 --seconds 120 --latency 0.05 --output e2e.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import mongomock
+from fastapi.testclient import TestClient
+
+import audio_vectorize.main as service
+from audio_vectorize.Model__AudioProbe_Headers import AudioProbeModel
+from audio_vectorize.Model__Cache_LRU import LRUCacheModel
+from audio_vectorize.Model__Components_Lazy import ComponentRegistryModel
+from audio_vectorize.Model__FileManagement_PostgressSQL import FileManagementModel
+from audio_vectorize.Model__IngestionQueue_Background import IngestionQueueModel
+from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel
+from audio_vectorize.Model__Metrics_Prometheus import STAGE_SECONDS
+from audio_vectorize.Model__Speech_Recognition import SpeechRecognitionModel
+from audio_vectorize.Model__UploadSpool_Disk import UploadSpoolModel
+from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import MongoDBAtlas
+from audio_vectorize.Model__VectorIndex_NumPy import VectorIndexModel
+from audio_vectorize.Model__VectorStorage_Quantized import STORAGE_DTYPES, VectorStorageModel
+from benchmarks.synthetic import speechLikeAudio, wavBytes, FixedLatencyRecognizer, HashEmbeddings
+
+
+TERMINAL={"done","partial","failed"}
+
+
+def percentile(values:List[float], q:float) -> float:
+    if not values:
+        return 0.0
+    ordered=sorted(values)
+    position=min(len(ordered)-1, max(0, round(q/100*(len(ordered)-1))))
+    return ordered[position]
+
+
+def rss() -> int:
+    """
+        current resident set size in bytes, peak so far where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system()=="Darwin" else peak*1024
+
+
+class StageMemory():
+    """
+        samples RSS in the background and charges it to every stage a file is in at that moment,
+        with files in different stages at once a stage's peak is an upper bound
+    """
+    def __init__(self, interval:float=0.01):
+        self.interval=interval
+        self.peaks:Dict[str,int]={}
+        self.stop=threading.Event()
+        self.thread=threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop.is_set():
+            current=rss()
+            queue=getattr(service, "IngestionQueue", None)
+            stages={file.stage for job in list(queue.jobs.values()) if queue for file in job.files if file.status in ("pending","running")} if queue else set()
+            for stage in stages or {"idle"}:
+                self.peaks[stage]=max(self.peaks.get(stage,0), current)
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def configure(args, workdir:str):
+    """
+        startup replacement, the same globals main.startup_event sets but on local stand-ins
+    """
+    async def startup():
+        service.SpeechToTextModel=SpeechRecognitionModel(recognizer=FixedLatencyRecognizer(args.latency, args.words_per_second), max_workers=args.transcribe_workers)
+        files_database=FileManagementModel(f"sqlite:///{os.path.join(workdir,'bench.sqlite3')}", cache=LRUCacheModel(4096, 300))
+        files_database.createTable()
+        storage=service.VectorStorage=VectorStorageModel(args.vector_storage)
+        service.Lexical=LexicalIndexModel(os.path.join(workdir,"lexical.sqlite3")) if args.lexical else None
+        vector_database=MongoDBAtlas(None, client=mongomock.MongoClient(), storage=storage, lexical=service.Lexical)
+        embeddings=HashEmbeddings()
+        service.Components=ComponentRegistryModel()
+        service.FilesDatabase=service.Components.register("files_database", lambda: files_database)
+        service.VectorDatabase=service.Components.register("vector_database", lambda: vector_database)
+        service.embeddings=service.Components.register("embeddings", lambda: embeddings)
+        service.LocalVectorIndex=VectorIndexModel(storage=storage)
+        service.QueryEmbeddings=LRUCacheModel(1024)
+        service.QueryResults=LRUCacheModel(1024)
+        service.AudioProbe=AudioProbeModel()
+        service.UploadSpool=UploadSpoolModel(os.path.join(workdir,"spool"))
+        service.IngestionQueue=IngestionQueueModel(service.ingestAudio, workers=args.ingest_workers, max_pending=max(100, args.requests*args.files), spool=service.UploadSpool, finalize=service.ingestVectors)
+        service.IngestionQueue.start()
+
+    async def shutdown():
+        await service.IngestionQueue.stop()
+        service.SpeechToTextModel.close()
+        await service.FilesDatabase.close()
+
+    service.app.router.on_startup=[startup]
+    service.app.router.on_shutdown=[shutdown]
+
+
+def stageSpans() -> Dict[str,dict]:
+    spans={}
+    for (stage,), (_, total, count) in STAGE_SECONDS.values.items():
+        spans[stage]={"count":count,"seconds":round(total,4),"mean_ms":round(total/count*1000,3) if count else 0.0}
+    return spans
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git","rev-parse","--short","HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run(args) -> dict:
+    audio=speechLikeAudio(args.seconds)
+    if args.format=="wav":
+        data=wavBytes(audio)
+    else:
+        buffer=tempfile.SpooledTemporaryFile()
+        audio.export(buffer, format=args.format)
+        buffer.seek(0)
+        data=buffer.read()
+    audio_seconds=len(audio)/1000
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(args, workdir)
+        with TestClient(service.app) as client, StageMemory() as memory:
+            database=service.FilesDatabase.createDatabase("bench@example.com", f"bench-{int(time.time())}")
+            collection=service.FilesDatabase.createCollection(f"bench-{database.id}", str(database.id))
+            form={"database_id":str(database.id),"collection_id":str(collection.id),"chunk_size":str(args.chunk_size),"chunk_overlap":str(args.chunk_overlap)}
+
+            started=time.perf_counter()
+            submitted={}
+            post_latencies=[]
+            for request in range(args.requests):
+                files=[("audiofiles",(f"book-{request}-{index}.{args.format}", data, f"audio/{args.format}")) for index in range(args.files)]
+                posted=time.perf_counter()
+                response=client.post("/api/audio/upload", files=files, data=form)
+                post_latencies.append(time.perf_counter()-posted)
+                response.raise_for_status()
+                submitted[response.json()["job_id"]]=posted
+
+            finished={}
+            statuses={}
+            while len(finished)<len(submitted):
+                for job_id, posted in submitted.items():
+                    if job_id in finished:
+                        continue
+                    job=client.get(f"/api/jobs/{job_id}").json()
+                    if job["status"] in TERMINAL:
+                        finished[job_id]=time.perf_counter()-posted
+                        statuses[job_id]=job
+                time.sleep(args.poll)
+            wall=time.perf_counter()-started
+
+        file_stages:Dict[str,List[float]]={}
+        for job in statuses.values():
+            for file in job["files"]:
+                for stage, seconds in file["stage_seconds"].items():
+                    file_stages.setdefault(stage,[]).append(seconds)
+
+    total_audio=audio_seconds*args.requests*args.files
+    latencies=list(finished.values())
+    return {
+        "benchmark":"end_to_end",
+        "commit":commit(),
+        "created_at":time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config":vars(args),
+        "audio_seconds_per_file":audio_seconds,
+        "wall_seconds":round(wall,3),
+        "audio_hours_per_minute":round(total_audio/3600/(wall/60),4),
+        "files":{"done":sum(file["status"]=="done" for job in statuses.values() for file in job["files"]),"total":args.requests*args.files},
+        "upload_latency_ms":{"p50":round(percentile(post_latencies,50)*1000,2),"p99":round(percentile(post_latencies,99)*1000,2)},
+        "ingest_latency_s":{"p50":round(percentile(latencies,50),3),"p99":round(percentile(latencies,99),3)},
+        "file_stages_s":{stage:{"p50":round(percentile(values,50),4),"p99":round(percentile(values,99),4)} for stage, values in file_stages.items()},
+        "spans":stageSpans(),
+        "peak_rss_mb":{stage:round(peak/1024/1024,1) for stage, peak in sorted(memory.peaks.items())},
+    }
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--files", type=int, default=2, help="files per upload request")
+    parser.add_argument("--seconds", type=float, default=120, help="audio length of every file")
+    parser.add_argument("--format", default="wav", choices=["wav","mp3","flac","ogg"])
+    parser.add_argument("--latency", type=float, default=0.05, help="recognizer latency per chunk")
+    parser.add_argument("--words-per-second", type=float, default=2.5)
+    parser.add_argument("--transcribe-workers", type=int, default=4)
+    parser.add_argument("--ingest-workers", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--vector-storage", default="float32", choices=STORAGE_DTYPES)
+    parser.add_argument("--lexical", action="store_true", help="keep the BM25 index up to date while ingesting")
+    parser.add_argument("--poll", type=float, default=0.05)
+    parser.add_argument("--output", default="bench_end_to_end.json")
+    args=parser.parse_args()
+
+    results=run(args)
+    with open(args.output,"w") as output:
+        json.dump(results, output, indent=2)
+
+    print(f"{results['files']['done']}/{results['files']['total']} files, {results['audio_seconds_per_file']:.0f}s of audio each, {results['wall_seconds']:.1f}s wall")
+    print(f"throughput   {results['audio_hours_per_minute']:.3f} audio-hours/min")
+    print(f"upload       p50 {results['upload_latency_ms']['p50']:.1f}ms  p99 {results['upload_latency_ms']['p99']:.1f}ms")
+    print(f"ingest       p50 {results['ingest_latency_s']['p50']:.2f}s  p99 {results['ingest_latency_s']['p99']:.2f}s")
+    for stage, span in results["spans"].items():
+        print(f"  {stage:<16} {span['count']:>6} spans  {span['seconds']:>9.3f}s  mean {span['mean_ms']:.2f}ms")
+    for stage, peak in results["peak_rss_mb"].items():
+        print(f"  peak rss {stage:<18} {peak:.1f} MB")
+    print(f"results written to {args.output}")
+
+
+if __name__=="__main__":
+    main()
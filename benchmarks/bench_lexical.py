@@ -0,0 +1,94 @@
+"""
+    BM25 index build speed, size on disk against the raw text, and query latency for rare terms,
+    quoted phrases and common words on a synthetic transcript corpus
+
+    python -m benchmarks.bench_lexical --chunks 50000 --output lexical.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel
+from benchmarks.bench_end_to_end import percentile
+
+
+NAMES=["ahab","ishmael","queequeg","starbuck","stubb","flask","pip","fedallah","tashtego","daggoo"]
+
+
+def corpus(chunks:int, words_per_chunk:int, vocabulary:int, seed:int=0) -> List[dict]:
+    """
+        zipf distributed words with a character name dropped into one chunk in a thousand
+    """
+    generator=np.random.default_rng(seed)
+    ranks=np.minimum(generator.zipf(1.1, chunks*words_per_chunk), vocabulary)-1
+    words=[f"w{rank}" for rank in ranks]
+    documents=[]
+    for index in range(chunks):
+        text=words[index*words_per_chunk:(index+1)*words_per_chunk]
+        if index%1000==0:
+            name=NAMES[(index//1000)%len(NAMES)]
+            text[10:10]=["captain", name, "said", "call", "me", "ishmael"]
+        documents.append({"_id":f"chunk-{index}","id":f"file-{index//200}","text":" ".join(text)})
+    return documents
+
+
+def timeQueries(index:LexicalIndexModel, queries:List[str], repeat:int) -> Dict[str,float]:
+    seconds=[]
+    for _ in range(repeat):
+        for query in queries:
+            started=time.perf_counter()
+            index.search("bench", "chunks", query, 10)
+            seconds.append(time.perf_counter()-started)
+    return {"p50_ms":percentile(seconds, 50)*1000, "p95_ms":percentile(seconds, 95)*1000}
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--words-per-chunk", type=int, default=90)
+    parser.add_argument("--vocabulary", type=int, default=30000)
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per write, like VECTOR_BATCH_SIZE")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="bench_lexical.json")
+    args=parser.parse_args()
+
+    documents=corpus(args.chunks, args.words_per_chunk, args.vocabulary)
+    text_bytes=sum(len(document["text"].encode()) for document in documents)
+    with tempfile.TemporaryDirectory() as workdir:
+        index=LexicalIndexModel(os.path.join(workdir, "lexical.sqlite3"))
+        started=time.perf_counter()
+        for start in range(0, len(documents), args.batch_size):
+            index.add("bench", "chunks", documents[start:start+args.batch_size])
+        build_seconds=time.perf_counter()-started
+        stats=index.stats()
+        file_bytes=sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir))
+
+        results={
+            "chunks_per_second":args.chunks/build_seconds,
+            "text_bytes":text_bytes,
+            "posting_bytes":stats["posting_bytes"],
+            "file_bytes":file_bytes,
+            "segments":stats["segments"],
+            "rare_term":timeQueries(index, NAMES, args.repeat),
+            "phrase":timeQueries(index, [f'"captain {name} said"' for name in NAMES], args.repeat),
+            "rare_and_common":timeQueries(index, [f"w0 w1 {name}" for name in NAMES], args.repeat),
+            "common_terms":timeQueries(index, ["w0 w1 w2", "w3 w5", "w10 w20 w30"], args.repeat),
+        }
+        index.close()
+
+    print(f"{args.chunks} chunks of {args.words_per_chunk} words, {results['chunks_per_second']:.0f} chunks/s indexed in batches of {args.batch_size}")
+    print(f"postings {results['posting_bytes']/2**20:.1f} MB ({results['posting_bytes']/text_bytes:.2f}x the text), sqlite file {file_bytes/2**20:.1f} MB, {results['segments']} segments")
+    for name in ("rare_term","phrase","rare_and_common","common_terms"):
+        print(f"{name:<16} p50 {results[name]['p50_ms']:7.2f} ms   p95 {results[name]['p95_ms']:7.2f} ms")
+    with open(args.output,"w") as output:
+        json.dump({"config":vars(args),"results":results}, output, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__=="__main__":
+    main()
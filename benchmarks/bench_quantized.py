@@ -0,0 +1,96 @@
+"""
+    stored size, decode speed, scan latency and recall@k of the vector storage modes on synthetic
+    embeddings, recall is measured against exact float32 search over the same vectors
+
+    python -m benchmarks.bench_quantized --vectors 20000 --dimension 768 --queries 200 --output quantized.json
+"""
+import argparse
+import json
+import time
+import uuid
+from typing import Dict, List
+
+import bson
+import numpy as np
+
+from audio_vectorize.Model__VectorIndex_NumPy import CollectionIndex, VectorIndexModel
+from audio_vectorize.Model__VectorStorage_Quantized import STORAGE_DTYPES, VectorStorageModel
+from benchmarks.synthetic import WORDS, clusteredEmbeddings
+
+
+def chunkDocument(position:int, text:str, fields:dict) -> dict:
+    return {"_id":bson.ObjectId(),"text":text,"id":str(uuid.uuid4()),"content_hash":str(position),"start_char":position*450,"end_char":position*450+500,**fields}
+
+
+def measure(storage:VectorStorageModel, vectors:np.ndarray, queries:np.ndarray, truth:np.ndarray, k:int, text:str) -> Dict[str,float]:
+    fields=storage.encode(vectors)
+    encoded=b"".join(bson.encode(chunkDocument(position, text, field)) for position, field in enumerate(fields))
+    embedding_bytes=sum(len(bson.encode(field)) for field in fields)/len(fields)
+
+    # what building the local index from a collection costs, BSON decoding plus vector decoding
+    started=time.perf_counter()
+    documents=bson.decode_all(encoded)
+    decoded=[storage.decode(document) for document in documents]
+    decode_seconds=time.perf_counter()-started
+
+    matrix, inverse_norms=storage.pack(decoded)
+    index=CollectionIndex(0, matrix, np.array([document["id"] for document in documents]), [storage.strip(document) for document in documents], inverse_norms)
+    local=VectorIndexModel(storage=storage)
+    found:List[List[int]]=[]
+    started=time.perf_counter()
+    for query in queries:
+        found.append([int(result["content_hash"]) for result in local.search(index, query, k)])
+    search_seconds=time.perf_counter()-started
+
+    recall=np.mean([len(set(result)&set(expected))/k for result, expected in zip(found, truth)])
+    return {
+        "document_bytes":len(encoded)/len(fields),
+        "embedding_bytes":embedding_bytes,
+        "index_bytes":matrix.nbytes+inverse_norms.nbytes,
+        "decode_vectors_per_second":len(fields)/decode_seconds,
+        "query_ms":search_seconds/len(queries)*1000,
+        "recall":float(recall),
+    }
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversample", type=int, default=4)
+    parser.add_argument("--output", default="bench_quantized.json")
+    args=parser.parse_args()
+
+    vectors=clusteredEmbeddings(args.vectors+args.queries, args.dimension, args.clusters)
+    vectors, queries=vectors[:args.vectors], vectors[args.vectors:]
+    truth=np.argsort(-(queries@vectors.T), axis=1)[:, :args.k]
+    text=" ".join(WORDS[index%len(WORDS)] for index in range(100))[:500]
+    print(f"{args.vectors} vectors of {args.dimension} dimensions, {args.queries} queries, recall@{args.k} against exact float32 search")
+
+    # exact vectors by content hash, what the embedding cache gives main's storage
+    exact=lambda hashes: [vectors[int(hash)] for hash in hashes]
+    modes={"float32":VectorStorageModel("float32")}
+    for dtype in STORAGE_DTYPES[1:]:
+        modes[dtype]=VectorStorageModel(dtype)
+        modes[f"{dtype}+rescore"]=VectorStorageModel(dtype, oversample=args.oversample, exact=exact)
+
+    results={}
+    print(f"{'mode':<16}{'doc bytes':>11}{'vec bytes':>11}{'index MB':>10}{'decode/s':>11}{'query ms':>10}{'recall':>8}")
+    for name, storage in modes.items():
+        result=measure(storage, vectors, queries, truth, args.k, text)
+        results[name]=result
+        print(f"{name:<16}{result['document_bytes']:>11.0f}{result['embedding_bytes']:>11.0f}{result['index_bytes']/2**20:>10.1f}{result['decode_vectors_per_second']:>11.0f}{result['query_ms']:>10.2f}{result['recall']:>8.3f}")
+
+    baseline=results["float32"]
+    for name, result in results.items():
+        result["storage_reduction"]=baseline["embedding_bytes"]/result["embedding_bytes"]
+    with open(args.output,"w") as output:
+        json.dump({"config":vars(args),"results":results}, output, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__=="__main__":
+    main()
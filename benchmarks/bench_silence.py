@@ -0,0 +1,48 @@
+"""
+    numpy silence segmenter vs pydub detect_nonsilent on synthetic multi-hour audio, the
+    (start, end) ranges of both are compared one by one
+
+    python -m benchmarks.bench_silence --hours 2
+"""
+import argparse
+import time
+
+from pydub.silence import detect_nonsilent
+
+from audio_vectorize.Model__SilenceDetection_NumPy import SilenceDetectionModel
+from benchmarks.synthetic import speechLikeAudio
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=1.0)
+    parser.add_argument("--frame-rate", type=int, default=16000)
+    parser.add_argument("--skip-pydub", action="store_true", help="pydub takes minutes per hour of audio")
+    args=parser.parse_args()
+
+    audio=speechLikeAudio(args.hours*3600, frame_rate=args.frame_rate)
+    print(f"audio {len(audio)/3600000:.2f}h at {audio.frame_rate}Hz")
+
+    model=SilenceDetectionModel(audio.frame_rate, audio.channels, audio.sample_width)
+    started=time.perf_counter()
+    samples=model.samples(audio.raw_data)
+    ranges=model.detectNonsilent(samples, min_silence_len=1000, silence_thresh=model.dBFS(samples)-14)
+    numpy_seconds=time.perf_counter()-started
+    print(f"numpy  {numpy_seconds:8.2f}s  {len(ranges)} nonsilent ranges")
+
+    if args.skip_pydub:
+        return
+    started=time.perf_counter()
+    expected=detect_nonsilent(audio, min_silence_len=1000, silence_thresh=audio.dBFS-14)
+    pydub_seconds=time.perf_counter()-started
+    print(f"pydub  {pydub_seconds:8.2f}s  {len(expected)} nonsilent ranges")
+
+    mismatches=[(index, got, want) for index, (got, want) in enumerate(zip(ranges, expected)) if got!=want]
+    same=len(ranges)==len(expected) and not mismatches
+    print(f"speedup {pydub_seconds/numpy_seconds:.0f}x, same boundaries: {same}")
+    if not same:
+        print(f"{len(ranges)} vs {len(expected)} ranges, first differences (index, numpy, pydub): {mismatches[:5]}")
+
+
+if __name__=="__main__":
+    main()
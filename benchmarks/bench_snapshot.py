@@ -0,0 +1,115 @@
+"""
+    collection snapshot export and import throughput, archive size against the stored documents and
+    how closely imported vectors match the source, for every snapshot dtype. SQLite stands in for
+    Neon and mongomock for Atlas, so the write side is slower than against a real server
+
+    python -m benchmarks.bench_snapshot --chunks 50000 --dimension 768 --output snapshot.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict
+
+import bson
+import mongomock
+import numpy as np
+
+from audio_vectorize.Model__FileManagement_PostgressSQL import FileManagementModel
+from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel
+from audio_vectorize.Model__Snapshot_Archive import SnapshotModel
+from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import MongoDBAtlas, contentHash
+from audio_vectorize.Model__VectorStorage_Quantized import STORAGE_DTYPES, VectorStorageModel
+from benchmarks.bench_lexical import corpus
+from benchmarks.synthetic import HashEmbeddings, clusteredEmbeddings
+
+
+def directoryBytes(path:str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def vectorsByHash(vector_database:MongoDBAtlas, database:str, collection:str) -> Dict[str,np.ndarray]:
+    return {document["content_hash"]:vector_database.storage.decode(document) for document in vector_database.client[database][collection].find({})}
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--chunks-per-file", type=int, default=200)
+    parser.add_argument("--words-per-chunk", type=int, default=90)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--storage", default="float32", choices=STORAGE_DTYPES, help="vector storage mode of both collections")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--shard-rows", type=int, default=5000)
+    parser.add_argument("--lexical", action="store_true", help="keep the BM25 index up to date while importing")
+    parser.add_argument("--reembed", action="store_true", help="also time a re-embedding import with hashed embeddings")
+    parser.add_argument("--output", default="bench_snapshot.json")
+    args=parser.parse_args()
+
+    workdir=tempfile.mkdtemp(prefix="bench-snapshot-")
+    files_database=FileManagementModel(f"sqlite:///{os.path.join(workdir,'files.sqlite3')}")
+    files_database.createTable()
+    lexical=LexicalIndexModel(os.path.join(workdir,"lexical.sqlite3")) if args.lexical else None
+    vector_database=MongoDBAtlas(None, client=mongomock.MongoClient(), storage=VectorStorageModel(args.storage), lexical=lexical)
+    embeddings=HashEmbeddings(args.dimension)
+    embeddings.model_name="bench"
+    snapshots=SnapshotModel(files_database, vector_database, embeddings, workers=args.workers, shard_rows=args.shard_rows)
+
+    database=files_database.createDatabase("bench@example.com", f"bench-{int(time.time())}")
+    source=files_database.createCollection(f"source-{database.id}", str(database.id))
+    files=args.chunks//args.chunks_per_file
+    now=datetime.now()
+    rows=[{"id":f"{index:08d}-0000-0000-0000-000000000000","name":f"book-{index}.mp3","size":50_000_000,"type":"audio/mpeg","format":"mp3","created_at":now,"updated_at":now,"content_hash":f"{index:064x}"} for index in range(files)]
+    files_database.importFiles(rows, str(source.id))
+    documents=[{"text":document["text"],"id":rows[index//args.chunks_per_file]["id"],"content_hash":contentHash(document["text"]),"start_char":0,"end_char":len(document["text"])} for index, document in enumerate(corpus(files*args.chunks_per_file, args.words_per_chunk, 20000))]
+    vector_database.Import_Chunks(documents, clusteredEmbeddings(len(documents), args.dimension), database.name, source.name)
+    files_database.setFilesStatus([row["id"] for row in rows], "complete")
+    stored_bytes=sum(len(bson.encode(document)) for document in vector_database.client[database.name][source.name].find({}))
+    expected=vectorsByHash(vector_database, database.name, source.name)
+    print(f"{len(documents)} chunks of {args.dimension} dimensions in {files} files, {stored_bytes/2**20:.1f} MB of {args.storage} documents")
+
+    results={}
+    runs=[(dtype, False) for dtype in STORAGE_DTYPES]+([("float32", True)] if args.reembed else [])
+    print(f"{'snapshot':<18}{'archive MB':>11}{'vs docs':>9}{'export/s':>10}{'import/s':>10}{'max error':>11}")
+    for dtype, reembed in runs:
+        name=f"{dtype}{'+reembed' if reembed else ''}"
+        path=os.path.join(workdir, name)
+        started=time.perf_counter()
+        manifest=snapshots.export(database.name, source.name, str(source.id), path, dtype)
+        export_seconds=time.perf_counter()-started
+
+        target=files_database.createCollection(f"{name}-{database.id}", str(database.id))
+        started=time.perf_counter()
+        restored=snapshots.restore(path, database.name, target.name, str(target.id), reembed)
+        import_seconds=time.perf_counter()-started
+
+        error=None
+        if not reembed:
+            imported=vectorsByHash(vector_database, database.name, target.name)
+            error=max(float(np.abs(imported[key]-vector).max()) for key, vector in expected.items())
+        archive_bytes=directoryBytes(path)
+        results[name]={
+            "archive_bytes":archive_bytes,
+            "archive_ratio":archive_bytes/stored_bytes,
+            "export_seconds":export_seconds,
+            "export_chunks_per_second":manifest["chunks"]/export_seconds,
+            "import_seconds":import_seconds,
+            "import_chunks_per_second":restored["chunks"]/import_seconds,
+            "files":restored["files"],
+            "chunks":restored["chunks"],
+            "max_abs_error":error,
+        }
+        result=results[name]
+        print(f"{name:<18}{archive_bytes/2**20:>11.1f}{result['archive_ratio']:>9.2f}{result['export_chunks_per_second']:>10.0f}{result['import_chunks_per_second']:>10.0f}{error if error is not None else float('nan'):>11.4f}")
+
+    if lexical:
+        lexical.close()
+    with open(args.output,"w") as output:
+        json.dump({"config":vars(args),"stored_bytes":stored_bytes,"results":results}, output, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__=="__main__":
+    main()
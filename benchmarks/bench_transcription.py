@@ -0,0 +1,56 @@
+"""
+    chunk transcription throughput vs pool size, using a fixed latency recognizer
+
+    python -m benchmarks.bench_transcription --seconds 600 --latency 0.2 --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import time
+
+from audio_vectorize.Model__Speech_Recognition import SpeechRecognitionModel
+from benchmarks.synthetic import speechLikeAudio, wavBytes, FakeUpload, FixedLatencyRecognizer
+
+
+async def measure(model:SpeechRecognitionModel, data:bytes):
+    """
+        returns (seconds, worst event loop lag) for one audioToText call
+    """
+    lag=0.0
+    done=asyncio.Event()
+
+    async def heartbeat():
+        nonlocal lag
+        while not done.is_set():
+            started=time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag=max(lag, time.perf_counter()-started-0.01)
+
+    beat=asyncio.create_task(heartbeat())
+    started=time.perf_counter()
+    await model.audioToText(FakeUpload(data))
+    elapsed=time.perf_counter()-started
+    done.set()
+    await beat
+    return elapsed, lag
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--executor", default="thread", choices=["thread","process"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1,2,4,8])
+    args=parser.parse_args()
+
+    audio=speechLikeAudio(args.seconds)
+    data=wavBytes(audio)
+    print(f"audio {len(audio)/1000:.0f}s, recognizer latency {args.latency}s, {args.executor} pool")
+    for workers in args.workers:
+        model=SpeechRecognitionModel(recognizer=FixedLatencyRecognizer(args.latency), max_workers=workers, executor=args.executor)
+        elapsed, lag=asyncio.run(measure(model, data))
+        model.close()
+        print(f"workers={workers:<3} {elapsed:7.2f}s  {len(audio)/1000/elapsed:7.1f}x realtime  max loop lag {lag*1000:.0f}ms")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+    synthetic speech-like audio and upload stand-ins shared by the benchmarks
+"""
+import hashlib
+import io
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from pydub import AudioSegment
+from pydub.generators import Sine, WhiteNoise
+
+
+def speechLikeAudio(seconds:float, speech_ms:int=4000, silence_ms:int=1500, frame_rate:int=16000) -> AudioSegment:
+    """
+        alternates tone+noise "speech" bursts with quiet gaps so split_on_silence finds a chunk per burst
+    """
+    burst=Sine(220, sample_rate=frame_rate).to_audio_segment(duration=speech_ms, volume=-12).overlay(
+        WhiteNoise(sample_rate=frame_rate).to_audio_segment(duration=speech_ms, volume=-30))
+    gap=WhiteNoise(sample_rate=frame_rate).to_audio_segment(duration=silence_ms, volume=-70)
+    pattern=(burst+gap).set_channels(1).set_sample_width(2).set_frame_rate(frame_rate)
+
+    repeats=max(1, int(seconds*1000//len(pattern)))
+    return pattern*repeats
+
+
+def wavBytes(audio:AudioSegment) -> bytes:
+    buffer=io.BytesIO()
+    audio.export(buffer, format="wav")
+    return buffer.getvalue()
+
+
+class FakeUpload():
+    """
+        enough of fastapi.UploadFile for audioToText
+    """
+    def __init__(self, data:bytes, filename:str="synthetic.wav", content_type:str="audio/wav"):
+        self.file=io.BytesIO(data)
+        self.filename=filename
+        self.content_type=content_type
+        self.size=len(data)
+
+    async def read(self, size:int=-1) -> bytes:
+        return self.file.read(size)
+
+    async def seek(self, offset:int):
+        self.file.seek(offset)
+
+
+WORDS="the a of and to in is was he she it that for on as with his her they at by this had from".split()
+
+
+class FixedLatencyRecognizer():
+    """
+        offline recognizer stub, sleeps like a network call and returns a deterministic transcript,
+        words_per_second > 0 pads it with words in proportion to the audio length
+    """
+    def __init__(self, latency:float=0.2, words_per_second:float=0):
+        self.latency=latency
+        self.words_per_second=words_per_second
+
+    def recognize(self, audio) -> str:
+        time.sleep(self.latency)
+        text=f"chunk of {len(audio.frame_data)} bytes"
+        if self.words_per_second:
+            seconds=len(audio.frame_data)/(audio.sample_rate*audio.sample_width)
+            seed=int.from_bytes(hashlib.blake2b(audio.frame_data[:4096], digest_size=4).digest(), "little")
+            text+=" "+" ".join(WORDS[(seed+index*7)%len(WORDS)] for index in range(int(seconds*self.words_per_second)))
+        return text
+
+
+class HashEmbeddings(Embeddings):
+    """
+        local embedding stub, hashed bag of words so equal texts get equal vectors and similar
+        texts land close, no model download
+    """
+    def __init__(self, dimension:int=384):
+        self.dimension=dimension
+        self.model_name=f"hash-{dimension}"
+
+    def embed_query(self, text:str) -> List[float]:
+        vector=np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            index=int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little")
+            vector[index%self.dimension]+=1.0
+        norm=np.linalg.norm(vector)
+        return (vector/norm if norm else vector).tolist()
+
+    def embed_documents(self, texts:List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+def clusteredEmbeddings(count:int, dimension:int=768, clusters:int=64, spread:float=0.6, seed:int=0) -> np.ndarray:
+    """
+        unit vectors drawn around random topic centers, neighbours are close but not trivially so,
+        a stand-in for sentence embeddings of a library of books
+    """
+    generator=np.random.default_rng(seed)
+    centers=generator.standard_normal((clusters, dimension)).astype(np.float32)
+    centers/=np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors=centers[generator.integers(0, clusters, count)]+spread*generator.standard_normal((count, dimension)).astype(np.float32)/np.sqrt(dimension)
+    return vectors/np.linalg.norm(vectors, axis=1, keepdims=True)
@@ -0,0 +1,168 @@
+import io
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+from audio_vectorize.Model__AudioProbe_Headers import ASF_AUDIO_MEDIA, ASF_FILE_PROPERTIES, ASF_HEADER, ASF_STREAM_PROPERTIES, AudioProbeModel, UnsupportedAudio
+
+
+def probe(data:bytes):
+    return AudioProbeModel().probe(io.BytesIO(data))
+
+
+def chunk(chunk_id:bytes, data:bytes, endian:str="<") -> bytes:
+    return struct.pack(endian+"4sI", chunk_id, len(data))+data+b"\x00"*(len(data)&1)
+
+
+def box(box_type:bytes, *payload:bytes) -> bytes:
+    data=b"".join(payload)
+    return struct.pack(">I4s", 8+len(data), box_type)+data
+
+
+def extended(value:int) -> bytes:
+    exponent=value.bit_length()-1
+    return struct.pack(">HQ", 16383+exponent, value<<(63-exponent))
+
+
+def oggPage(granule:int, packet:bytes) -> bytes:
+    return b"OggS"+struct.pack("<BBqIIIB", 0, 0, granule, 1, 0, 0, 1)+bytes([len(packet)])+packet
+
+
+def mp3Frames(count:int, xing_frames:int=None) -> bytes:
+    # mpeg 1 layer 3, 128 kbps, 44.1 kHz, stereo, 417 bytes per frame
+    frame=bytearray(b"\xff\xfb\x90\x00"+b"\x00"*413)
+    frames=[bytes(frame)]*count
+    if xing_frames is not None:
+        frame[36:48]=b"Xing"+struct.pack(">II", 1, xing_frames)
+        frames[0]=bytes(frame)
+    return b"".join(frames)
+
+
+def adtsFrames(count:int, frame_length:int=371) -> bytes:
+    # mpeg 4 aac lc, 44.1 kHz, stereo
+    header=bytes([0xFF, 0xF1, 0x50, 0x80|(frame_length>>11), (frame_length>>3)&0xFF, ((frame_length&7)<<5)|0x1F, 0xFC])
+    return (header+b"\x00"*(frame_length-7))*count
+
+
+def test_wav():
+    buffer=io.BytesIO()
+    with wave.open(buffer, "wb") as output:
+        output.setnchannels(2)
+        output.setsampwidth(2)
+        output.setframerate(22050)
+        output.writeframes(np.zeros(2*22050*3, dtype=np.int16).tobytes())
+
+    info=probe(buffer.getvalue())
+
+    assert (info.format, info.codec, info.sample_rate, info.channels, info.sample_width, info.duration_ms)==("WAV", "pcm_s16le", 22050, 2, 2, 3000)
+    assert (info.data_offset, info.data_size)==(44, 2*2*22050*3)
+
+
+def test_wav_with_unknown_data_size_runs_to_the_end():
+    header=chunk(b"fmt ", struct.pack("<HHIIHH", 1, 1, 16000, 32000, 2, 16))+struct.pack("<4sI", b"data", 0xFFFFFFFF)
+    data=header+b"\x00"*32000
+
+    info=probe(b"RIFF"+struct.pack("<I", 0xFFFFFFFF)+b"WAVE"+data)
+
+    assert (info.sample_rate, info.duration_ms, info.data_size)==(16000, 1000, 32000)
+
+
+def test_aiff():
+    comm=struct.pack(">hIh", 1, 48000*5, 16)+extended(48000)
+    data=b"AIFF"+chunk(b"COMM", comm, ">")+chunk(b"SSND", b"\x00"*64, ">")
+
+    info=probe(b"FORM"+struct.pack(">I", len(data))+data)
+
+    assert (info.format, info.codec, info.sample_rate, info.channels, info.duration_ms)==("AIFF", "pcm_s16be", 48000, 1, 5000)
+
+
+def test_flac():
+    streaminfo=int(44100<<44|(2-1)<<41|(16-1)<<36|44100*7).to_bytes(8, "big")
+    block=struct.pack(">HH", 4096, 4096)+b"\x00"*6+streaminfo+b"\x00"*16
+
+    info=probe(b"fLaC"+bytes([0x80])+len(block).to_bytes(3, "big")+block)
+
+    assert (info.format, info.sample_rate, info.channels, info.sample_width, info.duration_ms)==("FLAC", 44100, 2, 2, 7000)
+
+
+def test_ogg_vorbis():
+    identification=b"\x01vorbis"+struct.pack("<IBI", 0, 2, 44100)+b"\x00"*16
+
+    info=probe(oggPage(0, identification)+oggPage(0, b"\x00"*200)+oggPage(44100*4, b"\x00"*200))
+
+    assert (info.format, info.codec, info.sample_rate, info.channels, info.duration_ms)==("OGG", "vorbis", 44100, 2, 4000)
+
+
+def test_ogg_opus_counts_48khz_granules_after_the_pre_skip():
+    head=b"OpusHead"+struct.pack("<BBHIhB", 1, 1, 312, 16000, 0, 0)
+
+    info=probe(oggPage(0, head)+oggPage(312+48000*2, b"\x00"*100))
+
+    assert (info.codec, info.sample_rate, info.channels, info.duration_ms)==("opus", 16000, 1, 2000)
+
+
+def test_mp4_aac():
+    mdhd=box(b"mdhd", b"\x00"*12, struct.pack(">II", 1000, 6500), b"\x00"*4)
+    hdlr=box(b"hdlr", b"\x00"*8, b"soun", b"\x00"*12)
+    entry=box(b"mp4a", b"\x00"*6, struct.pack(">H", 1), b"\x00"*8, struct.pack(">HHHHI", 2, 16, 0, 0, 44100<<16))
+    stsd=box(b"stsd", b"\x00"*4, struct.pack(">I", 1), entry)
+    trak=box(b"trak", box(b"mdia", mdhd, hdlr, box(b"minf", box(b"stbl", stsd))))
+
+    info=probe(box(b"ftyp", b"M4A ", b"\x00"*4)+box(b"moov", trak)+box(b"mdat", b"\x00"*64))
+
+    assert (info.format, info.codec, info.sample_rate, info.channels, info.duration_ms)==("AAC", "aac", 44100, 2, 6500)
+
+
+def test_mp4_without_audio_track():
+    with pytest.raises(UnsupportedAudio, match="moov"):
+        probe(box(b"ftyp", b"isom", b"\x00"*4)+box(b"mdat", b"\x00"*64))
+
+
+def test_asf():
+    file_properties=b"\x00"*40+struct.pack("<QQQ", (8000+3000)*10000, 0, 3000)+b"\x00"*16
+    stream_properties=ASF_AUDIO_MEDIA+b"\x00"*38+struct.pack("<HHIIHH", 0x161, 2, 32000, 4000, 1, 16)
+    objects=[ASF_FILE_PROPERTIES+struct.pack("<Q", 24+len(file_properties))+file_properties, ASF_STREAM_PROPERTIES+struct.pack("<Q", 24+len(stream_properties))+stream_properties]
+    header=b"".join(objects)
+
+    info=probe(ASF_HEADER+struct.pack("<QIBB", 30+len(header), len(objects), 1, 2)+header+b"\x00"*64)
+
+    assert (info.format, info.sample_rate, info.channels, info.sample_width, info.duration_ms)==("WMA", 32000, 2, 2, 8000)
+
+
+def test_mp3_duration_from_bitrate():
+    data=mp3Frames(50)
+
+    info=probe(data)
+
+    assert (info.format, info.codec, info.sample_rate, info.channels)==("MP3", "mp3", 44100, 2)
+    assert info.duration_ms==len(data)*8*1000//128000
+
+
+def test_mp3_duration_from_xing_header_after_id3_tag():
+    tag=b"ID3\x04\x00\x00"+bytes([0, 0, 1, 0])+b"\x00"*128
+
+    info=probe(tag+mp3Frames(50, xing_frames=1000))
+
+    assert (info.format, info.sample_rate)==("MP3", 44100)
+    assert info.duration_ms==1000*1152*1000//44100
+
+
+def test_short_mp3_ending_in_an_id3v1_tag():
+    info=probe(mp3Frames(2)+b"TAG"+b"\x00"*125)
+
+    assert (info.format, info.sample_rate)==("MP3", 44100)
+
+
+def test_adts():
+    info=probe(adtsFrames(100))
+
+    assert (info.format, info.codec, info.sample_rate, info.channels)==("AAC", "aac", 44100, 2)
+    assert info.duration_ms==100*1024*1000//44100
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_bytes_are_unsupported(seed):
+    with pytest.raises(UnsupportedAudio):
+        probe(np.random.default_rng(seed).bytes(64*1024))
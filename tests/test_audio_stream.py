@@ -0,0 +1,117 @@
+import io
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from pydub.silence import split_on_silence
+
+from audio_vectorize.Model__AudioStream_FFmpeg import AudioStreamModel
+
+
+FRAME_RATE=16000
+
+
+def speech(seed=3, seconds=90) -> np.ndarray:
+    """
+        noise bursts of random length and loudness between quiet gaps, quiet at the start and
+        loud at the end so the loudness of the first windows is far from the whole file's
+    """
+    rng=np.random.default_rng(seed)
+    parts=[]
+    total=0
+    while total<seconds*FRAME_RATE:
+        burst=int(rng.uniform(0.3, 8)*FRAME_RATE)
+        gap=int(rng.uniform(0.2, 2.5)*FRAME_RATE)
+        loudness=300 if total<seconds*FRAME_RATE/3 else rng.uniform(2000, 12000)
+        parts.append(rng.normal(0, loudness, burst))
+        parts.append(rng.normal(0, 5, gap))
+        total+=burst+gap
+    return np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+
+
+def wavFile(samples:np.ndarray, frame_rate:int=FRAME_RATE, channels:int=1) -> io.BytesIO:
+    buffer=io.BytesIO()
+    with wave.open(buffer, "wb") as output:
+        output.setnchannels(channels)
+        output.setsampwidth(2)
+        output.setframerate(frame_rate)
+        output.writeframes(samples.tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+def pydubChunks(pcm:bytes, model:AudioStreamModel):
+    audio=AudioSegment(pcm, frame_rate=model.sample_rate, sample_width=2, channels=model.channels)
+    return [chunk.raw_data for chunk in split_on_silence(audio, min_silence_len=model.min_silence_len, silence_thresh=audio.dBFS+model.silence_offset, keep_silence=model.keep_silence)]
+
+
+def test_chunks_match_pydub_across_windows():
+    samples=speech()
+    model=AudioStreamModel(window_ms=7000, max_chunk_ms=10**9)
+
+    chunks=list(model.chunks(wavFile(samples)))
+
+    expected=pydubChunks(samples.tobytes(), model)
+    assert len(expected)>5
+    assert [chunk.data for chunk in chunks]==expected
+    assert [chunk.index for chunk in chunks]==list(range(len(chunks)))
+    assert all(len(chunk.data)==(chunk.end_ms-chunk.start_ms)*model.bytes_per_ms for chunk in chunks)
+
+
+def test_running_threshold_differs_without_whole_file_loudness():
+    samples=speech()
+    model=AudioStreamModel(window_ms=7000, max_chunk_ms=10**9)
+
+    running=[chunk.data for chunk in model.split(model.decode(wavFile(samples)))]
+
+    assert running!=pydubChunks(samples.tobytes(), model)
+
+
+def test_resumed_chunks_continue_the_full_run():
+    samples=speech(seed=5)
+    model=AudioStreamModel(window_ms=7000, max_chunk_ms=10**9)
+    chunks=list(model.chunks(wavFile(samples)))
+    done=len(chunks)//2
+
+    resumed=list(model.chunks(wavFile(samples), chunks[done-1].end_ms, done))
+
+    assert [(chunk.index, chunk.start_ms, chunk.end_ms) for chunk in resumed]==[(chunk.index, chunk.start_ms, chunk.end_ms) for chunk in chunks[done:]]
+
+
+def test_native_wav_is_read_without_decoding():
+    samples=speech(seconds=20)
+    source=wavFile(samples)
+    model=AudioStreamModel(window_ms=3000)
+
+    assert model.isNativePCM(model.probe.probe(source))
+    windows=list(model.decode(source))
+    assert all(len(window)==3000*model.bytes_per_ms for window in windows[:-1])
+    assert b"".join(windows)==samples.tobytes()
+    assert b"".join(model.decode(source, start_ms=1500))==samples[1500*16:].tobytes()
+
+
+def test_forced_cuts_bound_chunk_length():
+    samples=np.random.default_rng(1).normal(0, 8000, 25*FRAME_RATE).astype(np.int16)
+    model=AudioStreamModel(window_ms=4000, max_chunk_ms=6000)
+
+    chunks=list(model.chunks(wavFile(samples)))
+
+    assert max(chunk.end_ms-chunk.start_ms for chunk in chunks)<=6000
+    assert b"".join(chunk.data for chunk in chunks)==samples.tobytes()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_ffmpeg_decode_resamples_and_matches_pydub():
+    mono=speech(seconds=40)
+    stereo=np.repeat(mono, 2)
+    source=wavFile(stereo, frame_rate=8000, channels=2)
+    model=AudioStreamModel(window_ms=5000, max_chunk_ms=10**9)
+
+    assert not model.isNativePCM(model.probe.probe(source))
+    pcm=b"".join(model.decode(source))
+    expected=subprocess.run(["ffmpeg", "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", "16000", "pipe:1"], input=source.getvalue(), capture_output=True, check=True).stdout
+    assert pcm==expected
+    assert [chunk.data for chunk in model.chunks(source)]==pydubChunks(pcm, model)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+from audio_vectorize.Model__Cache_LRU import LRUCacheModel
+from audio_vectorize.Model__FileManagement_PostgressSQL import FileManagementModel
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now=[1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def files_database(tmp_path):
+    files_database=FileManagementModel(f"sqlite:///{tmp_path/'files.sqlite3'}", cache=LRUCacheModel(ttl_seconds=300))
+    files_database.createTable()
+    yield files_database
+    asyncio.run(files_database.close())
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache=LRUCacheModel(max_entries=3)
+    for key in "abc":
+        cache.put(key, key.upper())
+
+    assert cache.get("a")=="A"
+    cache.put("d", "D")
+
+    assert [cache.get(key) for key in "abcd"]==["A", None, "C", "D"]
+    assert cache.stats()=={"hits":4, "misses":1, "hit_rate":0.8, "evictions":1, "entries":3, "max_entries":3}
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache=LRUCacheModel(ttl_seconds=10)
+    cache.put("key", "value")
+
+    clock[0]+=9.9
+    assert cache.get("key")=="value"
+    clock[0]+=0.2
+    assert cache.get("key", "expired")=="expired"
+    assert cache.stats()["entries"]==0
+
+
+def test_get_or_load_loads_once_per_ttl(clock):
+    cache=LRUCacheModel(ttl_seconds=10)
+    loads=[]
+
+    def load():
+        loads.append(1)
+        return len(loads)
+
+    assert [cache.getOrLoad("key", load) for _ in range(3)]==[1, 1, 1]
+    clock[0]+=11
+    assert cache.getOrLoad("key", load)==2
+    # falsy values are cached too
+    assert [cache.getOrLoad("empty", lambda: None) for _ in range(2)]==[None, None]
+    assert cache.stats()["hits"]==3
+
+
+def test_invalidate_drops_matching_keys():
+    cache=LRUCacheModel()
+    for key in [("database", "1"), ("database", "2"), ("collection", "1")]:
+        cache.put(key, "row")
+
+    cache.invalidate(lambda key: key[0]=="database" and key[1]=="1")
+    assert [cache.get(key) for key in [("database", "1"), ("database", "2"), ("collection", "1")]]==[None, "row", "row"]
+
+    cache.invalidate()
+    assert cache.stats()["entries"]==0
+
+
+def test_metadata_lookups_read_through_the_cache(files_database):
+    database=files_database.createDatabase("user@example.com", "books")
+    collection=files_database.createCollection("novels", str(database.id))
+
+    for _ in range(3):
+        assert files_database.getDatabase(str(database.id)).name=="books"
+        assert files_database.getCollection(str(collection.id)).name=="novels"
+        found=asyncio.run(files_database.getDatabaseAndCollectionAsync(str(database.id), str(collection.id)))
+        assert (found[0].name, found[1].name)==("books", "novels")
+
+    stats=files_database.cacheStats()
+    assert (stats["misses"], stats["hits"])==(3, 6)
+
+
+def test_writes_invalidate_cached_lookups(files_database):
+    database=files_database.createDatabase("user@example.com", "books")
+    collection=files_database.createCollection("novels", str(database.id))
+    page, _=files_database.getDatabaseAndCollections("user@example.com")
+    assert [item["Collection"]["name"] for item in page]==["novels"]
+    asyncio.run(files_database.getDatabaseAndCollectionAsync(str(database.id), str(collection.id)))
+
+    files_database.createCollection("poems", str(database.id))
+    page, _=files_database.getDatabaseAndCollections("user@example.com")
+    assert sorted(item["Collection"]["name"] for item in page)==["novels", "poems"]
+
+    files_database.deleteCollection(str(collection.id))
+    with pytest.raises(Exception):
+        asyncio.run(files_database.getDatabaseAndCollectionAsync(str(database.id), str(collection.id)))
+    page, _=files_database.getDatabaseAndCollections("user@example.com")
+    assert [item["Collection"]["name"] for item in page]==["poems"]
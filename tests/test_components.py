@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+from audio_vectorize.Model__Components_Lazy import ComponentRegistryModel
+
+
+def test_load_async_builds_off_the_event_loop():
+    components=ComponentRegistryModel()
+    threads=[]
+    components.register("database", lambda: threads.append(threading.current_thread()) or object())
+
+    async def load():
+        await components.loadAsync(["database"])
+        return threading.current_thread()
+
+    loop_thread=asyncio.run(load())
+
+    assert components.ready(["database"])
+    assert threads and threads[0] is not loop_thread
+    asyncio.run(components.loadAsync(["database"]))
+    assert len(threads)==1
+
+
+def test_load_async_raises_and_retries_failed_builds():
+    components=ComponentRegistryModel()
+    attempts=[]
+
+    def factory():
+        attempts.append(1)
+        if len(attempts)==1:
+            raise ConnectionError("database unreachable")
+        return object()
+    components.register("database", factory)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(components.loadAsync(["database"]))
+    assert components.status()["database"]=={"state":"failed","error":"database unreachable"}
+
+    asyncio.run(components.loadAsync(["database"]))
+    assert components.ready(["database"])
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from audio_vectorize.Model__Deletion_Tombstones import DeletionModel
+from audio_vectorize.Model__FileManagement_PostgressSQL import FileManagementModel
+from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import MongoDBAtlas
+
+
+class FlakyVectorDatabase():
+    """
+        vector database whose calls fail while failures is above zero
+    """
+    def __init__(self, vector_database, failures=0):
+        self.vector_database=vector_database
+        self.failures=failures
+        self.calls=[]
+
+    def __getattr__(self, name):
+        method=getattr(self.vector_database, name)
+
+        def call(*args):
+            self.calls.append(name)
+            if self.failures:
+                self.failures-=1
+                raise ConnectionError("vector store unreachable")
+            return method(*args)
+        return call
+
+
+class RecordingIndex():
+    def __init__(self):
+        self.dropped=[]
+
+    def drop(self, database, collection=None):
+        self.dropped.append((database, collection))
+
+
+@pytest.fixture
+def files_database(tmp_path):
+    files_database=FileManagementModel(f"sqlite:///{tmp_path/'files.sqlite3'}")
+    files_database.createTable()
+    yield files_database
+    asyncio.run(files_database.close())
+
+
+@pytest.fixture
+def collection(files_database):
+    database=files_database.createDatabase("user@example.com", "books")
+    return files_database.createCollection("novels", str(database.id))
+
+
+@pytest.fixture
+def files(files_database, collection):
+    return files_database.addFiles([SimpleNamespace(filename=f"{index}.mp3", size=1, content_type="audio/mpeg") for index in range(3)], str(collection.id))
+
+
+@pytest.fixture
+def vector_database(files):
+    vector_database=MongoDBAtlas(None, client=mongomock.MongoClient())
+    vector_database.client["books"]["novels"].insert_many([{"id":str(file.id), "text":f"chunk {index}"} for file in files for index in range(4)])
+    return vector_database
+
+
+def chunks(vector_database, collection="novels"):
+    return sorted(document["id"] for document in vector_database.client["books"][collection].find({}))
+
+
+def test_file_delete_removes_rows_and_their_chunks(files_database, collection, files, vector_database):
+    deletions=DeletionModel(files_database, vector_database)
+
+    deletion=files_database.deleteFiles([str(files[0].id), str(files[1].id)])
+
+    assert [file.id for file in files_database.getFiles(str(collection.id))]==[files[2].id]
+    target,=json.loads(deletion.targets)
+    assert (target["database"], target["collection"], sorted(target["file_ids"]))==("books", "novels", sorted([str(files[0].id), str(files[1].id)]))
+    assert deletions.apply(deletion)
+    assert chunks(vector_database)==[str(files[2].id)]*4
+    assert files_database.getDeletions()==[]
+
+
+def test_failed_vector_delete_keeps_the_tombstone_until_a_retry_succeeds(files_database, files, vector_database):
+    flaky=FlakyVectorDatabase(vector_database, failures=2)
+    deletions=DeletionModel(files_database, flaky)
+    deletion=files_database.deleteFiles([str(files[0].id)])
+
+    assert not deletions.apply(deletion)
+    assert deletions.retry()==0
+
+    pending,=files_database.getDeletions()
+    assert (pending.id, pending.attempts, pending.last_error)==(deletion.id, 2, "vector store unreachable")
+    assert str(files[0].id) in chunks(vector_database)
+    assert deletions.retry()==1
+    assert str(files[0].id) not in chunks(vector_database)
+    assert files_database.getDeletions()==[]
+    assert deletions.retry()==0
+    assert flaky.calls==["Delete_Files"]*3
+
+
+def test_collection_and_database_deletes_drop_the_vector_store_side(files_database, collection, files, vector_database):
+    local_index=RecordingIndex()
+    deletions=DeletionModel(files_database, vector_database, local_index=local_index)
+    other=files_database.createCollection("poems", str(collection.database_id))
+    vector_database.client["books"]["poems"].insert_one({"id":"poem", "text":"chunk"})
+
+    assert deletions.apply(files_database.deleteCollection(str(collection.id)))
+    assert chunks(vector_database)==[]
+    assert chunks(vector_database, "poems")==["poem"]
+    assert files_database.getFiles(str(collection.id))==[]
+
+    assert deletions.apply(files_database.deleteDatabase(str(collection.database_id)))
+    assert "books" not in vector_database.client.list_database_names()
+    assert local_index.dropped==[("books", "novels"), ("books", None)]
+    assert files_database.getDeletions()==[]
+    assert files_database.deleteCollection(str(other.id)) is None
+
+
+def test_a_tombstone_is_applied_by_one_caller_at_a_time(files_database, files, vector_database):
+    deletions=DeletionModel(files_database, vector_database)
+    deletion=files_database.deleteFiles([str(files[0].id)])
+    deletions.running.add(str(deletion.id))
+
+    assert not deletions.apply(deletion)
+    assert files_database.getDeletions()[0].attempts==0
+    assert str(files[0].id) in chunks(vector_database)
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+from audio_vectorize.Model__EmbeddingServer_Socket import EmbeddingServerModel, RemoteEmbeddingsModel
+from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import textChunker
+
+
+class WordModel():
+    """
+        embeds a text as its word and character counts, a token is a word
+    """
+    model_name="words"
+
+    def __init__(self):
+        self.busy=threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.busy:
+            time.sleep(0.01)
+            return [[float(len(text.split())), float(len(text))] for text in texts]
+
+    def countTokens(self, texts):
+        # a fast tokenizer used while a batch is embedding raises like this, the server lock prevents it
+        if not self.busy.acquire(blocking=False):
+            raise Exception("Already borrowed")
+        try:
+            return [len(text.split()) for text in texts]
+        finally:
+            self.busy.release()
+
+
+class NoCounterModel():
+    model_name="characters"
+
+    def embed_documents(self, texts):
+        return [[float(len(text))] for text in texts]
+
+
+def serve(model):
+    # unix socket paths are limited to about 100 characters, pytest's tmp_path can be longer
+    directory=tempfile.mkdtemp(prefix="embed")
+    server=EmbeddingServerModel(model, os.path.join(directory, "server.sock"), b"secret", max_wait=0.001)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    deadline=time.monotonic()+5
+    while server.listener is None and time.monotonic()<deadline:
+        time.sleep(0.01)
+    return server, directory
+
+
+@pytest.fixture
+def remote():
+    server, directory=serve(WordModel())
+    yield RemoteEmbeddingsModel(server.address, b"secret")
+    server.stop()
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_token_counts_come_from_the_served_model(remote):
+    assert remote.countTokens(["one two three", "four", ""])==[3, 1, 0]
+    assert remote.countTokens([])==[]
+    assert remote.model_name=="words"
+
+
+def test_token_counts_and_embeddings_from_many_threads(remote):
+    texts=[" ".join(["word"]*count) for count in range(1, 40)]
+    results=[]
+
+    def work(index):
+        if index%2:
+            results.append(("tokens", remote.countTokens(texts)))
+        else:
+            results.append(("vectors", [vector[0] for vector in remote.embed_documents(texts)]))
+    threads=[threading.Thread(target=work, args=(index,)) for index in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results)==16
+    assert all(values==list(range(1, 40)) for _, values in results)
+
+
+def test_token_chunker_measures_with_the_served_tokenizer(remote):
+    text=" ".join(f"w{index}" for index in range(100))
+
+    chunks=list(textChunker(10, 0, "tokens", remote).chunks(text))
+
+    assert all(len(chunk.text.split())<=10 for chunk in chunks)
+    assert " ".join(chunk.text for chunk in chunks)==text
+
+
+def test_models_without_a_tokenizer_count_characters():
+    server, directory=serve(NoCounterModel())
+    try:
+        assert RemoteEmbeddingsModel(server.address, b"secret").countTokens(["x"*40, "y"])==[10, 1]
+    finally:
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
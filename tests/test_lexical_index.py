@@ -0,0 +1,173 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from audio_vectorize.Model__LexicalIndex_BM25 import LexicalIndexModel, decodeBlobs, decodePostings, decodeVarints, encodeBlobs, encodePostings, encodeVarints, reciprocalRankFusion, tokenize
+
+
+WORDS=["quick", "brown", "fox", "jumps", "over", "lazy", "dog", "audio", "vector", "search", "the", "a"]
+
+
+def leb128(value:int) -> bytes:
+    encoded=bytearray()
+    while True:
+        byte=value&0x7f
+        value>>=7
+        encoded.append(byte|(0x80 if value else 0))
+        if not value:
+            return bytes(encoded)
+
+
+def documents(rng:random.Random, count:int, start:int=0, files:int=3):
+    return [{"_id":f"chunk-{start+index}", "id":f"file-{(start+index)%files}", "text":" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 30)))} for index in range(count)]
+
+
+def bm25(documents, query:str, k1:float=1.2, b:float=0.75):
+    tokenized={document["_id"]:tokenize(document["text"]) for document in documents}
+    lengths={id:max(1, len(tokens)) for id, tokens in tokenized.items()}
+    average=sum(lengths.values())/len(lengths)
+    scores={}
+    for term in dict.fromkeys(tokenize(query)):
+        containing=[id for id, tokens in tokenized.items() if term in tokens]
+        idf=math.log(1+(len(tokenized)-len(containing)+0.5)/(len(containing)+0.5))
+        for id in containing:
+            tf=tokenized[id].count(term)
+            scores[id]=scores.get(id, 0.0)+idf*tf*(k1+1)/(tf+k1*(1-b+b*lengths[id]/average))
+    # the index breaks ties by the order chunks were added
+    order=[document["_id"] for document in documents]
+    return sorted(scores.items(), key=lambda item: (-round(item[1], 9), order.index(item[0])))
+
+
+def assertRanked(results, expected):
+    assert [id for id, _ in results]==[id for id, _ in expected]
+    assert [score for _, score in results]==pytest.approx([score for _, score in expected])
+
+
+@pytest.fixture
+def index(tmp_path):
+    index=LexicalIndexModel(str(tmp_path/"lexical.sqlite3"), merge_segments=4)
+    yield index
+    index.close()
+
+
+def test_varints_match_leb128():
+    rng=np.random.default_rng(0)
+    values=[0, 1, 127, 128, 16383, 16384, 2**63-1]+[int(value) for value in rng.integers(0, 2**62, 500)]+[int(value) for value in rng.integers(0, 300, 500)]
+
+    encoded=encodeVarints(values)
+
+    assert encoded==b"".join(leb128(value) for value in values)
+    assert decodeVarints(encoded).tolist()==values
+    assert encodeVarints([])==b"" and decodeVarints(b"").tolist()==[]
+
+
+def test_blobs_round_trip():
+    rng=random.Random(1)
+    lists=[[rng.randint(0, 10**rng.randint(1, 12)) for _ in range(rng.randint(1, 20))] for _ in range(200)]
+
+    blobs=encodeBlobs(lists)
+
+    assert blobs==[encodeVarints(values) for values in lists]
+    assert decodeBlobs(blobs)==lists
+
+
+def test_postings_round_trip():
+    docs=[3, 4, 90, 1000, 1001]
+    positions=[[0], [2, 5, 9], [1], [0, 300, 301], [7, 8]]
+
+    postings=decodePostings(encodePostings(docs, positions))
+
+    assert postings.docs.tolist()==docs
+    assert postings.tfs.tolist()==[len(doc_positions) for doc_positions in positions]
+    assert [postings.positions[postings.offsets[index]:postings.offsets[index+1]].tolist() for index in range(len(docs))]==positions
+
+
+def test_search_scores_are_bm25(index):
+    indexed=documents(random.Random(2), 60)
+    index.add("db", "chunks", indexed)
+
+    results=index.search("db", "chunks", "lazy fox audio", k=10)
+
+    assertRanked(results, bm25(indexed, "lazy fox audio")[:10])
+
+
+def test_merged_segments_search_like_one_segment(tmp_path, index):
+    rng=random.Random(3)
+    indexed=[]
+    for batch in range(21):
+        batch_documents=documents(rng, rng.randint(1, 8), start=len(indexed))
+        index.add("db", "chunks", batch_documents)
+        indexed.extend(batch_documents)
+    single=LexicalIndexModel(str(tmp_path/"single.sqlite3"))
+    single.add("db", "chunks", indexed)
+
+    # 21 segments with 4 a level: one of level 2, one of level 1, one of level 0
+    assert index.stats()["segments"]==3
+    for query in ("quick", "brown dog", "vector search the"):
+        assertRanked(index.search("db", "chunks", query, k=8), single.search("db", "chunks", query, k=8))
+    single.close()
+
+
+def test_removed_chunks_are_not_found_and_dropped_at_merge(index):
+    indexed=documents(random.Random(4), 12)
+    for start in range(0, 12, 4):
+        index.add("db", "chunks", indexed[start:start+4])
+    before=index.stats()["posting_bytes"]
+
+    index.removeFiles("db", "chunks", ["file-0"])
+    index.removeChunks("db", "chunks", ["chunk-1"])
+
+    live=[document for document in indexed if document["id"]!="file-0" and document["_id"]!="chunk-1"]
+    found={id for id, _ in index.search("db", "chunks", " ".join(WORDS), k=100)}
+    assert found=={document["_id"] for document in live}
+    assertRanked(index.search("db", "chunks", "lazy dog", k=100), bm25(live, "lazy dog"))
+
+    index.add("db", "chunks", documents(random.Random(5), 1, start=100))
+    assert index.stats()["segments"]==1
+    assert index.stats()["chunks"]==len(live)+1
+    assert index.stats()["posting_bytes"]<before
+
+
+def test_phrases_must_match_consecutive_words(index):
+    index.add("db", "chunks", [
+        {"_id":"in-order", "id":"file-1", "text":"the quick brown fox"},
+        {"_id":"reversed", "id":"file-1", "text":"the brown quick fox"},
+        {"_id":"apart", "id":"file-2", "text":"quick the brown fox"},
+    ])
+
+    assert [id for id, _ in index.search("db", "chunks", '"quick brown"')]==["in-order"]
+    assert {id for id, _ in index.search("db", "chunks", 'fox "brown quick"')}=={"reversed"}
+    assert {id for id, _ in index.search("db", "chunks", "quick brown")}=={"in-order", "reversed", "apart"}
+    assert [id for id, _ in index.search("db", "chunks", "quick brown", file_id="file-2")]==["apart"]
+    assert index.search("db", "chunks", '"fox quick"')==[]
+
+
+def test_another_process_writes_are_seen(tmp_path, index):
+    index.add("db", "chunks", [{"_id":"first", "id":"file-1", "text":"audio vector"}])
+    assert [id for id, _ in index.search("db", "chunks", "audio")]==["first"]
+    other=LexicalIndexModel(index.path)
+
+    other.add("db", "chunks", [{"_id":"second", "id":"file-1", "text":"audio audio"}])
+    other.removeChunks("db", "chunks", ["first"])
+    other.close()
+
+    assert [id for id, _ in index.search("db", "chunks", "audio")]==["second"]
+
+
+def test_drop_forgets_the_collection(index):
+    index.add("db", "chunks", [{"_id":"first", "id":"file-1", "text":"audio"}])
+    index.add("db", "other", [{"_id":"second", "id":"file-1", "text":"audio"}])
+
+    index.drop("db", "chunks")
+
+    assert index.search("db", "chunks", "audio")==[]
+    assert [id for id, _ in index.search("db", "other", "audio")]==["second"]
+
+
+def test_reciprocal_rank_fusion():
+    fused=reciprocalRankFusion([["a", "b", "c"], ["c", "a"]], k=60)
+
+    assert [id for id, _ in fused]==["a", "c", "b"]
+    assert dict(fused)==pytest.approx({"a":1/61+1/62, "c":1/63+1/61, "b":1/62})
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from audio_vectorize.Model__TextChunker_Recursive import TextChunkerModel, Transcript
+
+
+WORDS=["the", "a", "audio", "vector", "chunk", "embedding", "transcript", "searching", "ok", "supercalifragilisticexpialidocious"]
+
+
+def prose(rng:random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 400)))+rng.choice(["", " ", "\n"])
+
+
+def mixed(rng:random.Random) -> str:
+    parts=[rng.choice(WORDS+["\n", "\n\n", "  ", "\n\n\n", "x"*rng.randint(1, 80), " "]) for _ in range(rng.randint(0, 200))]
+    return rng.choice(["", " "]).join(parts)
+
+
+def cases(seed:int, count:int):
+    rng=random.Random(seed)
+    for _ in range(count):
+        size=rng.choice([10, 15, 40, 100, 300])
+        yield rng.choice([prose, mixed])(rng), size, rng.choice([0, 0, size//10, size//3])
+
+
+def transcript(rng:random.Random) -> Transcript:
+    parts=[]
+    position_ms=0
+    for _ in range(rng.randint(1, 30)):
+        start_ms=position_ms+rng.randint(0, 500)
+        position_ms=start_ms+rng.randint(200, 9000)
+        parts.append((" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40))), start_ms, position_ms))
+    return Transcript.join(parts)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_chunks_match_langchain(seed):
+    for text, size, overlap in cases(seed, 150):
+        splitter=RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
+
+        chunks=list(TextChunkerModel(size, overlap).chunks(text))
+
+        assert [chunk.text for chunk in chunks]==splitter.split_text(text), (text, size, overlap)
+        assert [chunk.text for chunk in chunks]==[document.page_content for document in splitter.split_documents(splitter.create_documents([text]))]
+        assert all(text[chunk.start:chunk.end]==chunk.text for chunk in chunks)
+
+
+def test_overlap_larger_than_chunk_size_is_rejected():
+    with pytest.raises(Exception, match="must be smaller"):
+        TextChunkerModel(10, 10)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_transcript_chunks_map_to_the_audio_they_were_spoken_in(seed):
+    rng=random.Random(seed)
+    for _ in range(50):
+        text=transcript(rng)
+        size=rng.choice([15, 40, 100, 300])
+        overlap=rng.choice([0, size//4])
+
+        chunks=list(TextChunkerModel(size, overlap).chunks(text))
+
+        assert [chunk.text for chunk in chunks]==RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap).split_text(text)
+        for chunk in chunks:
+            assert text[chunk.start:chunk.end]==chunk.text
+            spoken=[segment for segment in text.segments if segment[0]<chunk.end and segment[1]>chunk.start]
+            assert text.audioRange(chunk.start, chunk.end)==(spoken[0][2], spoken[-1][3])
+
+
+def test_transcript_join_and_round_trip():
+    text=Transcript.join([("hello there", 0, 1200), ("general", 1500, 2100), ("kenobi", 2300, 3000)])
+
+    assert text=="hello there general kenobi"
+    assert text.segments==[(0, 11, 0, 1200), (12, 19, 1500, 2100), (20, 26, 2300, 3000)]
+    assert text.audioRange(6, 15)==(0, 2100)
+    assert text.audioRange(20, 26)==(2300, 3000)
+    assert Transcript.loads(text.dumps()).segments==text.segments
+    assert Transcript.loads("plain cached text").audioRange(0, 5) is None
@@ -0,0 +1,75 @@
+import multiprocessing
+
+from audio_vectorize.Model__TranscriptionCache_SQLite import TranscriptionCacheModel
+
+
+def entry(index:int) -> str:
+    return f"transcript {index} "*20
+
+
+def fill(path:str, worker:int, count:int, max_bytes:int):
+    cache=TranscriptionCacheModel(path, max_bytes=max_bytes)
+    for index in range(count):
+        cache.put(f"{worker}-{index}", entry(index))
+    cache.close()
+
+
+def test_get_put_and_replace(tmp_path):
+    cache=TranscriptionCacheModel(str(tmp_path/"cache.sqlite3"))
+
+    assert cache.get("missing") is None
+    cache.put("key", "first")
+    cache.put("key", "second")
+
+    assert cache.get("key")=="second"
+    stats=cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"])==(1, 1, 1, len("key")+len("second"))
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    size=len("k0")+len(entry(0))
+    cache=TranscriptionCacheModel(str(tmp_path/"cache.sqlite3"), max_bytes=size*3)
+    for index in range(3):
+        cache.put(f"k{index}", entry(0))
+    cache.get("k0")
+
+    cache.put("k3", entry(0))
+
+    assert cache.get("k1") is None
+    assert all(cache.get(key) for key in ("k0", "k2", "k3"))
+    assert cache.stats()["evictions"]==1
+    cache.close()
+
+
+def test_two_instances_share_the_size_limit(tmp_path):
+    path=str(tmp_path/"cache.sqlite3")
+    max_bytes=(len("0-000")+len(entry(0)))*40
+    first=TranscriptionCacheModel(path, max_bytes=max_bytes)
+    second=TranscriptionCacheModel(path, max_bytes=max_bytes)
+
+    for index in range(60):
+        (first if index%2 else second).put(f"{index%2}-{index:03d}", entry(0))
+
+    assert first.stats()["bytes"]==second.stats()["bytes"]<=max_bytes
+    assert first.stats()["entries"]==40
+    first.close()
+    second.close()
+
+
+def test_processes_share_the_size_limit(tmp_path):
+    path=str(tmp_path/"cache.sqlite3")
+    max_bytes=200_000
+    TranscriptionCacheModel(path, max_bytes=max_bytes).close()
+    context=multiprocessing.get_context("spawn")
+    workers=[context.Process(target=fill, args=(path, worker, 300, max_bytes)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    cache=TranscriptionCacheModel(path, max_bytes=max_bytes)
+    stats=cache.stats()
+    cache.close()
+    assert all(worker.exitcode==0 for worker in workers)
+    assert max_bytes-2000<stats["bytes"]<=max_bytes
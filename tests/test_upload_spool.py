@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import numpy as np
+import pytest
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from audio_vectorize.Model__UploadSpool_Disk import UploadSpoolModel, UploadTooLarge
+
+
+def upload(name:str, data:bytes, declared:bool=True) -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data) if declared else None, filename=name, headers=Headers({"content-type":"audio/mpeg"}))
+
+
+def payload(size:int, seed:int=0) -> bytes:
+    return np.random.default_rng(seed).bytes(size)
+
+
+@pytest.fixture
+def spool_directory(tmp_path):
+    return str(tmp_path/"spool")
+
+
+def test_spooled_copies_are_hashed_in_blocks(spool_directory):
+    spool=UploadSpoolModel(spool_directory, block_size=1000)
+    data=[payload(10_500, seed) for seed in range(3)]+[b""]
+
+    spooled=asyncio.run(spool.spool([upload(f"{index}.mp3", part) for index, part in enumerate(data)], "job"))
+
+    assert [os.path.basename(item.path) for item in spooled]==["job-0", "job-1", "job-2", "job-3"]
+    assert [(item.size, item.sha256) for item in spooled]==[(len(part), hashlib.sha256(part).hexdigest()) for part in data]
+    reopened=spool.open(spooled[1])
+    assert (reopened.filename, reopened.size, reopened.content_type)==("1.mp3", 10_500, "audio/mpeg")
+    assert asyncio.run(reopened.read())==data[1]
+    asyncio.run(reopened.close())
+
+    spool.remove(spooled)
+    assert os.listdir(spool_directory)==[]
+
+
+def test_declared_sizes_over_the_limits_are_rejected_before_copying(spool_directory):
+    spool=UploadSpoolModel(spool_directory, max_file_bytes=5000, max_request_bytes=8000)
+
+    with pytest.raises(UploadTooLarge, match="File of 6000 bytes"):
+        asyncio.run(spool.spool([upload("big.mp3", payload(6000))], "job"))
+    with pytest.raises(UploadTooLarge, match="Request of 9000 bytes"):
+        asyncio.run(spool.spool([upload("one.mp3", payload(4500)), upload("two.mp3", payload(4500))], "job"))
+    assert os.listdir(spool_directory)==[]
+
+
+def test_undeclared_sizes_are_limited_while_copying(spool_directory):
+    spool=UploadSpoolModel(spool_directory, max_file_bytes=5000, max_request_bytes=8000, block_size=1024)
+
+    with pytest.raises(UploadTooLarge, match="big.mp3"):
+        asyncio.run(spool.spool([upload("big.mp3", payload(5001), declared=False)], "job"))
+    # the second file fits the per-file limit but not what is left of the request's
+    with pytest.raises(UploadTooLarge, match="two.mp3"):
+        asyncio.run(spool.spool([upload("one.mp3", payload(4000), declared=False), upload("two.mp3", payload(4001), declared=False)], "job"))
+    assert os.listdir(spool_directory)==[]
+
+    spooled=asyncio.run(spool.spool([upload("one.mp3", payload(4000), declared=False), upload("two.mp3", payload(4000), declared=False)], "job"))
+    assert [item.size for item in spooled]==[4000, 4000]
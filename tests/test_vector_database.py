@@ -0,0 +1,227 @@
+import contextlib
+
+import mongomock
+import pytest
+from pymongo.errors import OperationFailure
+
+from audio_vectorize.Model__VectorDatabase_MongoDBAtlas import MongoDBAtlas
+
+
+CHUNK_SIZE=60
+CHUNK_OVERLAP=0
+
+
+class CountingEmbeddings():
+    def __init__(self):
+        self.embedded=[]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+
+class RecordingCollection():
+    """
+        mongomock collection that takes a session argument, mongomock raises on any, and
+        records every call with the session it was given
+    """
+    def __init__(self, collection, calls):
+        self.collection=collection
+        self.calls=calls
+        self.name=collection.name
+
+    def __getattr__(self, name):
+        method=getattr(self.collection, name)
+
+        def call(*args, **kwargs):
+            self.calls.append((name, kwargs.pop("session", None)))
+            return method(*args, **kwargs)
+        return call
+
+
+class TransactionClient():
+    """
+        mongomock client with sessions and transactions, like a replica set
+    """
+    def __init__(self):
+        self.client=mongomock.MongoClient()
+        self.calls=[]
+        self.session=object()
+
+    def __getitem__(self, database):
+        return TransactionDatabase(self.client[database], self.calls)
+
+    @contextlib.contextmanager
+    def _session(self):
+        yield self
+
+    def start_session(self):
+        return self._session()
+
+    def start_transaction(self):
+        return contextlib.nullcontext()
+
+
+class TransactionDatabase():
+    def __init__(self, database, calls):
+        self.database=database
+        self.calls=calls
+
+    def __getitem__(self, collection):
+        return RecordingCollection(self.database[collection], self.calls)
+
+
+def paragraph(word, count=12):
+    return " ".join(f"{word}{index}" for index in range(count))
+
+
+TEXT="\n\n".join(paragraph(word) for word in ("alpha", "beta", "gamma", "delta"))
+
+
+def update(vector_database, text, embeddings=None):
+    return vector_database.Update_Files(text, "file-1", "db", "chunks", embeddings or CountingEmbeddings(), "index", CHUNK_SIZE, CHUNK_OVERLAP)
+
+
+def stored(vector_database):
+    return sorted((document["start_char"], document["text"]) for document in vector_database.client["db"]["chunks"].find({"id":"file-1"}))
+
+
+def expected(text):
+    fresh=MongoDBAtlas(None, client=mongomock.MongoClient())
+    fresh.Insert_Files(text, {"id":"file-1"}, "db", "chunks", CountingEmbeddings(), "index", CHUNK_SIZE, CHUNK_OVERLAP)
+    return stored(fresh)
+
+
+@pytest.fixture
+def vector_database():
+    vector_database=MongoDBAtlas(None, client=mongomock.MongoClient())
+    vector_database.Insert_Files(TEXT, {"id":"file-1"}, "db", "chunks", CountingEmbeddings(), "index", CHUNK_SIZE, CHUNK_OVERLAP)
+    return vector_database
+
+
+def test_update_unchanged_file_embeds_nothing(vector_database):
+    embeddings=CountingEmbeddings()
+    before=stored(vector_database)
+
+    result=update(vector_database, TEXT, embeddings)
+
+    assert (result["inserted"], result["deleted"], result["moved"])==(0, 0, 0)
+    assert result["unchanged"]==len(before)
+    assert embeddings.embedded==[]
+    assert stored(vector_database)==before
+
+
+def test_update_embeds_only_changed_chunks(vector_database):
+    embeddings=CountingEmbeddings()
+    text=TEXT.replace(paragraph("gamma"), paragraph("epsilon"))
+
+    result=update(vector_database, text, embeddings)
+
+    assert result["inserted"]==result["deleted"]>0
+    assert all("epsilon" in chunk for chunk in embeddings.embedded)
+    assert stored(vector_database)==expected(text)
+
+
+def test_update_moves_shifted_chunks_without_embedding(vector_database):
+    embeddings=CountingEmbeddings()
+    text=paragraph("zeta")+"\n\n"+TEXT
+
+    result=update(vector_database, text, embeddings)
+
+    assert result["moved"]==result["unchanged"]>0
+    assert all("zeta" in chunk for chunk in embeddings.embedded)
+    assert stored(vector_database)==expected(text)
+
+
+def test_update_shrinking_file_deletes_stale_chunks(vector_database):
+    text=TEXT.split("\n\n")[0]
+
+    result=update(vector_database, text)
+
+    assert result["inserted"]==0
+    assert result["deleted"]>0
+    assert stored(vector_database)==expected(text)
+
+
+def test_swap_runs_every_write_in_one_transaction():
+    client=TransactionClient()
+    vector_database=MongoDBAtlas(None, client=client)
+    vector_database.Insert_Files(TEXT, {"id":"file-1"}, "db", "chunks", CountingEmbeddings(), "index", CHUNK_SIZE, CHUNK_OVERLAP)
+    text=paragraph("zeta")+"\n\n"+TEXT.replace(paragraph("gamma"), paragraph("epsilon"))
+    del client.calls[:]
+
+    update(vector_database, text)
+
+    writes=[(name, session) for name, session in client.calls if name in ("insert_many", "bulk_write", "update_one", "delete_many")]
+    assert [name for name, _ in writes][0]=="insert_many"
+    assert [name for name, _ in writes][-1]=="delete_many"
+    assert any(name in ("bulk_write", "update_one") for name, _ in writes)
+    assert all(session is client for _, session in writes)
+    assert vector_database.transactions_supported
+    assert stored(vector_database)==expected(text)
+
+
+def test_swap_without_transactions_inserts_before_deleting(vector_database):
+    calls=[]
+    collection=RecordingCollection(vector_database.client["db"]["chunks"], calls)
+    stale=[document["_id"] for document in vector_database.client["db"]["chunks"].find({})][:2]
+
+    vector_database._Swap_Chunks(collection, stale, [{"id":"file-1","text":"new"}], [(stale[0], {"start_char":0})])
+
+    assert not vector_database.transactions_supported
+    assert [name for name, _ in calls if name!="update_one"]==["insert_many", "bulk_write", "delete_many"]
+    assert all(session is None for _, session in calls)
+    assert vector_database.client["db"]["chunks"].count_documents({"_id":{"$in":stale}})==0
+
+
+def test_update_falls_back_when_server_has_no_transactions(vector_database):
+    def start_session():
+        raise OperationFailure("Transaction numbers are only allowed on a replica set member or mongos", code=20)
+    vector_database.client.start_session=start_session
+    text=TEXT.replace(paragraph("beta"), paragraph("theta"))
+
+    result=update(vector_database, text)
+
+    assert result["inserted"]>0
+    assert not vector_database.transactions_supported
+    assert stored(vector_database)==expected(text)
+
+
+def test_swap_raises_other_server_errors(vector_database):
+    def start_session():
+        raise OperationFailure("not authorized", code=13)
+    vector_database.client.start_session=start_session
+
+    with pytest.raises(OperationFailure):
+        vector_database._Swap_Chunks(vector_database.client["db"]["chunks"], [], [{"id":"file-1","text":"new"}])
+    assert vector_database.transactions_supported
+
+
+def test_resume_keeps_written_chunks_and_drops_orphans():
+    vector_database=MongoDBAtlas(None, client=mongomock.MongoClient())
+    chunks=vector_database.client["db"]["chunks"]
+    # a failed attempt wrote one chunk the retry's chunking also has and one it no longer has
+    vector_database.Bulk_Insert_Files([(TEXT, {"id":"file-1"})], "db", "chunks", CountingEmbeddings(), CHUNK_SIZE, CHUNK_OVERLAP)
+    kept=chunks.find_one({}, sort=[("start_char", 1)])["_id"]
+    chunks.delete_many({"_id":{"$ne":kept}})
+    orphan=chunks.insert_one({"id":"file-1", "text":"alpha0 alpha1", "content_hash":"other-chunking", "start_char":0, "end_char":13}).inserted_id
+    embeddings=CountingEmbeddings()
+
+    result=vector_database.Bulk_Insert_Files([(TEXT, {"id":"file-1"})], "db", "chunks", embeddings, CHUNK_SIZE, CHUNK_OVERLAP, resume_ids=["file-1"])
+
+    assert result["deleted"]==1
+    assert chunks.count_documents({"_id":orphan})==0
+    assert chunks.count_documents({"_id":kept})==1
+    assert len(embeddings.embedded)==len(expected(TEXT))-1
+    assert stored(vector_database)==expected(TEXT)
+
+
+def test_resume_moves_kept_chunks_of_a_shifted_transcript(vector_database):
+    text=paragraph("zeta")+"\n\n"+TEXT
+    embeddings=CountingEmbeddings()
+
+    result=vector_database.Bulk_Insert_Files([(text, {"id":"file-1"})], "db", "chunks", embeddings, CHUNK_SIZE, CHUNK_OVERLAP, resume_ids=["file-1"])
+
+    assert result["deleted"]==0
+    assert all("zeta" in chunk for chunk in embeddings.embedded)
+    assert stored(vector_database)==expected(text)
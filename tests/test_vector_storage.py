@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from audio_vectorize.Model__VectorIndex_NumPy import CollectionIndex, VectorIndexModel
+from audio_vectorize.Model__VectorStorage_Quantized import VectorStorageModel
+
+
+DIMENSION=32
+
+
+@pytest.fixture
+def vectors():
+    # near duplicates, int8 rounding is enough to reorder them
+    rng=np.random.default_rng(0)
+    base=rng.normal(size=DIMENSION)
+    return (base+rng.normal(scale=0.02, size=(40, DIMENSION))).astype(np.float32)
+
+
+def normalized(vector):
+    return vector/np.linalg.norm(vector)
+
+
+def cosines(vectors, query):
+    return (vectors@query)/np.linalg.norm(vectors, axis=1)
+
+
+def index(storage, vectors):
+    documents=[{"_id":str(position), "id":"file-1", "text":f"chunk {position}", "content_hash":str(position)} for position in range(len(vectors))]
+    matrix, inverse_norms=storage.pack(list(storage.dequantize(*storage.quantize(vectors))))
+    return CollectionIndex(0, matrix, np.array(["file-1"]*len(vectors)), documents, inverse_norms)
+
+
+def test_rescore_uses_exact_vectors_of_every_candidate(vectors):
+    storage=VectorStorageModel("int8", exact=lambda hashes: [vectors[int(hash)] for hash in hashes])
+    query=normalized(vectors[0]+vectors[1])
+
+    rescored=storage.rescore(query, [str(position) for position in range(10)], [None]*10, np.zeros(10))
+
+    assert rescored==pytest.approx(cosines(vectors[:10], query), abs=1e-6)
+
+
+def test_candidates_missing_from_the_cache_are_embedded(vectors):
+    embedded=[]
+
+    def embed(texts):
+        embedded.extend(texts)
+        return [vectors[int(text.split()[1])].tolist() for text in texts]
+    storage=VectorStorageModel("int8", exact=lambda hashes: [vectors[int(hash)] if int(hash)%2 else None for hash in hashes], embed=embed)
+    query=normalized(vectors[3])
+
+    rescored=storage.rescore(query, [str(position) for position in range(6)], [f"chunk {position}" for position in range(6)], np.zeros(6))
+
+    assert embedded==["chunk 0", "chunk 2", "chunk 4"]
+    assert rescored==pytest.approx(cosines(vectors[:6], query), abs=1e-6)
+
+
+def test_quantized_scores_are_kept_unless_every_candidate_is_exact(vectors):
+    def failing(texts):
+        raise ConnectionError("embedding server unreachable")
+    partial=lambda hashes: [vectors[int(hash)] if hash!="2" else None for hash in hashes]
+    quantized=np.linspace(0.9, 0.5, 5)
+    hashes=[str(position) for position in range(5)]
+    query=normalized(vectors[4])
+
+    assert VectorStorageModel("int8", exact=partial).rescore(query, hashes, [f"chunk {position}" for position in range(5)], quantized).tolist()==pytest.approx(quantized.tolist())
+    assert VectorStorageModel("int8", exact=partial, embed=failing).rescore(query, hashes, [f"chunk {position}" for position in range(5)], quantized).tolist()==pytest.approx(quantized.tolist())
+    # a candidate without text cannot be embedded either
+    assert VectorStorageModel("int8", exact=partial, embed=lambda texts: [vectors[0]]*len(texts)).rescore(query, hashes, [None]*5, quantized).tolist()==pytest.approx(quantized.tolist())
+
+
+def test_local_search_ranks_by_exact_cosine(vectors):
+    query=vectors[7]+vectors[8]
+    expected=np.argsort(-cosines(vectors, normalized(query)))[:5].tolist()
+    embed=lambda texts: [vectors[int(text.split()[1])] for text in texts]
+    storage=VectorStorageModel("int8", oversample=8, exact=lambda hashes: [vectors[int(hash)] if int(hash)<20 else None for hash in hashes], embed=embed)
+
+    results=VectorIndexModel(storage=storage).search(index(storage, vectors), query.tolist(), k=5)
+
+    assert [int(result["_id"]) for result in results]==expected
+    assert [result["score"] for result in results]==pytest.approx(cosines(vectors[expected], normalized(query)).tolist(), abs=1e-6)
+
+
+def test_local_search_without_every_exact_vector_keeps_the_quantized_ranking(vectors):
+    query=(vectors[7]+vectors[8]).tolist()
+    quantized=VectorStorageModel("int8")
+    partial=VectorStorageModel("int8", oversample=8, exact=lambda hashes: [vectors[int(hash)] if int(hash)<20 else None for hash in hashes])
+    collection=index(quantized, vectors)
+
+    expected=VectorIndexModel(storage=quantized).search(collection, query, k=5)
+    results=VectorIndexModel(storage=partial).search(collection, query, k=5)
+
+    assert [result["_id"] for result in results]==[result["_id"] for result in expected]